@@ -0,0 +1,240 @@
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+import price_store
+import loader
+import instrumentation
+
+# How missing days are treated once prices are on the calendar: 'mask' leaves them
+# missing, 'ffill' carries the last price forward for up to `max_fill` days
+POLICIES = ('mask', 'ffill')
+MAX_FILL = 3
+
+# A tick is an outlier when its log return jumps more than OUTLIER_Z robust standard
+# deviations (median absolute deviation) away from the token's median return and the
+# next return jumps back the other way
+OUTLIER_Z = 8.0
+
+# Scales the median absolute deviation to a standard deviation for normal data
+MAD_SCALE = 1.4826
+
+SUMMARY_COLUMNS = ['first', 'last', 'observed', 'missing', 'longest_gap', 'filled', 'outliers', 'duplicates']
+
+
+def canonical_calendar(index, start=None, end=None):
+    """Contiguous daily UTC calendar from `start` (or the first date) to `end` (or
+    the last date)."""
+    if start is None and len(index) == 0:
+        return loader.days_to_index([])
+    first = pd.Timestamp(start if start is not None else index.min()).floor('D')
+    last = pd.Timestamp(end if end is not None else index.max()).floor('D')
+    return pd.DatetimeIndex(pd.date_range(first, last, freq='D'), name='timestamp')
+
+
+def valid_bounds(values):
+    """Row positions of the first and last finite value of every column (-1 for an
+    empty column)."""
+    valid = np.isfinite(values)
+    any_valid = valid.any(axis=0)
+    first = np.where(any_valid, valid.argmax(axis=0), -1)
+    last = np.where(any_valid, len(values) - 1 - valid[::-1].argmax(axis=0), -1)
+    return first, last
+
+
+def window_mask(values):
+    """True for the cells between every column's first and last finite value."""
+    first, last = valid_bounds(values)
+    rows = np.arange(len(values))[:, None]
+    return (rows >= first) & (rows <= last)
+
+
+def longest_runs(mask):
+    """Length of the longest run of True in every column."""
+    if len(mask) == 0:
+        return np.zeros(mask.shape[1], dtype='int64')
+    counts = np.cumsum(mask, axis=0)
+    # Count at the last False above each cell; subtracting it restarts the run
+    resets = np.maximum.accumulate(np.where(mask, 0, counts), axis=0)
+    return (counts - resets).max(axis=0)
+
+
+def outlier_mask(values, z=OUTLIER_Z):
+    """True for isolated bad ticks: non-positive prices, and prices whose log return
+    from the previous observation and to the next one are both more than `z` robust
+    standard deviations from the token's median, with opposite signs.
+
+    A sustained move (a jump that does not revert) is not flagged.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logs = np.where(values > 0, np.log(values), np.nan)
+    bad = np.isfinite(values) & (values <= 0)
+    if len(values) < 3:
+        return bad
+
+    # Log returns between consecutive observations of each token, so a gap does not
+    # hide the tick after it
+    filled = pd.DataFrame(logs).ffill().to_numpy()
+    moves = np.full(logs.shape, np.nan)
+    moves[1:] = logs[1:] - filled[:-1]
+    with warnings.catch_warnings():
+        # Tokens without any returns give an all-NaN median
+        warnings.simplefilter('ignore', RuntimeWarning)
+        median = np.nanmedian(moves, axis=0)
+        spread = MAD_SCALE * np.nanmedian(np.abs(moves - median), axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = (moves - median) / spread
+    scores = np.where(spread > 0, scores, 0.0)
+
+    # Score of the return out of each tick: the next observation's return
+    scores_out = pd.DataFrame(np.where(np.isfinite(moves), scores, np.nan)).shift(-1).bfill().to_numpy()
+    spike = (np.abs(scores) > z) & (np.abs(scores_out) > z) & (np.sign(scores) != np.sign(scores_out))
+    return bad | (spike & np.isfinite(logs))
+
+
+class QualityReport:
+    """Result of the alignment stage: a per-token summary and the flagged cells.
+
+    `summary` has one row per token with its valid window (`first`, `last`),
+    the observed days, the missing days inside the window, the longest gap, the
+    days filled by the policy, the outlier ticks and the duplicate rows seen in
+    the store. `issues` lists every flagged (date, symbol, kind) cell.
+    """
+
+    def __init__(self, summary, issues):
+        self.summary = summary
+        self.issues = issues
+
+    @property
+    def clean(self):
+        return self.issues.empty
+
+    def print_summary(self):
+        affected = self.summary[self.summary[['missing', 'outliers', 'duplicates']].sum(axis=1) > 0]
+        if affected.empty:
+            print(f"Data quality: no gaps, outliers or duplicates in {len(self.summary)} tokens.")
+            return
+        print(f"Data quality: {len(affected)} of {len(self.summary)} tokens have gaps, outliers or duplicates:")
+        print(affected.to_string())
+
+
+def flagged(mask, index, columns, kind):
+    rows, cols = np.nonzero(mask)
+    return pd.DataFrame({'date': index[rows], 'symbol': np.asarray(columns, dtype=object)[cols], 'kind': kind})
+
+
+def align(prices, policy='mask', max_fill=MAX_FILL, mask_outliers=False, z=OUTLIER_Z,
+          start=None, end=None, duplicates=None):
+    """Put a date x token price matrix on the canonical daily calendar and check it.
+
+    Every step is a whole-matrix array operation, so the cost does not depend on
+    looping over tokens. Missing days are masked (NaN) or, with policy 'ffill',
+    filled from the last price for up to `max_fill` days; nothing is filled
+    before a token's first or after its last price, so each token keeps its own
+    valid window. With `mask_outliers` flagged ticks are set to NaN before the
+    policy is applied. `duplicates` is a Series of duplicate row counts per
+    token (see duplicate_rows), included in the report.
+
+    Returns (aligned prices, QualityReport).
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown fill policy: {policy}")
+    with instrumentation.stage('align') as stage:
+        calendar = canonical_calendar(prices.index, start, end)
+        aligned = prices.reindex(calendar)
+        # Float32 matrices (the matrix store) stay float32
+        values = aligned.to_numpy(copy=True)
+        if values.dtype.kind != 'f':
+            values = values.astype('float64')
+        stage.add(rows=values.shape[0], tokens=values.shape[1])
+
+        outliers = outlier_mask(values, z)
+        if mask_outliers:
+            values[outliers] = np.nan
+        inside = window_mask(values)
+        missing = inside & ~np.isfinite(values)
+
+        filled = np.zeros_like(missing)
+        if policy == 'ffill' and max_fill > 0:
+            carried = pd.DataFrame(values).ffill(limit=max_fill).to_numpy()
+            filled = missing & np.isfinite(carried)
+            values = np.where(inside, carried, np.nan)
+
+        first, last = valid_bounds(np.where(inside, values, np.nan))
+        present = first >= 0
+        dates = np.asarray(calendar)
+        nat = np.datetime64('NaT')
+        summary = pd.DataFrame({
+            'first': np.where(present, dates[np.maximum(first, 0)] if len(dates) else nat, nat),
+            'last': np.where(present, dates[np.maximum(last, 0)] if len(dates) else nat, nat),
+            'observed': (inside & ~missing).sum(axis=0),
+            'missing': missing.sum(axis=0),
+            'longest_gap': longest_runs(missing),
+            'filled': filled.sum(axis=0),
+            'outliers': outliers.sum(axis=0),
+            'duplicates': 0,
+        }, index=aligned.columns)[SUMMARY_COLUMNS]
+        if duplicates is not None and len(duplicates):
+            summary['duplicates'] = duplicates.reindex(summary.index, fill_value=0).astype('int64')
+        issues = pd.concat([flagged(missing & ~filled, calendar, aligned.columns, 'gap'),
+                            flagged(filled, calendar, aligned.columns, 'filled'),
+                            flagged(outliers, calendar, aligned.columns, 'outlier')], ignore_index=True)
+        stage.add(gaps=int(missing.sum()), outliers=int(outliers.sum()))
+
+    aligned = pd.DataFrame(values, index=calendar, columns=aligned.columns)
+    return aligned, QualityReport(summary, issues.sort_values(['date', 'symbol'], ignore_index=True))
+
+
+def duplicate_rows(conn, symbols=None, start=None, end=None):
+    """Extra rows per token on days that hold more than one daily bar (the loader
+    keeps one of them), counted by SQLite in one grouped query."""
+    where, params = [], []
+    if symbols is not None:
+        symbols = list(symbols)
+        if not symbols:
+            return pd.Series(dtype='int64')
+        where.append(f"symbol IN ({', '.join('?' for _ in symbols)})")
+        params.extend(symbols)
+    if start is not None:
+        where.append("day >= ?")
+        params.append(loader.to_epoch_day(start))
+    if end is not None:
+        where.append("day <= ?")
+        params.append(loader.to_epoch_day(end))
+    query = f"SELECT symbol, COUNT(*) - 1 FROM {price_store.PRICES_TABLE}"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " GROUP BY symbol, day HAVING COUNT(*) > 1"
+    rows = conn.execute(query, params).fetchall()
+    if not rows:
+        return pd.Series(dtype='int64')
+    return pd.DataFrame(rows, columns=['symbol', 'extra']).groupby('symbol')['extra'].sum()
+
+
+def load_aligned(conn, symbols=None, start=None, end=None, **options):
+    """Read the daily price matrix and its duplicate counts from one snapshot of the
+    store and run them through align()."""
+    with price_store.snapshot(conn):
+        prices = loader.load_price_matrix(conn, symbols, start, end)
+        duplicates = duplicate_rows(conn, symbols, start, end)
+    return align(prices, start=start, end=end, duplicates=duplicates, **options)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the stored daily prices for gaps, duplicates and outlier ticks.')
+    parser.add_argument('--db', default=price_store.DB_PATH, help='Path to the SQLite database')
+    parser.add_argument('--tickers', nargs='+', help='Tokens to check (default: all)')
+    parser.add_argument('--start', help='First date of the calendar (default: first stored date)')
+    parser.add_argument('--end', help='Last date of the calendar (default: last stored date)')
+    parser.add_argument('--z', type=float, default=OUTLIER_Z, help='Robust z-score above which a reverting tick is an outlier')
+    parser.add_argument('--issues', help='Write every flagged cell to this CSV file')
+    args = parser.parse_args()
+
+    conn = price_store.connect(args.db, readonly=True)
+    _, report = load_aligned(conn, args.tickers, args.start, args.end, z=args.z)
+    conn.close()
+    print(report.summary.to_string())
+    report.print_summary()
+    if args.issues:
+        report.issues.to_csv(args.issues, index=False)
+        print(f"{len(report.issues)} flagged cells written to {args.issues}")
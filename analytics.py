@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+import loader
+import backends
+
+# Default smoothing window for the rolling charts
+WINDOW_SIZE = 7
+
+# Date range shown by the event charts and the Breakpoint conference span inside it
+EVENT_WINDOW = ('2023-10-27', '2023-11-06')
+BREAKPOINT_PERIOD = ('2023-10-30', '2023-11-03')
+
+
+# The calculations below run on the configured compute backend (see backends.py)
+
+
+# Daily simple returns (as decimals) of a date x token price matrix
+def daily_returns(prices):
+    return backends.get().returns(prices)
+
+
+# Daily returns as percentages
+def pct_changes(returns):
+    return returns * 100
+
+
+# Rolling average of the daily returns, in percent
+def rolling_mean(returns, window=WINDOW_SIZE):
+    return rolling(returns, window, 'mean') * 100
+
+
+# Rolling standard deviation of the daily returns (volatility), in percent
+def rolling_volatility(returns, window=WINDOW_SIZE):
+    return rolling(returns, window, 'std') * 100
+
+
+# Trailing `window`-row statistic (mean, std, min, max or sum) of every column
+def rolling(frame, window=WINDOW_SIZE, stat='mean'):
+    return backends.get().rolling(frame, window, stat)
+
+
+# Compounded return since the first row
+def cumulative_returns(returns):
+    return backends.get().cumulative(returns)
+
+
+# Pearson correlation of the daily returns; each pair uses the dates where both tokens
+# have data, so a gap in one token does not drop those dates for every other pair
+def correlation(returns):
+    return backends.get().correlation(returns)
+
+
+# Shift every column so that it starts at zero on its first valid row
+def normalize_to_start(frame):
+    return frame - frame.bfill().iloc[0]
+
+
+# Buckets the heatmap can aggregate daily returns into
+BUCKETS = {'daily': None, 'weekly': 'W', 'monthly': 'MS'}
+
+
+# Compound daily returns (as decimals) into weekly or monthly buckets
+def aggregate_returns(returns, bucket='weekly'):
+    freq = BUCKETS[bucket]
+    if freq is None:
+        return returns
+    growth = np.log1p(returns).resample(freq).sum(min_count=1)
+    return np.expm1(growth)
+
+
+# Compound consecutive rows into equal-sized blocks so there are at most `max_rows`
+# rows; each block is labelled with its first date
+def cap_rows(returns, max_rows):
+    n_rows, n_cols = returns.shape
+    if n_rows <= max_rows:
+        return returns
+    step = -(-n_rows // max_rows)
+    n_blocks = -(-n_rows // step)
+    growth = np.full((n_blocks * step, n_cols), np.nan)
+    growth[:n_rows] = np.log1p(returns.to_numpy(dtype='float64'))
+    growth = growth.reshape(n_blocks, step, n_cols)
+    valid = np.isfinite(growth).any(axis=1)
+    summed = np.where(valid, np.nansum(growth, axis=1), np.nan)
+    return pd.DataFrame(np.expm1(summed), index=returns.index[::step], columns=returns.columns)
+
+
+# Order tokens by a summary of their returns (largest first)
+def sort_tokens(returns, by='mean'):
+    if by is None or by == 'name':
+        return returns[sorted(returns.columns)]
+    metrics = {
+        'mean': lambda r: r.mean(),
+        'volatility': lambda r: r.std(),
+        'cumulative': lambda r: np.expm1(np.log1p(r).sum()),
+        'last': lambda r: r.ffill().iloc[-1],
+    }
+    return returns[metrics[by](returns).sort_values(ascending=False, na_position='last').index]
+
+
+# Apply a column-wise calculation on a contiguous daily calendar, so a token's result
+# only depends on its own bars (a missing day is a gap, not a skipped row), then
+# return to the original dates
+def on_daily_calendar(fn, prices):
+    if prices.empty:
+        return fn(prices)
+    return fn(prices.asfreq('D')).reindex(prices.index)
+
+
+# Rows of `frame` inside an inclusive (start, end) date window
+def event_window(frame, window=EVENT_WINDOW):
+    start, end = window
+    return frame.loc[start:end]
+
+
+class AnalysisContext:
+    """Loads the price matrix once and shares the derived frames between outputs.
+
+    Every property is computed on first use and cached, so asking for several
+    charts reads the database once and computes the daily returns once. Results
+    that persist between runs come from the pipeline's MetricCache instead.
+    """
+
+    def __init__(self, prices):
+        self.prices = prices
+        self._cache = {}
+
+    def _get(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    # Per-token metric `fn(prices)`, computed on the daily calendar
+    def _per_symbol(self, key, fn):
+        return self._get(key, lambda: on_daily_calendar(fn, self.prices))
+
+    @property
+    def returns(self):
+        return self._per_symbol('returns', daily_returns)
+
+    @property
+    def pct_changes(self):
+        return self._get('pct_changes', lambda: pct_changes(self.returns))
+
+    @property
+    def cumulative_returns(self):
+        return self._per_symbol('cumulative_returns', lambda p: cumulative_returns(daily_returns(p)))
+
+    @property
+    def correlation(self):
+        return self._get('correlation', lambda: correlation(self.returns))
+
+    def rolling_mean(self, window=WINDOW_SIZE):
+        return self._per_symbol(('rolling_mean', window), lambda p: rolling_mean(daily_returns(p), window))
+
+    def rolling_volatility(self, window=WINDOW_SIZE):
+        return self._per_symbol(('rolling_volatility', window),
+                                lambda p: rolling_volatility(daily_returns(p), window))
+
+
+# Build a context straight from the loader
+def load_context(conn, symbols=None, start=None, end=None):
+    return AnalysisContext(loader.load_price_matrix(conn, symbols, start, end))
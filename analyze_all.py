@@ -0,0 +1,144 @@
+import argparse
+import loader
+import analytics
+import charts
+import render
+import metric_cache
+import matrix_store
+import instrumentation
+import price_store
+import alignment
+import pipeline
+import backends
+
+
+# Each output declares its chart data as a pipeline plan on the shared price source,
+# so the database is read once and the steps the outputs share (the daily returns)
+# are computed once however many outputs are requested. Outputs only describe the
+# chart; rendering happens in render.py.
+def heatmap_output(prices, window_size, heatmap_mode='auto', heatmap_bucket='weekly', heatmap_sort='mean', **options):
+    returns = prices.returns()
+    scalable = heatmap_mode == 'scalable' or (heatmap_mode == 'auto' and charts.use_scalable_heatmap(*returns.to_frame().shape))
+    if scalable:
+        return render.RenderJob('scalable_heatmap_chart', returns, charts.HEATMAP_PNG,
+                                bucket=heatmap_bucket, sort_by=heatmap_sort)
+    return render.RenderJob('heatmap_chart', returns.pct().dropna(), charts.HEATMAP_PNG)
+
+
+def correlation_output(prices, window_size, **options):
+    return render.RenderJob('correlation_chart', prices.returns().corr(), charts.CORRELATION_PNG)
+
+
+def rolling_mean_output(prices, window_size, **options):
+    return render.RenderJob('rolling_returns_chart', prices.returns().rolling(window_size).mean().pct().dropna(),
+                            charts.rolling_returns_png(window_size), window_size=window_size)
+
+
+def rolling_std_output(prices, window_size, **options):
+    return render.RenderJob('rolling_volatility_chart', prices.returns().rolling(window_size).std().pct().dropna(),
+                            charts.rolling_volatility_png(window_size), window_size=window_size)
+
+
+def daily_output(prices, window_size, **options):
+    return render.RenderJob('daily_returns_chart', prices.returns().pct().dropna().event_window(),
+                            charts.DAILY_RETURNS_PNG)
+
+
+def cumulative_output(prices, window_size, **options):
+    return render.RenderJob('cumulative_returns_chart', prices.returns().cumulative().dropna().event_window().normalize(),
+                            charts.CUMULATIVE_RETURNS_PNG)
+
+
+OUTPUTS = {
+    'heatmap': heatmap_output,
+    'correlation': correlation_output,
+    'rolling_mean': rolling_mean_output,
+    'rolling_std': rolling_std_output,
+    'daily': daily_output,
+    'cumulative': cumulative_output,
+}
+
+
+# Load the price matrix once and render every requested output from it. Daily prices
+# are read from the daily table, or resampled from intraday bars when `interval` is an
+# intraday one. Prices are put on the daily calendar by the alignment stage first (gaps
+# masked or forward-filled per `fill_policy`), and its quality report is printed. With a
+# MetricCache, derived metrics are only recomputed for tokens whose prices changed.
+# Charts are rendered headless in a process pool and skipped when their inputs are
+# unchanged; with show=True they are drawn one by one in this process instead.
+def run(conn, outputs, tickers=loader.TICKERS, window_size=analytics.WINDOW_SIZE, show=False, cache=None,
+        store=None, workers=None, force=False, interval=price_store.DAILY, fill_policy='mask',
+        max_fill=alignment.MAX_FILL, mask_outliers=False, **options):
+    source = pipeline.PriceSource(conn, store, interval, cache, fill_policy, max_fill, mask_outliers)
+    prices = pipeline.Frame(source).select(tickers)
+    # Every output needs the full history of the selected tokens, so this one read
+    # serves them all
+    loader.report_missing(tickers, prices.to_frame().columns)
+    source.quality.print_summary()
+    with instrumentation.stage('analytics'):
+        jobs = [OUTPUTS[name](prices, window_size, **options) for name in outputs]
+        for job, data in zip(jobs, pipeline.collect(*[job.data for job in jobs])):
+            job.data = data
+    if show:
+        for job in jobs:
+            print(f"Rendering {job.path}...")
+            getattr(charts, job.chart)(job.data, path=job.path, show=True, **job.params)
+        return prices
+    with instrumentation.stage('render') as stage:
+        rendered, skipped = render.render_all(jobs, workers, force)
+        stage.add(charts_rendered=len(rendered), charts_skipped=len(skipped))
+    for path in rendered:
+        print(f"Rendered {path}.")
+    for path in skipped:
+        print(f"{path} is up to date. Skipping...")
+    return prices
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Produce the chart set from a single load of crypto_data.db.')
+    parser.add_argument('outputs', nargs='*', metavar='output',
+                        help=f"Outputs to produce: {', '.join(OUTPUTS)} (default: all)")
+    parser.add_argument('--db', default='crypto_data.db', help='Path to the SQLite database')
+    parser.add_argument('--window', type=int, default=analytics.WINDOW_SIZE, help='Rolling window size in days')
+    parser.add_argument('--tickers', nargs='+', default=loader.TICKERS, help='Tokens to analyze')
+    parser.add_argument('--no-cache', action='store_true', help='Recompute every metric instead of using the metric cache')
+    parser.add_argument('--cache-path', default=metric_cache.CACHE_PATH, help='Path of the metric cache')
+    parser.add_argument('--cache-mb', type=float, default=metric_cache.MAX_BYTES / 2**20, help='Size bound of the metric cache in MB')
+    parser.add_argument('--matrix-store', metavar='PATH', help='Read prices from the memory-mapped matrix at PATH')
+    parser.add_argument('--interval', choices=list(price_store.INTERVALS), default=price_store.DAILY,
+                        help='Base bar interval; intraday bars are resampled to daily closes')
+    parser.add_argument('--fill-policy', choices=alignment.POLICIES, default='mask',
+                        help='Leave missing days empty or carry the last price forward')
+    parser.add_argument('--max-fill', type=int, default=alignment.MAX_FILL,
+                        help='Longest run of missing days filled by --fill-policy ffill')
+    parser.add_argument('--mask-outliers', action='store_true', help='Drop outlier ticks before computing the metrics')
+    parser.add_argument('--workers', type=int, help='Render processes (default: one per CPU)')
+    parser.add_argument('--force', action='store_true', help='Re-render charts even if their inputs are unchanged')
+    parser.add_argument('--heatmap-mode', choices=['auto', 'cells', 'scalable'], default='auto',
+                        help='Per-cell heatmap, bucketed rasterized heatmap, or pick by data size')
+    parser.add_argument('--heatmap-bucket', choices=list(analytics.BUCKETS), default='weekly',
+                        help='Bucket size of the scalable heatmap')
+    parser.add_argument('--heatmap-sort', choices=['mean', 'volatility', 'cumulative', 'last', 'name'], default='mean',
+                        help='Token order of the scalable heatmap')
+    parser.add_argument('--show', action='store_true', help='Show each chart after saving it')
+    instrumentation.add_arguments(parser)
+    backends.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args(args)
+    backends.configure_from_args(args)
+    unknown = [name for name in args.outputs if name not in OUTPUTS]
+    if unknown:
+        parser.error(f"unknown outputs: {', '.join(unknown)}")
+
+    # The prices are only read; the metric cache lives in its own file
+    conn = price_store.connect(args.db, readonly=True)
+    cache = None if args.no_cache else metric_cache.MetricCache(args.cache_path, int(args.cache_mb * 2**20))
+    store = matrix_store.MatrixStore(args.matrix_store) if args.matrix_store else None
+    run(conn, args.outputs or list(OUTPUTS), args.tickers, args.window, args.show, cache, store,
+        args.workers, args.force, args.interval, args.fill_policy, args.max_fill, args.mask_outliers,
+        heatmap_mode=args.heatmap_mode, heatmap_bucket=args.heatmap_bucket,
+        heatmap_sort=args.heatmap_sort)
+    if cache is not None:
+        print(f"Metric cache: {cache.hits} hits, {cache.misses} misses.")
+        cache.close()
+    conn.close()
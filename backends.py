@@ -0,0 +1,193 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import price_store
+import alignment
+import correlation
+
+# Polars is optional; without it only the pandas backend is available
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+# Backends the analytics can run on. 'pandas' is the default; 'polars' evaluates the
+# same calculations as lazy, multi-threaded column expressions, which pays off for
+# large universes. Chosen with ANALYTICS_BACKEND=polars, set_backend() or --backend.
+BACKENDS = ('pandas', 'polars')
+BACKEND = os.environ.get('ANALYTICS_BACKEND', 'pandas')
+
+# Largest absolute difference from pandas that verify() accepts; the backends sum in
+# a different order, so rolling statistics and correlations differ in the last bits
+TOLERANCE = 1e-9
+
+ROLLING_STATS = ('mean', 'std', 'min', 'max', 'sum')
+
+
+class PandasBackend:
+    """The reference implementation, on pandas' vectorized frame operations."""
+
+    name = 'pandas'
+
+    def returns(self, prices):
+        return prices.pct_change(fill_method=None)
+
+    def rolling(self, frame, window, stat):
+        return getattr(frame.rolling(window=window), stat)()
+
+    def cumulative(self, returns):
+        return (1 + returns).cumprod() - 1
+
+    def correlation(self, returns):
+        # Each pair uses the dates where both tokens have data
+        return returns.corr()
+
+
+class PolarsBackend:
+    """The same calculations as PandasBackend on a Polars frame.
+
+    Each calculation but the correlation is one expression expanded over every
+    token column and run lazily on Polars' thread pool; correlations are masked
+    matrix products (correlation.CorrelationEngine) in float64. NaN is converted
+    to null on the way in and back on the way out, and results have the dtypes
+    pandas gives (returns and cumulative returns keep the input's float dtype,
+    rolling statistics and correlations are float64). Anything but a non-empty
+    DataFrame goes to pandas.
+    """
+
+    name = 'polars'
+
+    def __init__(self):
+        self.pandas = PandasBackend()
+
+    @staticmethod
+    def columns(frame, dtype=None):
+        # Columns are named by position, so any token labels work
+        values = frame.to_numpy(dtype=dtype)
+        if values.dtype.kind != 'f':
+            values = values.astype('float64')
+        names = [f"c{i}" for i in range(values.shape[1])]
+        data = pl.from_numpy(np.asfortranarray(values), schema=names, orient='row')
+        return data.fill_nan(None), names
+
+    @staticmethod
+    def evaluate(data, exprs):
+        return data.lazy().select(exprs).collect()
+
+    def per_column(self, frame, expr, dtype=None):
+        data, _ = self.columns(frame, dtype)
+        # One expression over every column, each keeping its own name
+        result = self.evaluate(data, [expr(pl.all()).name.keep()])
+        return pd.DataFrame(result.to_numpy(), index=frame.index, columns=frame.columns)
+
+    @staticmethod
+    def usable(frame):
+        return isinstance(frame, pd.DataFrame) and not frame.empty
+
+    def returns(self, prices):
+        if not self.usable(prices):
+            return self.pandas.returns(prices)
+        return self.per_column(prices, lambda col: col / col.shift(1) - 1)
+
+    def rolling(self, frame, window, stat):
+        if not self.usable(frame):
+            return self.pandas.rolling(frame, window, stat)
+        # A window needs `window` values, as with pandas' default min_periods
+        return self.per_column(frame, lambda col: getattr(col, f"rolling_{stat}")(window), dtype='float64')
+
+    def cumulative(self, returns):
+        if not self.usable(returns):
+            return self.pandas.cumulative(returns)
+        # cum_prod skips nulls, like pandas' cumprod
+        return self.per_column(returns, lambda col: (1 + col).cum_prod() - 1)
+
+    def correlation(self, returns):
+        if not self.usable(returns):
+            return self.pandas.correlation(returns)
+        # Pairwise-complete correlations are a few masked matrix products over all
+        # tokens at once, in float64 to stay within TOLERANCE of pandas
+        engine = correlation.CorrelationEngine.from_returns(returns, dtype='float64', workers=1)
+        return pd.DataFrame(engine.matrix(), index=returns.columns.copy(), columns=returns.columns.copy())
+
+
+# Backend instances, created on first use
+_instances = {}
+
+
+def available():
+    return [name for name in BACKENDS if name != 'polars' or pl is not None]
+
+
+def check(name):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown analytics backend: {name}")
+    if name == 'polars' and pl is None:
+        raise ImportError("The polars backend needs the polars package (pip install polars)")
+
+
+def get(name=None):
+    """The backend called `name`, or the configured one."""
+    name = name or BACKEND
+    if name not in _instances:
+        check(name)
+        _instances[name] = PolarsBackend() if name == 'polars' else PandasBackend()
+    return _instances[name]
+
+
+def set_backend(name):
+    global BACKEND
+    check(name)
+    BACKEND = name
+
+
+def add_arguments(parser):
+    parser.add_argument('--backend', choices=BACKENDS, default=None,
+                        help='Compute backend of the analytics (default: ANALYTICS_BACKEND or pandas)')
+
+
+def configure_from_args(args):
+    if args.backend:
+        set_backend(args.backend)
+
+
+def verify(prices, name='polars', windows=(7,)):
+    """Largest absolute difference of every calculation on backend `name` against
+    pandas, for a date x token price matrix."""
+    reference, backend = get('pandas'), get(name)
+    returns = reference.returns(prices)
+    results = {'returns': (reference.returns(prices), backend.returns(prices)),
+               'cumulative': (reference.cumulative(returns), backend.cumulative(returns)),
+               'correlation': (reference.correlation(returns), backend.correlation(returns))}
+    for window in windows:
+        for stat in ROLLING_STATS:
+            results[f"rolling({window}).{stat}"] = (reference.rolling(returns, window, stat),
+                                                    backend.rolling(returns, window, stat))
+    worst = {}
+    for key, (expected, actual) in results.items():
+        expected, actual = expected.to_numpy(dtype='float64'), actual.to_numpy(dtype='float64')
+        # Both must be missing in the same cells
+        if not np.array_equal(np.isnan(expected), np.isnan(actual)):
+            worst[key] = np.inf
+            continue
+        both = np.isfinite(expected) & np.isfinite(actual)
+        worst[key] = float(np.abs(expected - actual)[both].max()) if both.any() else 0.0
+    return worst
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare an analytics backend with pandas on the stored prices.')
+    parser.add_argument('--db', default=price_store.DB_PATH, help='Path to the SQLite database')
+    parser.add_argument('--backend', choices=BACKENDS, default='polars', help='Backend to compare with pandas')
+    parser.add_argument('--tickers', nargs='+', help='Tokens to include (default: all)')
+    parser.add_argument('--windows', nargs='+', type=int, default=[7], help='Rolling windows to compare')
+    args = parser.parse_args()
+
+    conn = price_store.connect(args.db, readonly=True)
+    prices, _ = alignment.load_aligned(conn, args.tickers)
+    conn.close()
+    failed = False
+    for key, diff in verify(prices, args.backend, args.windows).items():
+        failed = failed or not diff <= TOLERANCE
+        print(f"{key}: max abs difference vs pandas {diff:.3g}{'' if diff <= TOLERANCE else '  MISMATCH'}")
+    raise SystemExit(1 if failed else 0)
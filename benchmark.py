@@ -0,0 +1,242 @@
+import argparse
+import ast
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import price_store
+import loader
+import analytics
+import correlation
+
+# Default problem sizes as (tokens, days); today's database is about 10 x 60
+SIZES = [(10, 60), (100, 365), (1000, 730)]
+
+# Timed runs per stage; the median is reported
+REPEAT = 3
+
+# First day of the synthetic history
+START = '2020-01-01'
+
+
+def synthetic_quotes(n_tokens, n_days, start=START, seed=0, missing=0.01):
+    """Synthetic daily quotes shaped like the CoinMarketCap historical endpoint.
+
+    Prices follow a geometric random walk with a common market factor and
+    per-token volatility; about `missing` of the days are dropped at random.
+    Returns {symbol: [{'timestamp': ..., 'quote': {'USD': {...}}}, ...]}.
+    """
+    rng = np.random.default_rng(seed)
+    vols = rng.uniform(0.02, 0.12, n_tokens)
+    betas = rng.uniform(0.5, 1.5, n_tokens)
+    market = rng.normal(0, 0.03, n_days)
+    returns = market[:, None] * betas + rng.normal(0, 1, (n_days, n_tokens)) * vols
+    prices = rng.uniform(0.001, 100, n_tokens) * np.exp(np.cumsum(returns, axis=0))
+    supply = rng.uniform(1e6, 1e10, n_tokens)
+    volumes = prices * supply * rng.uniform(0.001, 0.1, (n_days, n_tokens))
+    keep = rng.random((n_days, n_tokens)) >= missing
+    stamps = pd.date_range(start, periods=n_days, freq='D').strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+    quotes = {}
+    for j in range(n_tokens):
+        symbol = f'TK{j:05d}'
+        records = []
+        for i in np.flatnonzero(keep[:, j]):
+            usd = {
+                'percent_change_1h': float(returns[i, j] * 4),
+                'percent_change_24h': float(returns[i, j] * 100),
+                'percent_change_7d': float(returns[max(0, i - 6):i + 1, j].sum() * 100),
+                'percent_change_30d': float(returns[max(0, i - 29):i + 1, j].sum() * 100),
+                'price': float(prices[i, j]),
+                'volume_24h': float(volumes[i, j]),
+                'market_cap': float(prices[i, j] * supply[j]),
+                'total_supply': float(supply[j]),
+                'circulating_supply': float(supply[j] * 0.8),
+                'timestamp': stamps[i],
+            }
+            records.append({'timestamp': stamps[i], 'quote': {'USD': usd}})
+        quotes[symbol] = records
+    return quotes
+
+
+# The layout written by the original fetcher: one TEXT table per symbol with the quote
+# dict stored as its Python repr
+def write_legacy(conn, quotes):
+    with conn:
+        for symbol, records in quotes.items():
+            conn.execute(f'DROP TABLE IF EXISTS "{symbol}"')
+            conn.execute(f'CREATE TABLE "{symbol}" ("timestamp" TEXT, "quote" TEXT)')
+            conn.executemany(f'INSERT INTO "{symbol}" VALUES (?, ?)',
+                             [(r['timestamp'], str(r['quote'])) for r in records])
+
+
+def write_normalized(conn, quotes):
+    price_store.ensure_schema(conn)
+    return price_store.upsert_rows(conn, (price_store.quote_to_row(symbol, record)
+                                          for symbol, records in quotes.items() for record in records))
+
+
+def generate(path, n_tokens, n_days, seed=0, layouts=('legacy', 'normalized')):
+    """Write a synthetic database at `path` in the requested layouts."""
+    if os.path.exists(path):
+        os.remove(path)
+    quotes = synthetic_quotes(n_tokens, n_days, seed=seed)
+    conn = sqlite3.connect(path)
+    if 'legacy' in layouts:
+        write_legacy(conn, quotes)
+    if 'normalized' in layouts:
+        write_normalized(conn, quotes)
+    conn.close()
+    return quotes
+
+
+def timed(fn, repeat=REPEAT, setup=None):
+    """Median wall time of `fn()` over `repeat` runs, and its last result."""
+    times, result = [], None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+# The original scripts' read path: one read_sql per ticker, then literal_eval per row
+def legacy_read(conn, symbols):
+    return {symbol: pd.read_sql(f'SELECT timestamp, quote FROM "{symbol}" ORDER BY timestamp', conn,
+                                parse_dates=['timestamp']) for symbol in symbols}
+
+
+def legacy_parse(frames):
+    return pd.DataFrame({symbol: df.set_index('timestamp')['quote'].apply(
+        lambda x: ast.literal_eval(x)['USD']['price']) for symbol, df in frames.items()})
+
+
+def run_size(n_tokens, n_days, directory, repeat=REPEAT, render=True, seed=0):
+    """Time every stage for one problem size; returns a list of result dicts."""
+    path = os.path.join(directory, f'bench_{n_tokens}x{n_days}.db')
+    quotes = synthetic_quotes(n_tokens, n_days, seed=seed)
+    rows = sum(len(records) for records in quotes.values())
+    symbols = list(quotes)
+    results = []
+
+    def record(stage, seconds):
+        results.append({'stage': stage, 'tokens': n_tokens, 'days': n_days, 'rows': rows,
+                        'seconds': round(seconds, 6), 'rows_per_second': round(rows / seconds, 1) if seconds else None})
+        print(f"  {stage:<24} {seconds:10.4f}s")
+
+    def fresh_db():
+        if os.path.exists(path):
+            os.remove(path)
+
+    def ingest_legacy():
+        legacy = sqlite3.connect(path)
+        write_legacy(legacy, quotes)
+        legacy.close()
+
+    seconds, _ = timed(ingest_legacy, repeat, fresh_db)
+    record('ingest_legacy', seconds)
+    conn = sqlite3.connect(path)
+    seconds, _ = timed(lambda: write_normalized(conn, quotes), repeat,
+                       lambda: conn.execute(f"DROP TABLE IF EXISTS {price_store.PRICES_TABLE}"))
+    record('ingest_normalized', seconds)
+
+    seconds, frames = timed(lambda: legacy_read(conn, symbols), repeat)
+    record('legacy_read_sql', seconds)
+    seconds, _ = timed(lambda: legacy_parse(frames), repeat)
+    record('legacy_literal_eval', seconds)
+    seconds, prices = timed(lambda: loader.load_price_matrix(conn, symbols), repeat)
+    record('load_price_matrix', seconds)
+    conn.close()
+
+    prices = prices.asfreq('D')
+    seconds, returns = timed(lambda: analytics.daily_returns(prices), repeat)
+    record('pct_change', seconds)
+    seconds, _ = timed(lambda: (analytics.rolling_mean(returns), analytics.rolling_volatility(returns)), repeat)
+    record('rolling_mean_std', seconds)
+    seconds, _ = timed(lambda: returns.corr(), repeat)
+    record('corr_pandas', seconds)
+    seconds, _ = timed(lambda: correlation.CorrelationEngine.from_returns(returns).matrix(), repeat)
+    record('corr_blocked', seconds)
+
+    if render:
+        import charts
+        charts.set_headless()
+        png = os.path.join(directory, 'bench.png')
+        seconds, _ = timed(lambda: charts.rolling_returns_chart(analytics.rolling_mean(returns), 7, png, False), repeat)
+        record('savefig_line', seconds)
+        # The original per-cell seaborn heatmap, on the % changes analyze_all gives it,
+        # and the bucketed rasterized heatmap that replaces it on large data
+        pct_changes = (returns * 100).dropna(how='all')
+        seconds, _ = timed(lambda: charts.heatmap_chart(pct_changes, png, False), repeat)
+        record('savefig_heatmap', seconds)
+        seconds, _ = timed(lambda: charts.scalable_heatmap_chart(returns, png, show=False), repeat)
+        record('savefig_heatmap_scalable', seconds)
+    os.remove(path)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'cpus': os.cpu_count(),
+        'timestamp': pd.Timestamp.now(tz='UTC').isoformat(),
+    }
+
+
+# Print the speedup of every stage in `current` relative to `baseline` (old / new time)
+def compare(baseline, current):
+    old = {(r['stage'], r['tokens'], r['days']): r['seconds'] for r in baseline['results']}
+    for r in current['results']:
+        key = (r['stage'], r['tokens'], r['days'])
+        if key in old and r['seconds']:
+            print(f"{r['stage']:<24} {r['tokens']:>6} x {r['days']:<5} {old[key]:10.4f}s -> {r['seconds']:10.4f}s"
+                  f"  ({old[key] / r['seconds']:.2f}x)")
+
+
+def parse_size(text):
+    tokens, days = text.lower().split('x')
+    return int(tokens), int(days)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark ingest, load, analytics and render on synthetic data.')
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=SIZES, metavar='TOKENSxDAYS',
+                        help='Problem sizes, e.g. 10x60 100x365')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='Timed runs per stage (median reported)')
+    parser.add_argument('--no-render', action='store_true', help='Skip the savefig stages')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', metavar='JSON', help='Print speedups against an earlier results file')
+    parser.add_argument('--generate', metavar='DB',
+                        help='Only write a synthetic database (first size, both layouts) to DB and exit')
+    args = parser.parse_args()
+
+    if args.generate:
+        n_tokens, n_days = args.sizes[0]
+        generate(args.generate, n_tokens, n_days, args.seed)
+        print(f"Wrote {n_tokens} tokens x {n_days} days to {args.generate}")
+        raise SystemExit
+
+    report = {'environment': environment(), 'repeat': args.repeat, 'results': []}
+    with tempfile.TemporaryDirectory() as directory:
+        for n_tokens, n_days in args.sizes:
+            print(f"{n_tokens} tokens x {n_days} days")
+            report['results'].extend(run_size(n_tokens, n_days, directory, args.repeat, not args.no_render, args.seed))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
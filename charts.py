@@ -0,0 +1,218 @@
+import os
+import numpy as np
+import analytics
+
+# Headless mode renders with the Agg backend and never calls plt.show(); it is on when
+# HEADLESS=1 is set in the environment or after set_headless()
+HEADLESS = os.environ.get('HEADLESS', '') not in ('', '0')
+
+
+def set_headless(headless=True):
+    global HEADLESS
+    HEADLESS = headless
+
+
+# Plotting libraries are imported on first use, so modules that only compute data
+# (and runs whose charts are all up to date) never pay for them
+def pyplot():
+    import matplotlib
+    if HEADLESS:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+# Output file names of the standard chart set
+HEATMAP_PNG = 'crypto_daily_pct_change_heatmap.png'
+CORRELATION_PNG = 'crypto_correlation_matrix.png'
+DAILY_RETURNS_PNG = 'crypto_daily_returns_with_breakpoint.png'
+CUMULATIVE_RETURNS_PNG = 'crypto_cumulative_returns_with_breakpoint_custom_legend.png'
+CLUSTERS_PNG = 'crypto_token_clusters.png'
+
+
+def rolling_returns_png(window_size):
+    return f'crypto_{window_size}day_rolling_returns.png'
+
+
+def rolling_volatility_png(window_size):
+    return f'crypto_{window_size}day_rolling_volatility.png'
+
+
+# Save the current figure, then either show it or close it
+def finish(path, show):
+    plt = pyplot()
+    plt.savefig(path)
+    if show and not HEADLESS:
+        plt.show()
+    else:
+        plt.close()
+
+
+# Heatmap of daily % changes, one row per token
+def heatmap_chart(all_pct_changes, path=HEATMAP_PNG, show=True):
+    import seaborn as sns
+    plt = pyplot()
+    plt.figure(figsize=(16, 10))
+    sns.heatmap(all_pct_changes.T, cmap='RdYlGn', center=0, annot=False, linewidths=.5, cbar_kws={'label': '% Change'})
+    plt.title('Heatmap of Daily % Change in Close Price for Cryptocurrencies')
+    plt.xlabel('Date')
+    plt.ylabel('Token')
+    plt.xticks(rotation=45, ha='right')
+    plt.tight_layout()
+    finish(path, show)
+
+
+# Above this many date x token cells the per-cell heatmap gets slow and unreadable,
+# and the scalable heatmap is used instead
+HEATMAP_MAX_CELLS = 5000
+
+
+def use_scalable_heatmap(n_dates, n_tokens):
+    return n_dates * n_tokens > HEATMAP_MAX_CELLS
+
+
+# Heatmap for long histories and large universes: daily returns (as decimals) are
+# compounded into weekly/monthly buckets and capped at `max_columns` columns, tokens
+# are sorted by `sort_by`, and the whole grid is drawn as one rasterized image, so
+# rendering time barely depends on the length of the history
+def scalable_heatmap_chart(daily_returns, path=HEATMAP_PNG, bucket='weekly', max_columns=400,
+                           sort_by='mean', show=True):
+    plt = pyplot()
+    aggregated = analytics.cap_rows(analytics.aggregate_returns(daily_returns, bucket), max_columns)
+    aggregated = analytics.sort_tokens(aggregated, sort_by) * 100  # Convert to percentage
+    grid = aggregated.T.to_numpy(dtype='float64')
+
+    # Symmetric colour scale around zero, robust to a few extreme buckets
+    finite = np.abs(grid[np.isfinite(grid)])
+    limit = float(np.percentile(finite, 99)) if finite.size else 1.0
+
+    n_tokens, n_columns = grid.shape
+    height = max(6, min(20, n_tokens * 0.3)) if n_tokens <= 100 else 12
+    fig, ax = plt.subplots(figsize=(16, height))
+    image = ax.imshow(np.ma.masked_invalid(grid), aspect='auto', interpolation='nearest', cmap='RdYlGn',
+                      vmin=-limit, vmax=limit, rasterized=True)
+    fig.colorbar(image, ax=ax, label=f'% Change ({bucket})')
+
+    # Label at most ~20 dates and, for small universes, every token
+    step = max(1, n_columns // 20)
+    ax.set_xticks(range(0, n_columns, step))
+    ax.set_xticklabels([d.strftime('%Y-%m-%d') for d in aggregated.index[::step]], rotation=45, ha='right')
+    if n_tokens <= 100:
+        ax.set_yticks(range(n_tokens))
+        ax.set_yticklabels(aggregated.columns)
+    else:
+        ax.set_yticks([])
+
+    ax.set_title(f'Heatmap of {bucket.capitalize()} % Change in Close Price for Cryptocurrencies')
+    ax.set_xlabel('Date')
+    ax.set_ylabel(f'Token (sorted by {sort_by})' if sort_by else 'Token')
+    fig.tight_layout()
+    finish(path, show)
+
+
+# Annotated heatmap of the correlation matrix
+def correlation_chart(correlation_matrix, path=CORRELATION_PNG, show=True):
+    import seaborn as sns
+    plt = pyplot()
+    plt.figure(figsize=(12, 8))
+    sns.heatmap(correlation_matrix, annot=True, cmap='coolwarm', center=0, linewidths=.5)
+    plt.title('Correlation Matrix of Daily Returns for Cryptocurrencies')
+    plt.xlabel('Token')
+    plt.ylabel('Token')
+    plt.tight_layout()
+    finish(path, show)
+
+
+# One line per token, with every 5th day labelled on the x-axis
+def line_chart(frame, title, ylabel, path, show=True):
+    import matplotlib.dates as mdates
+    plt = pyplot()
+    plt.figure(figsize=(14, 8))
+    for ticker in frame.columns:
+        plt.plot(frame.index, frame[ticker], label=ticker)
+
+    # Format the x-axis dates for better readability
+    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+    plt.gca().xaxis.set_major_locator(mdates.DayLocator(interval=5))  # Show every 5th day
+    plt.gcf().autofmt_xdate()  # Rotate the x-axis dates for better readability
+
+    plt.title(title)
+    plt.xlabel('Date')
+    plt.ylabel(ylabel)
+    plt.legend(loc='upper left')
+    plt.grid(True)
+    finish(path, show)
+
+
+def rolling_returns_chart(all_rolling_returns, window_size, path=None, show=True):
+    line_chart(all_rolling_returns,
+               f'{window_size}-Day Rolling Average of Daily Returns for Cryptocurrencies',
+               f'{window_size}-Day Rolling % Return',
+               path or rolling_returns_png(window_size), show)
+
+
+def rolling_volatility_chart(all_volatility, window_size, path=None, show=True):
+    line_chart(all_volatility,
+               f'{window_size}-Day Rolling Volatility (Standard Deviation) of Cryptocurrencies',
+               f'{window_size}-Day Rolling Volatility (%)',
+               path or rolling_volatility_png(window_size), show)
+
+
+# Daily line chart of an event window with the Breakpoint period shaded
+def event_chart(frame, title, ylabel, path, period=analytics.BREAKPOINT_PERIOD, show=True):
+    import matplotlib.dates as mdates
+    from matplotlib.patches import Patch
+    plt = pyplot()
+    plt.figure(figsize=(14, 8))
+    for ticker in frame.columns:
+        plt.plot(frame.index, frame[ticker], label=ticker)
+
+    # Highlight the Breakpoint time period
+    plt.axvspan(period[0], period[1], color='lightgray', alpha=0.5)
+
+    # Adding a custom legend for the Breakpoint shading
+    custom_legend = [Patch(color='lightgray', alpha=0.5, label='Breakpoint Period')]
+
+    # Format the x-axis dates for better readability
+    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+    plt.gca().xaxis.set_major_locator(mdates.DayLocator(interval=1))  # Show every day in the range
+    plt.gcf().autofmt_xdate()  # Rotate the x-axis dates for better readability
+
+    plt.title(title)
+    plt.xlabel('Date')
+    plt.ylabel(ylabel)
+
+    # Combine the custom legend with the existing one
+    plt.legend(handles=plt.gca().get_legend_handles_labels()[0] + custom_legend, loc='upper left')
+
+    plt.grid(True)
+    finish(path, show)
+
+
+def daily_returns_chart(filtered_daily_returns, path=DAILY_RETURNS_PNG, show=True):
+    event_chart(filtered_daily_returns,
+                'Daily Returns of Cryptocurrencies (Oct 27, 2023 - Nov 6, 2023)',
+                'Daily Return (%)', path, show=show)
+
+
+def cumulative_returns_chart(filtered_cum_returns, path=CUMULATIVE_RETURNS_PNG, show=True):
+    event_chart(filtered_cum_returns,
+                'Cumulative Returns of SPL Tokens (Oct 27, 2023 - Nov 6, 2023)',
+                'Cumulative Return (Normalized)', path, show=show)
+
+
+# Tokens as points (x, y columns, e.g. a 2-D projection of their returns) coloured by
+# `cluster`; tokens are labelled when there are few enough to read
+def cluster_chart(points, path=CLUSTERS_PNG, show=True):
+    plt = pyplot()
+    plt.figure(figsize=(12, 8))
+    scatter = plt.scatter(points['x'], points['y'], c=points['cluster'], cmap='viridis', s=40)
+    if len(points) <= 100:
+        for symbol, row in points.iterrows():
+            plt.annotate(symbol, (row['x'], row['y']), textcoords='offset points', xytext=(4, 4), fontsize=8)
+    plt.legend(*scatter.legend_elements(), title='Cluster')
+    plt.title('Clusters of Cryptocurrencies Based on Daily Returns')
+    plt.xlabel('Component 1')
+    plt.ylabel('Component 2')
+    plt.grid(True)
+    finish(path, show)
@@ -0,0 +1,288 @@
+import argparse
+import io
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+import price_store
+import loader
+import analytics
+import matrix_store
+
+# Days of returns each token is clustered on, and the default number of clusters
+LOOKBACK = 90
+N_CLUSTERS = 3
+
+# Tokens need at least this many returns in the lookback window to be clustered
+MIN_PERIODS = 20
+
+# Default location of the warm-start state and assignments: their own file next to
+# the price database, so clustering only ever reads the price data (git-ignored,
+# like metric_cache.db)
+STATE_PATH = 'cluster_state.db'
+
+# Seconds to wait for another process writing to the state file
+BUSY_TIMEOUT = 30.0
+
+# Centroids of the last k-means fit per (lookback, k), used to warm-start the next one.
+# `end_day` is the last day of the window the centroids were fitted on.
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cluster_state (
+    lookback INTEGER NOT NULL,
+    k INTEGER NOT NULL,
+    end_day INTEGER NOT NULL,
+    centroids BLOB NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (lookback, k)
+)
+"""
+
+# Latest cluster of every token, per method
+ASSIGNMENTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_clusters (
+    method TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    cluster INTEGER NOT NULL,
+    distance REAL,
+    end_day INTEGER NOT NULL,
+    PRIMARY KEY (method, symbol)
+) WITHOUT ROWID
+"""
+
+
+# Open (creating if needed) the clustering state database, in WAL mode so a
+# scheduled refit and a manual run can share it
+def connect_state(path=STATE_PATH):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode = WAL")
+    ensure_schema(conn)
+    return conn
+
+
+def ensure_schema(conn):
+    conn.execute(STATE_SCHEMA)
+    conn.execute(ASSIGNMENTS_SCHEMA)
+    conn.commit()
+
+
+def return_features(returns, lookback=LOOKBACK, min_periods=MIN_PERIODS):
+    """Token x day feature matrix of the last `lookback` days of returns.
+
+    Each token's returns are centred and scaled to unit length, with missing days
+    set to zero, so the squared Euclidean distance between two tokens is
+    2 * (1 - correlation) and k-means groups tokens by correlation. Returns
+    (symbols, features, end_date); tokens with fewer than `min_periods` returns in
+    the window are left out.
+    """
+    window = returns.iloc[-lookback:]
+    values = window.to_numpy(dtype=np.float32).T
+    mask = np.isfinite(values)
+    counts = mask.sum(axis=1)
+    keep = counts >= max(2, min_periods)
+    values, mask, counts = values[keep], mask[keep], counts[keep]
+    means = np.where(mask, values, 0).sum(axis=1) / counts
+    centred = np.where(mask, values - means[:, None], 0).astype(np.float32)
+    norms = np.sqrt((centred * centred).sum(axis=1))
+    centred[norms > 0] /= norms[norms > 0, None]
+    return list(window.columns[keep]), centred, window.index[-1]
+
+
+def relabel_by_size(labels):
+    """Renumber clusters 0..k-1 from largest to smallest (ties by first member)."""
+    ids, first, sizes = np.unique(labels, return_index=True, return_counts=True)
+    order = ids[np.lexsort((first, -sizes))]
+    mapping = np.empty(ids.max() + 1, dtype=np.int64)
+    mapping[order] = np.arange(len(order))
+    return mapping[labels]
+
+
+def kmeans_clusters(features, n_clusters=N_CLUSTERS, init=None, batch_size=1024, seed=42):
+    """MiniBatchKMeans over token feature rows.
+
+    `init` (k x features) warm-starts the fit from previous centroids, which keeps
+    the cluster ids stable across refits and converges in a few passes. Returns
+    (labels, distances to the assigned centroid, centroids).
+    """
+    from sklearn.cluster import MiniBatchKMeans
+    n_clusters = min(n_clusters, len(features))
+    warm = init is not None and init.shape == (n_clusters, features.shape[1])
+    model = MiniBatchKMeans(n_clusters=n_clusters, init=init if warm else 'k-means++', n_init=1 if warm else 3,
+                            batch_size=batch_size, random_state=seed)
+    labels = model.fit_predict(features)
+    distances = np.linalg.norm(features - model.cluster_centers_[labels], axis=1)
+    centroids = model.cluster_centers_
+    if not warm:
+        # Cold fits get deterministic ids; warm fits keep the ids of the previous fit
+        new_labels = relabel_by_size(labels)
+        order = np.full(n_clusters, -1)
+        order[new_labels] = labels
+        # Centroids of empty clusters go last
+        unused = np.setdiff1d(np.arange(n_clusters), labels)
+        order[order < 0] = unused
+        labels, centroids = new_labels, centroids[order]
+    return labels, distances, centroids
+
+
+def hierarchical_clusters(returns, n_clusters=N_CLUSTERS, lookback=LOOKBACK, min_periods=MIN_PERIODS,
+                          method='average'):
+    """Agglomerative clustering on correlation distance (1 - r).
+
+    The pairwise-complete correlation matrix comes from the blocked correlation
+    engine; pairs without enough overlap are treated as uncorrelated. Needs the
+    full N x N matrix, so it suits up to a few thousand tokens. Returns
+    (symbols, labels, end_date).
+    """
+    from scipy.cluster.hierarchy import linkage, fcluster
+    from scipy.spatial.distance import squareform
+    import correlation
+    window = returns.iloc[-lookback:]
+    window = window.loc[:, window.notna().sum() >= max(2, min_periods)]
+    corr = correlation.CorrelationEngine.from_returns(window, min_periods=min_periods).matrix()
+    distance = 1 - np.nan_to_num(corr.astype('float64'), nan=0.0)
+    np.fill_diagonal(distance, 0)
+    distance = np.clip((distance + distance.T) / 2, 0, 2)
+    tree = linkage(squareform(distance, checks=False), method=method)
+    labels = fcluster(tree, t=min(n_clusters, len(window.columns)), criterion='maxclust') - 1
+    return list(window.columns), relabel_by_size(labels), window.index[-1]
+
+
+def encode_centroids(centroids):
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(centroids, dtype=np.float32))
+    return buffer.getvalue()
+
+
+def decode_centroids(payload):
+    return np.load(io.BytesIO(payload))
+
+
+def load_centroids(conn, lookback, k):
+    """(end_day, centroids) of the last fit, or (None, None)."""
+    row = conn.execute("SELECT end_day, centroids FROM cluster_state WHERE lookback = ? AND k = ?",
+                       (lookback, k)).fetchone()
+    if row is None:
+        return None, None
+    return row[0], decode_centroids(row[1])
+
+
+def shift_centroids(centroids, days):
+    """Re-align centroids fitted on a window ending `days` days earlier: the
+    oldest days drop out and the new ones start at zero."""
+    if days <= 0:
+        return centroids
+    lookback = centroids.shape[1]
+    shifted = np.zeros_like(centroids)
+    if days < lookback:
+        shifted[:, :lookback - days] = centroids[:, days:]
+    return shifted
+
+
+def save_assignments(conn, method, symbols, labels, distances, end_day):
+    if distances is None:
+        distances = [None] * len(symbols)
+    conn.execute("DELETE FROM token_clusters WHERE method = ?", (method,))
+    conn.executemany(
+        "INSERT INTO token_clusters (method, symbol, cluster, distance, end_day) VALUES (?, ?, ?, ?, ?)",
+        [(method, s, int(c), None if d is None else float(d), end_day)
+         for s, c, d in zip(symbols, labels, distances)],
+    )
+    conn.commit()
+
+
+def update(conn, returns, n_clusters=N_CLUSTERS, lookback=LOOKBACK, min_periods=MIN_PERIODS, cold=False):
+    """Refit the k-means clusters on the latest window and store the assignments
+    in `conn`, the clustering state database (see connect_state).
+
+    The previous centroids, shifted by the number of days that arrived since,
+    seed the fit unless `cold` is set. Returns a DataFrame indexed by symbol with
+    `cluster` and `distance` columns.
+    """
+    ensure_schema(conn)
+    symbols, features, end_date = return_features(returns, lookback, min_periods)
+    if not symbols:
+        return pd.DataFrame(columns=['cluster', 'distance'])
+    # Pad short histories so the feature width always equals the lookback
+    if features.shape[1] < lookback:
+        features = np.pad(features, ((0, 0), (lookback - features.shape[1], 0)))
+    end_day = loader.to_epoch_day(end_date)
+
+    init = None
+    if not cold:
+        last_day, centroids = load_centroids(conn, lookback, n_clusters)
+        if centroids is not None:
+            init = shift_centroids(centroids, end_day - last_day)
+
+    labels, distances, centroids = kmeans_clusters(features, n_clusters, init)
+    conn.execute(
+        "INSERT INTO cluster_state (lookback, k, end_day, centroids, updated_at) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (lookback, k) DO UPDATE SET end_day = excluded.end_day, "
+        "centroids = excluded.centroids, updated_at = excluded.updated_at",
+        (lookback, n_clusters, end_day, encode_centroids(centroids), time.time()),
+    )
+    save_assignments(conn, 'kmeans', symbols, labels, distances, end_day)
+    return pd.DataFrame({'cluster': labels, 'distance': distances}, index=pd.Index(symbols, name='symbol'))
+
+
+def assignments(conn, method='kmeans'):
+    """Stored cluster assignments of `method` as a DataFrame indexed by symbol."""
+    ensure_schema(conn)
+    return pd.read_sql_query("SELECT symbol, cluster, distance, end_day FROM token_clusters "
+                             "WHERE method = ? ORDER BY cluster, symbol", conn, params=(method,),
+                             index_col='symbol')
+
+
+# 2-D projection of the token features (first two principal components) for plotting
+def project(features):
+    centred = features - features.mean(axis=0)
+    u, s, _ = np.linalg.svd(centred, full_matrices=False)
+    return u[:, :2] * s[:2]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cluster tokens by the behavior of their daily returns.')
+    parser.add_argument('--db', default=price_store.DB_PATH, help='Path to the SQLite database')
+    parser.add_argument('--state', default=STATE_PATH,
+                        help='SQLite file for the warm-start centroids and assignments')
+    parser.add_argument('--matrix-store', metavar='PATH', help='Read prices from the memory-mapped matrix at PATH')
+    parser.add_argument('--method', choices=['kmeans', 'hierarchical'], default='kmeans')
+    parser.add_argument('--clusters', type=int, default=N_CLUSTERS, help='Number of clusters')
+    parser.add_argument('--lookback', type=int, default=LOOKBACK, help='Days of returns to cluster on')
+    parser.add_argument('--min-periods', type=int, default=MIN_PERIODS, help='Minimum returns per token')
+    parser.add_argument('--cold', action='store_true', help='Ignore the stored centroids (k-means)')
+    parser.add_argument('--csv', help='Also write the assignments to this CSV file')
+    parser.add_argument('--plot', action='store_true', help='Render the clusters as a scatter chart')
+    args = parser.parse_args()
+
+    # Prices are only read; the centroids and assignments go to their own file
+    conn = price_store.connect(args.db, readonly=True)
+    # One extra day of prices gives `lookback` returns
+    if args.matrix_store:
+        store = matrix_store.MatrixStore(args.matrix_store)
+        meta = store.load_meta()
+        start_day = max(meta['start_day'], meta['start_day'] + meta['n_days'] - args.lookback - 1)
+        prices = store.frame(start=loader.days_to_index([start_day])[0])
+    else:
+        prices = loader.load_price_matrix(conn).asfreq('D').iloc[-args.lookback - 1:]
+    conn.close()
+    returns = analytics.daily_returns(prices)
+
+    state = connect_state(args.state)
+    if args.method == 'kmeans':
+        result = update(state, returns, args.clusters, args.lookback, args.min_periods, args.cold)
+    else:
+        symbols, labels, end_date = hierarchical_clusters(returns, args.clusters, args.lookback, args.min_periods)
+        save_assignments(state, 'hierarchical', symbols, labels, None, loader.to_epoch_day(end_date))
+        result = pd.DataFrame({'cluster': labels}, index=pd.Index(symbols, name='symbol'))
+    state.close()
+
+    for cluster, members in result.groupby('cluster').groups.items():
+        print(f"Cluster {cluster}: {', '.join(members)}")
+    if args.csv:
+        result.to_csv(args.csv)
+
+    if args.plot:
+        # Plotting libraries are only imported when a chart is requested
+        import charts
+        symbols, features, _ = return_features(returns, args.lookback, args.min_periods)
+        points = pd.DataFrame(project(features), index=symbols, columns=['x', 'y'])
+        charts.cluster_chart(points.join(result['cluster'], how='inner'), show=False)
@@ -0,0 +1,244 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import instrumentation
+import response_cache
+
+# Base URL for the CoinMarketCap API
+BASE_URL = 'https://pro-api.coinmarketcap.com'
+QUOTES_PATH = '/v1/cryptocurrency/quotes/historical'
+
+# Longest date range requested in a single call; longer ranges are split into pages
+PAGE_DAYS = 365
+
+# Page length per bar interval, so intraday pages stay under a thousand bars per call
+INTERVAL_PAGE_DAYS = {'daily': PAGE_DAYS, '1h': 30, '5m': 2}
+
+# Status codes worth retrying: rate limited, or a transient server-side failure
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CMCError(Exception):
+    """Raised when a request fails for good or the API returns no quotes."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate_per_minute` tokens per minute.
+
+    `acquire` blocks until a token is available. `pause` stops handing out
+    tokens until the given number of seconds has passed, which is how a
+    Retry-After from one worker slows down every other worker as well.
+    """
+
+    def __init__(self, rate_per_minute, burst=None, clock=time.monotonic, sleep=time.sleep):
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive")
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst if burst is not None else max(1.0, rate_per_minute / 60.0))
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = self.clock()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            self.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            now = self.clock()
+            self._refill(now)
+            self.paused_until = max(self.paused_until, now + seconds)
+            self.tokens = 0.0
+
+
+# Parse a Retry-After header given either as seconds or as an HTTP date
+def parse_retry_after(value, now=None):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, when.timestamp() - now)
+
+
+# Split [start_date, end_date] into consecutive ranges of at most `page_days` days
+def page_ranges(start_date, end_date, page_days=PAGE_DAYS):
+    pages = []
+    step = timedelta(days=page_days)
+    page_start = start_date
+    while page_start < end_date:
+        page_end = min(page_start + step, end_date)
+        pages.append((page_start, page_end))
+        page_start = page_end
+    return pages
+
+
+class CMCClient:
+    """Pooled, rate-limited client for the historical quotes endpoint.
+
+    All requests share one `requests.Session` whose connection pool is sized
+    for `max_workers`, and go through a token bucket configured from the plan's
+    credits per minute. 429 and 5xx responses are retried with full-jitter
+    exponential backoff, waiting at least as long as any Retry-After header.
+    With a `response_cache.ResponseCache`, quotes already fetched are served
+    from disk and only the missing ranges reach the API.
+    """
+
+    def __init__(self, api_key, base_url=BASE_URL, credits_per_minute=30, max_workers=4,
+                 max_retries=5, backoff_base=1.0, backoff_cap=60.0, timeout=30, session=None, cache=None):
+        self.base_url = base_url.rstrip('/')
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+        self.cache = cache
+        self.limiter = TokenBucket(credits_per_minute)
+        # Number of 429 responses seen, so callers can slow down
+        self.throttled = 0
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Accepts': 'application/json'})
+        # No key is needed when every response is replayed from the cache
+        if api_key:
+            self.session.headers['X-CMC_PRO_API_KEY'] = api_key
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def get(self, path, params):
+        """GET with rate limiting and retries; returns the decoded JSON body."""
+        url = self.base_url + path
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            if attempt:
+                instrumentation.count('api_retries')
+            instrumentation.count('api_calls')
+            try:
+                with instrumentation.stage('api_request') as stage:
+                    response = self.session.get(url, params=params, timeout=self.timeout)
+                    stage.add(bytes=len(response.content))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise CMCError(f"Request to {url} failed: {e}") from e
+                time.sleep(self.backoff(attempt))
+                continue
+            instrumentation.count('api_bytes', len(response.content))
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = self.backoff(attempt)
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                if response.status_code == 429:
+                    # Hold back every worker, not just this one
+                    self.throttled += 1
+                    self.limiter.pause(delay)
+                else:
+                    time.sleep(delay)
+                continue
+
+            if response.status_code != 200:
+                raise CMCError(f"HTTP {response.status_code} from {url}: {response.text[:200]}")
+            return response.json()
+
+    def fetch_quotes(self, symbol, start_date, end_date, interval='daily'):
+        """Return the list of quote records for one symbol and date range."""
+        params = {
+            'symbol': symbol,
+            'time_start': int(start_date.timestamp()),
+            'time_end': int(end_date.timestamp()),
+            'interval': interval,
+        }
+        data = None
+        if self.cache is not None:
+            try:
+                data = self.cache.get(QUOTES_PATH, params)
+            except response_cache.CacheMiss as e:
+                raise CMCError(str(e)) from e
+            instrumentation.count('api_cache_hits' if data is not None else 'api_cache_misses')
+        if data is None:
+            data = self.get(QUOTES_PATH, params)
+            if self.cache is not None and 'data' in data and 'quotes' in data['data']:
+                self.cache.put(QUOTES_PATH, params, data)
+        if 'data' in data and 'quotes' in data['data']:
+            return data['data']['quotes']
+        raise CMCError(f"Error fetching data for {symbol}: {data}")
+
+    def fetch_many(self, jobs, interval='daily'):
+        """Fetch several (symbol, start_date, end_date) jobs concurrently.
+
+        Yields (job, quotes, error); exactly one of `quotes` and `error` is
+        None, and any failure of a job comes back as a CMCError rather than
+        ending the batch. Jobs finish in any order, but each symbol's jobs are
+        yielded in the order given: a finished job waits for the earlier jobs
+        of its symbol. Closing the generator early waits for the requests in
+        flight and cancels the rest.
+        """
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = {pool.submit(self.fetch_quotes, *job, interval=interval): job for job in jobs}
+            # Each symbol's futures in submission order
+            queues = {}
+            for future, job in futures.items():
+                queues.setdefault(job[0], []).append(future)
+            for future in as_completed(futures):
+                queue = queues[futures[future][0]]
+                while queue and queue[0].done():
+                    head = queue.pop(0)
+                    yield self.job_result(futures[head], head)
+        finally:
+            # If the caller stops early, jobs that have not started are dropped
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def job_result(job, future):
+        try:
+            return job, future.result(), None
+        except CMCError as e:
+            return job, None, e
+        except Exception as e:
+            # A malformed response (bad JSON, missing fields) fails only its own job
+            error = CMCError(f"Error fetching data for {job[0]}: {e!r}")
+            error.__cause__ = e
+            return job, None, error
@@ -0,0 +1,199 @@
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import price_store
+import loader
+import matrix_store
+
+# Tokens per block; a block pair needs a handful of (dates x BLOCK_SIZE) float32 arrays
+BLOCK_SIZE = 512
+
+
+class CorrelationEngine:
+    """Blocked, pairwise-complete Pearson correlation of daily returns.
+
+    Tokens are split into blocks of `block_size` columns that are loaded on demand
+    through `load_block(start, stop) -> (dates x tokens) array`, so the returns never
+    have to sit in memory as a whole (e.g. when they come from a memory-mapped
+    matrix). Each block pair is computed in float32 (or `dtype`) with a handful of
+    matrix products over the validity masks, which gives pairwise-complete
+    statistics: every pair uses exactly the dates where both tokens have a return.
+    Block pairs run on a thread pool; NumPy releases the GIL inside the products.
+    """
+
+    def __init__(self, symbols, load_block, block_size=BLOCK_SIZE, min_periods=2, workers=None,
+                 dtype=np.float32):
+        self.symbols = list(symbols)
+        self.load_block = load_block
+        self.dtype = np.dtype(dtype)
+        self.block_size = block_size
+        self.min_periods = max(2, min_periods)
+        self.workers = workers or os.cpu_count() or 1
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    @classmethod
+    def from_returns(cls, returns, **kwargs):
+        """Engine over an in-memory date x token returns DataFrame."""
+        values = returns.to_numpy(dtype=kwargs.get('dtype', np.float32))
+        return cls(returns.columns, lambda start, stop: values[:, start:stop], **kwargs)
+
+    @classmethod
+    def from_prices(cls, prices, symbols, **kwargs):
+        """Engine over a date x token price array (e.g. a MatrixStore view).
+
+        Returns are derived one block at a time, so only one block of prices is
+        read into memory per worker.
+        """
+        def load_block(start, stop):
+            block = np.asarray(prices[:, start:stop], dtype=kwargs.get('dtype', np.float32))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return block[1:] / block[:-1] - 1
+        return cls(symbols, load_block, **kwargs)
+
+    def blocks_ranges(self):
+        n = len(self.symbols)
+        return [(start, min(start + self.block_size, n)) for start in range(0, n, self.block_size)]
+
+    def _prepare(self, start, stop):
+        x = np.asarray(self.load_block(start, stop), dtype=self.dtype)
+        mask = np.isfinite(x)
+        # Centre each column first so the sums below do not cancel
+        counts = mask.sum(axis=0)
+        means = np.where(counts > 0, np.where(mask, x, 0).sum(axis=0) / np.maximum(counts, 1), 0)
+        x = np.where(mask, x - means, 0).astype(self.dtype)
+        m = mask.astype(self.dtype)
+        return x, m, x * x
+
+    def _pair(self, a, b):
+        xa, ma, xxa = a
+        xb, mb, xxb = b
+        n = ma.T @ mb
+        sx = xa.T @ mb
+        sy = ma.T @ xb
+        sxx = xxa.T @ mb
+        syy = ma.T @ xxb
+        sxy = xa.T @ xb
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = sxy - sx * sy / n
+            var_x = sxx - sx * sx / n
+            var_y = syy - sy * sy / n
+            r = cov / np.sqrt(var_x * var_y)
+        r[(n < self.min_periods) | ~np.isfinite(r)] = np.nan
+        np.clip(r, -1, 1, out=r)
+        return r, n
+
+    def blocks(self):
+        """Yield (row_range, col_range, corr_block, overlap_counts) for the upper
+        triangle of block pairs (row block <= column block)."""
+        ranges = self.blocks_ranges()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for i, (r0, r1) in enumerate(ranges):
+                a = self._prepare(r0, r1)
+
+                def pair(rng, a=a, same=(r0, r1)):
+                    b = a if rng == same else self._prepare(*rng)
+                    return rng, self._pair(a, b)
+
+                for (c0, c1), (r, n) in pool.map(pair, ranges[i:]):
+                    yield (r0, r1), (c0, c1), r, n
+
+    def matrix(self, out=None):
+        """Full N x N correlation matrix (of the engine's dtype), written into `out`
+        if given (e.g. a np.memmap for matrices that do not fit in memory)."""
+        n = len(self.symbols)
+        if out is None:
+            out = np.empty((n, n), dtype=self.dtype)
+        for (r0, r1), (c0, c1), r, _ in self.blocks():
+            out[r0:r1, c0:c1] = r
+            out[c0:c1, r0:r1] = r.T
+        return out
+
+    def frame(self):
+        return pd.DataFrame(self.matrix(), index=self.symbols, columns=self.symbols)
+
+    def top_pairs(self, k=10, largest=True):
+        """The k most (or, with largest=False, least) correlated distinct pairs.
+
+        Only a running top-k is kept while blocks stream past, so memory stays at
+        one block pair regardless of N.
+        """
+        sign = 1 if largest else -1
+        best_scores = np.empty(0, dtype=self.dtype)
+        best_a = np.empty(0, dtype=np.int64)
+        best_b = np.empty(0, dtype=np.int64)
+        best_n = np.empty(0, dtype=np.int64)
+        for (r0, r1), (c0, c1), r, n in self.blocks():
+            rows, cols = np.nonzero(np.isfinite(r))
+            if r0 == c0:
+                keep = rows < cols
+                rows, cols = rows[keep], cols[keep]
+            if rows.size == 0:
+                continue
+            scores = sign * r[rows, cols]
+            if scores.size > k:
+                part = np.argpartition(-scores, k - 1)[:k]
+                rows, cols, scores = rows[part], cols[part], scores[part]
+            best_scores = np.concatenate([best_scores, scores])
+            best_a = np.concatenate([best_a, rows + r0])
+            best_b = np.concatenate([best_b, cols + c0])
+            best_n = np.concatenate([best_n, n[rows, cols].astype(np.int64)])
+            if best_scores.size > k:
+                part = np.argpartition(-best_scores, k - 1)[:k]
+                best_scores, best_a, best_b, best_n = best_scores[part], best_a[part], best_b[part], best_n[part]
+        order = np.argsort(-best_scores, kind='stable')
+        return pd.DataFrame({
+            'token_a': [self.symbols[i] for i in best_a[order]],
+            'token_b': [self.symbols[i] for i in best_b[order]],
+            'correlation': sign * best_scores[order],
+            'overlap': best_n[order],
+        })
+
+    def neighbors(self, symbol, k=10, largest=True):
+        """The k tokens most (or least) correlated with `symbol`, computed as a
+        single 1 x N strip."""
+        i = self.index[symbol]
+        target = self._prepare(i, i + 1)
+
+        def strip(rng):
+            r, _ = self._pair(target, self._prepare(*rng))
+            return r[0]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            strips = list(pool.map(strip, self.blocks_ranges()))
+        corr = pd.Series(np.concatenate(strips), index=self.symbols).drop(symbol).dropna()
+        return corr.sort_values(ascending=not largest).head(k)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Blocked correlation of daily returns with top-k queries.')
+    parser.add_argument('--db', default='crypto_data.db', help='Path to the SQLite database')
+    parser.add_argument('--matrix-store', metavar='PATH', help='Read prices from the memory-mapped matrix at PATH')
+    parser.add_argument('--tickers', nargs='+', help='Tokens to include (default: all)')
+    parser.add_argument('--top', type=int, default=10, help='Number of pairs / neighbors to report')
+    parser.add_argument('--least', action='store_true', help='Report the least correlated pairs instead')
+    parser.add_argument('--neighbors', metavar='TOKEN', help='Report the neighbors of TOKEN instead of pairs')
+    parser.add_argument('--min-periods', type=int, default=2, help='Minimum overlapping days per pair')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE, help='Tokens per block')
+    parser.add_argument('--render', action='store_true', help='Also render the full matrix as a heatmap')
+    args = parser.parse_args()
+
+    options = dict(block_size=args.block_size, min_periods=args.min_periods)
+    if args.matrix_store:
+        days, symbols, prices = matrix_store.MatrixStore(args.matrix_store).array(args.tickers)
+        engine = CorrelationEngine.from_prices(prices, symbols, **options)
+    else:
+        conn = price_store.connect(args.db, readonly=True)
+        engine = CorrelationEngine.from_returns(loader.load_returns(conn, args.tickers), **options)
+        conn.close()
+
+    if args.neighbors:
+        print(engine.neighbors(args.neighbors, args.top, largest=not args.least).to_string())
+    else:
+        print(engine.top_pairs(args.top, largest=not args.least).to_string(index=False))
+
+    if args.render:
+        # Plotting libraries are only imported when a chart is requested
+        import charts
+        charts.correlation_chart(engine.frame(), show=False)
@@ -0,0 +1,183 @@
+import argparse
+import json
+import signal
+import threading
+import time
+import price_store
+import loader
+import analytics
+import metric_cache
+import analyze_all
+import instrumentation
+import fetchData
+import response_cache
+
+# Seconds between polls of the quotes endpoint
+POLL_SECONDS = 3600
+
+# Polls are spaced out up to this many times the normal period while the API keeps
+# answering 429
+MAX_BACKOFF = 8
+
+# Delay before the next poll while older pages are still queued behind the per-cycle
+# budget
+CATCH_UP_SECONDS = 60
+
+# Share of the plan's credits one cycle may spend, leaving room for other clients
+BUDGET_SHARE = 0.8
+
+# Small key/value table holding the daemon's schedule across restarts. The per-symbol
+# fetch cursor is the ingest_state high-water mark, so a restart never refetches bars.
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daemon_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+)
+"""
+
+
+def load_state(conn):
+    conn.execute(STATE_SCHEMA)
+    return {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM daemon_state")}
+
+
+def save_state(conn, **values):
+    with conn:
+        conn.executemany(
+            "INSERT INTO daemon_state (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            [(key, json.dumps(value)) for key, value in values.items()],
+        )
+
+
+class IngestDaemon:
+    """Polls the quotes endpoint on a schedule and refreshes what the new bars affect.
+
+    Each cycle fetches only the bars after every symbol's high-water mark, at most
+    `max_jobs` pages of them (the stalest symbols first), then updates the rolling
+    statistics and matrix store for the symbols that changed and re-renders the
+    charts. The metric cache recomputes only the changed tokens and the render
+    manifest skips charts whose inputs did not change. When the API answers 429,
+    the poll period doubles (up to MAX_BACKOFF times) until a cycle goes through
+    unthrottled. SIGINT/SIGTERM finish the page being stored and exit.
+    """
+
+    def __init__(self, conn, client, symbols, interval=price_store.DAILY, poll_seconds=POLL_SECONDS,
+                 max_jobs=None, outputs=None, tickers=loader.TICKERS, cache=None, render_workers=None):
+        self.conn = conn
+        self.client = client
+        self.symbols = list(symbols)
+        self.interval = interval
+        self.poll_seconds = poll_seconds
+        if max_jobs is None:
+            credits = client.limiter.rate * poll_seconds
+            max_jobs = max(1, int(credits * BUDGET_SHARE))
+        self.max_jobs = max_jobs
+        self.outputs = outputs
+        self.tickers = list(tickers)
+        self.cache = cache
+        self.render_workers = render_workers
+        self.stop = threading.Event()
+        self.state = load_state(conn)
+
+    def install_signal_handlers(self):
+        def handle(signum, frame):
+            print(f"Received signal {signum}; stopping after the current step...")
+            self.stop.set()
+        signal.signal(signal.SIGINT, handle)
+        signal.signal(signal.SIGTERM, handle)
+
+    def refresh(self, updated):
+        """Re-render the chart set if any of its tokens got new bars."""
+        affected = sorted(set(updated) & set(self.tickers))
+        if self.outputs == [] or not affected:
+            return
+        print(f"Refreshing charts for {', '.join(affected)}...")
+        analyze_all.run(self.conn, self.outputs or list(analyze_all.OUTPUTS), self.tickers,
+                        analytics.WINDOW_SIZE, cache=self.cache, workers=self.render_workers,
+                        interval=self.interval)
+
+    def cycle(self):
+        """One poll: fetch, store, refresh. Returns the seconds until the next poll."""
+        started = time.time()
+        jobs = fetchData.plan_jobs(self.conn, self.symbols, fetchData.incremental_end(self.interval),
+                                   self.interval)
+        deferred = len(jobs) - self.max_jobs
+        jobs = jobs[:self.max_jobs]
+        throttled = self.client.throttled
+
+        updated = fetchData.fetch_and_store(self.conn, self.client, jobs, self.interval, self.stop)
+        fetchData.update_derived(self.conn, updated, self.interval)
+        if not self.stop.is_set():
+            self.refresh(updated)
+
+        backoff = self.state.get('backoff', 1)
+        if self.client.throttled > throttled:
+            backoff = min(backoff * 2, MAX_BACKOFF)
+            print(f"Rate limited during this cycle; polling every {self.poll_seconds * backoff}s.")
+        else:
+            backoff = 1
+        delay = self.poll_seconds * backoff
+        if deferred > 0 and backoff == 1:
+            print(f"{deferred} pages deferred to the next cycle.")
+            delay = min(delay, CATCH_UP_SECONDS)
+
+        self.state.update(backoff=backoff, last_started=started, last_finished=time.time(),
+                          next_poll=time.time() + delay, last_updated=sorted(updated))
+        save_state(self.conn, **self.state)
+        # One metrics record per cycle; the exit flush only writes what came after
+        instrumentation.flush(reset=True)
+        return delay
+
+    def run(self, once=False):
+        # Resume the persisted schedule rather than polling again right after a restart
+        wait = self.state.get('next_poll', 0) - time.time()
+        if wait > 0 and not once:
+            print(f"Next poll in {wait:.0f}s.")
+            self.stop.wait(wait)
+        while not self.stop.is_set():
+            delay = self.cycle()
+            if once:
+                break
+            print(f"Next poll in {delay:.0f}s.")
+            self.stop.wait(delay)
+        print("Ingest daemon stopped.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Poll for new bars and refresh the affected metrics and charts.')
+    parser.add_argument('--db', default=price_store.DB_PATH, help='Path to the SQLite database')
+    parser.add_argument('--interval', choices=list(price_store.INTERVALS), default=price_store.DAILY,
+                        help='Bar interval to ingest')
+    parser.add_argument('--poll-seconds', type=float, default=POLL_SECONDS, help='Seconds between polls')
+    parser.add_argument('--max-jobs', type=int, help='Pages fetched per cycle (default: from the rate limit)')
+    parser.add_argument('--workers', type=int, default=1, help='Concurrent fetch workers')
+    parser.add_argument('--render-workers', type=int, help='Render processes (default: one per CPU)')
+    parser.add_argument('--outputs', nargs='*', metavar='OUTPUT',
+                        help=f"Charts to refresh: {', '.join(analyze_all.OUTPUTS)} (default: all; none to disable)")
+    parser.add_argument('--no-cache', action='store_true', help='Recompute every metric instead of using the metric cache')
+    parser.add_argument('--cache-path', default=metric_cache.CACHE_PATH, help='Path of the metric cache')
+    parser.add_argument('--base-url', help='CoinMarketCap API base URL')
+    parser.add_argument('--once', action='store_true', help='Run a single cycle and exit')
+    response_cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args(args)
+    unknown = [name for name in args.outputs or [] if name not in analyze_all.OUTPUTS]
+    if unknown:
+        parser.error(f"unknown outputs: {', '.join(unknown)}")
+
+    conn = price_store.connect(args.db)
+    price_store.ensure_schema(conn, args.interval)
+    client = fetchData.make_client(args.base_url, args.workers, response_cache.open_from_args(args))
+    cache = None if args.no_cache else metric_cache.MetricCache(args.cache_path)
+    daemon = IngestDaemon(conn, client, fetchData.tickers.values(), args.interval, args.poll_seconds,
+                          args.max_jobs, args.outputs, cache=cache, render_workers=args.render_workers)
+    daemon.install_signal_handlers()
+    try:
+        daemon.run(args.once)
+    finally:
+        client.close()
+        if cache is not None:
+            cache.close()
+        conn.close()
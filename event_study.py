@@ -0,0 +1,229 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import price_store
+import loader
+import analytics
+
+# Token used as the market benchmark
+BENCHMARK = 'SOL'
+
+# Event window and (market model) estimation window, in days relative to the event date
+EVENT_WINDOW = (-3, 7)
+ESTIMATION_WINDOW = (-60, -4)
+
+# Bootstrap draws used for the significance tests
+N_BOOTSTRAP = 10000
+
+
+class Event:
+    """A dated event (conference, listing, unlock); `tokens` limits the tokens it applies to."""
+
+    def __init__(self, name, date, tokens=None):
+        self.name = name
+        self.date = pd.Timestamp(date)
+        self.tokens = list(tokens) if tokens else None
+
+
+# Breakpoint 2023 (Oct 30 - Nov 3), shown from Oct 27 to Nov 6 as in the event charts
+BREAKPOINT_2023 = Event('Breakpoint 2023', analytics.BREAKPOINT_PERIOD[0])
+
+
+# Read events from a JSON list of {"name": ..., "date": ..., "tokens": [...]} objects
+def load_events(path):
+    with open(path) as f:
+        return [Event(e['name'], e['date'], e.get('tokens')) for e in json.load(f)]
+
+
+def windows(returns, events, offsets):
+    """Gather an (events x offsets x tokens) tensor of returns in one indexing pass.
+
+    Days outside the data come back as NaN. Events are matched to the first
+    trading date on or after the event date; events before the first date or
+    after the last have no data at all.
+    """
+    values = returns.to_numpy(dtype='float64')
+    n_dates, n_tokens = values.shape
+    pad = int(np.max(np.abs(offsets))) if len(offsets) else 0
+    padded = np.full((n_dates + 2 * pad, n_tokens), np.nan)
+    padded[pad:pad + n_dates] = values
+    dates = pd.DatetimeIndex([e.date for e in events])
+    positions = returns.index.searchsorted(dates)
+    rows = positions[:, None] + np.asarray(offsets)[None, :] + pad
+    # searchsorted puts events before the first date at position 0
+    outside = positions >= n_dates
+    if n_dates:
+        outside |= dates < returns.index[0]
+    rows[outside] = 0
+    tensor = padded[rows]
+    tensor[outside] = np.nan
+    return tensor
+
+
+class EventStudyResult:
+    """Abnormal (AR) and cumulative abnormal (CAR) returns per event, day and token."""
+
+    def __init__(self, events, offsets, tokens, ar, car):
+        self.events = events
+        self.offsets = np.asarray(offsets)
+        self.tokens = list(tokens)
+        self.ar = ar
+        self.car = car
+
+    def final_car(self):
+        """Events x tokens DataFrame of the CAR at the end of the event window."""
+        names = [e.name for e in self.events]
+        return pd.DataFrame(self.car[:, -1, :], index=names, columns=self.tokens)
+
+    def car_frame(self, event=0):
+        """Relative day x token DataFrame of one event's CAR."""
+        return pd.DataFrame(self.car[event], index=pd.Index(self.offsets, name='day'), columns=self.tokens)
+
+    def tidy(self):
+        e, d, t = np.meshgrid(np.arange(len(self.events)), np.arange(len(self.offsets)),
+                              np.arange(len(self.tokens)), indexing='ij')
+        return pd.DataFrame({
+            'event': np.asarray([ev.name for ev in self.events])[e.ravel()],
+            'day': self.offsets[d.ravel()],
+            'token': np.asarray(self.tokens)[t.ravel()],
+            'ar': self.ar.ravel(),
+            'car': self.car.ravel(),
+        }).dropna(subset=['ar'])
+
+
+def event_study(returns, events, benchmark=BENCHMARK, window=EVENT_WINDOW, model='market_adjusted',
+                estimation=ESTIMATION_WINDOW):
+    """Abnormal returns of every token around every event, computed as tensors.
+
+    `model='market_adjusted'` uses AR = r - r_benchmark; `model='market'` fits
+    r = alpha + beta * r_benchmark per event and token over the estimation window
+    and uses the residuals. Tokens an event does not apply to are masked with NaN.
+    """
+    tokens = [c for c in returns.columns if c != benchmark]
+    offsets = np.arange(window[0], window[1] + 1)
+    r = windows(returns[tokens], events, offsets)
+    b = windows(returns[[benchmark]], events, offsets)  # (E, W, 1)
+
+    if model == 'market_adjusted':
+        ar = r - b
+    elif model == 'market':
+        est = np.arange(estimation[0], estimation[1] + 1)
+        re = windows(returns[tokens], events, est)
+        be = np.broadcast_to(windows(returns[[benchmark]], events, est), re.shape)
+        valid = np.isfinite(re) & np.isfinite(be)
+        n = valid.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_r = np.where(valid, re, 0).sum(axis=1) / n
+            mean_b = np.where(valid, be, 0).sum(axis=1) / n
+            dr = np.where(valid, re - mean_r[:, None, :], 0)
+            db = np.where(valid, be - mean_b[:, None, :], 0)
+            beta = (dr * db).sum(axis=1) / (db * db).sum(axis=1)
+        alpha = mean_r - beta * mean_b
+        ar = r - (alpha[:, None, :] + beta[:, None, :] * b)
+    else:
+        raise ValueError(f"Unknown event study model: {model}")
+
+    # Restrict events to the tokens they apply to
+    token_pos = {t: i for i, t in enumerate(tokens)}
+    for i, event in enumerate(events):
+        if event.tokens is not None:
+            keep = np.zeros(len(tokens), dtype=bool)
+            keep[[token_pos[t] for t in event.tokens if t in token_pos]] = True
+            ar[i, :, ~keep] = np.nan
+
+    car = np.where(np.isnan(ar), np.nan, np.nancumsum(ar, axis=1))
+    return EventStudyResult(events, offsets, tokens, ar, car)
+
+
+# One worker's share of bootstrap means: resample along axis 0 of `sample` (n x k).
+# Each resample is a row of draw counts per observation, so a block of draws is two
+# (draws x n) @ (n x k) products instead of a (draws x n x k) gather.
+def bootstrap_chunk(args):
+    sample, draws, seed = args
+    rng = np.random.default_rng(seed)
+    n, k = sample.shape
+    valid = np.isfinite(sample)
+    filled = np.where(valid, sample, 0.0)
+    valid = valid.astype('float64')
+    means = np.empty((draws, k))
+    for start in range(0, draws, 256):
+        stop = min(start + 256, draws)
+        idx = rng.integers(0, n, size=(stop - start, n))
+        offsets = np.arange(stop - start)[:, None] * n
+        counts = np.bincount((idx + offsets).ravel(), minlength=(stop - start) * n).reshape(stop - start, n)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # A resample can miss every valid row of a column; its mean is NaN
+            means[start:stop] = (counts @ filled) / (counts @ valid)
+    return means
+
+
+def bootstrap_test(sample, n_bootstrap=N_BOOTSTRAP, workers=None, seed=0):
+    """Two-sided bootstrap test that the mean of each column of `sample` is zero.
+
+    Rows are resampled with replacement; the draws are split across worker
+    processes. A draw that missed every valid value of a column has no mean and
+    is left out of that column's p-value altogether. Returns (mean, p_value,
+    draws) arrays, one entry per column; `draws` counts the usable draws.
+    """
+    sample = np.asarray(sample, dtype='float64')
+    counts = np.isfinite(sample).sum(axis=0)
+    observed = np.full(sample.shape[1], np.nan)
+    observed[counts > 0] = np.nanmean(sample[:, counts > 0], axis=0)
+    centred = sample - observed
+    workers = workers or os.cpu_count() or 1
+    shares = [n_bootstrap // workers + (i < n_bootstrap % workers) for i in range(workers)]
+    tasks = [(centred, draws, seed + i) for i, draws in enumerate(shares) if draws]
+    if len(tasks) == 1:
+        means = bootstrap_chunk(tasks[0])
+    else:
+        with ProcessPoolExecutor(max_workers=len(tasks)) as pool:
+            means = np.concatenate(list(pool.map(bootstrap_chunk, tasks)))
+    usable = np.isfinite(means)
+    draws = usable.sum(axis=0)
+    extreme = (usable & (np.abs(means) >= np.abs(observed))).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p_value = extreme / draws
+    # Not testable with fewer than two observations
+    p_value[counts < 2] = np.nan
+    return observed, p_value, draws
+
+
+def significance(result, n_bootstrap=N_BOOTSTRAP, workers=None):
+    """Bootstrap p-values for the final CAR: per token across events, and per event
+    across tokens (the cross-sectional CAAR)."""
+    final = result.final_car()
+    per_token = pd.DataFrame(dict(zip(('mean_car', 'p_value', 'draws'),
+                                      bootstrap_test(final.to_numpy(), n_bootstrap, workers))),
+                             index=final.columns)
+    per_event = pd.DataFrame(dict(zip(('caar', 'p_value', 'draws'),
+                                      bootstrap_test(final.to_numpy().T, n_bootstrap, workers))),
+                             index=final.index)
+    return per_token, per_event
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Event study of token returns against a benchmark.')
+    parser.add_argument('--db', default='crypto_data.db', help='Path to the SQLite database')
+    parser.add_argument('--events', help='JSON file of events (default: Breakpoint 2023)')
+    parser.add_argument('--benchmark', default=BENCHMARK, help='Benchmark token')
+    parser.add_argument('--model', choices=['market_adjusted', 'market'], default='market_adjusted')
+    parser.add_argument('--window', type=int, nargs=2, default=EVENT_WINDOW, metavar=('START', 'END'),
+                        help='Event window in days relative to the event date')
+    parser.add_argument('--bootstrap', type=int, default=N_BOOTSTRAP, help='Bootstrap draws (0 to skip)')
+    parser.add_argument('--workers', type=int, help='Bootstrap worker processes (default: one per CPU)')
+    args = parser.parse_args()
+
+    events = load_events(args.events) if args.events else [BREAKPOINT_2023]
+    conn = price_store.connect(args.db, readonly=True)
+    returns = analytics.daily_returns(loader.load_price_matrix(conn).asfreq('D'))
+    conn.close()
+
+    result = event_study(returns, events, args.benchmark, tuple(args.window), args.model)
+    print("Final cumulative abnormal returns:\n", result.final_car().T.to_string())
+    if args.bootstrap:
+        per_token, per_event = significance(result, args.bootstrap, args.workers)
+        print("\nPer token (across events):\n", per_token.to_string())
+        print("\nPer event (across tokens):\n", per_event.to_string())
@@ -1,18 +1,20 @@
-import requests
+import argparse
 import pandas as pd
-import sqlite3
-import time
-import config  # Import the config module
-
-# Use the API key from config.py
-API_KEY = config.API_KEY
-headers = {
-    'Accepts': 'application/json',
-    'X-CMC_PRO_API_KEY': API_KEY,
-}
-
-# Base URL for the CoinMarketCap API
-base_url = 'https://pro-api.coinmarketcap.com/v1/cryptocurrency/quotes/historical'
+import price_store
+import cmc_client
+import rolling_state
+import matrix_store
+import instrumentation
+import response_cache
+
+# Use the API key from config.py; the rate limit follows the plan's credits per minute.
+# config.py is optional when every response is replayed from the API cache.
+try:
+    import config  # Import the config module
+except ImportError:
+    config = None
+API_KEY = getattr(config, 'API_KEY', None)
+CREDITS_PER_MINUTE = getattr(config, 'CREDITS_PER_MINUTE', 30)
 
 # Define the tickers you want to pull data for
 tickers = {
@@ -27,84 +29,164 @@ tickers = {
     'Raydium': 'RAY',
     'Bonk': 'BONK'
 }
+names = {symbol: name for name, symbol in tickers.items()}
 
 # Define the start and end dates for the historical data
 fixed_start_date = pd.Timestamp('2023-10-01').tz_localize(None)
 fixed_end_date = pd.Timestamp('2023-12-01').tz_localize(None)
 
-# SQLite database connection
-conn = sqlite3.connect('crypto_data.db')
-c = conn.cursor()
-
-# Function to check if a table exists
-def table_exists(symbol):
-    c.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{symbol}';")
-    return c.fetchone() is not None
-
-# Function to fetch historical data
-def fetch_historical_data(symbol, start_date, end_date):
-    time.sleep(2)  # Adjust delay as needed to stay within rate limits
-    url = f'{base_url}?symbol={symbol}&time_start={int(start_date.timestamp())}&time_end={int(end_date.timestamp())}&interval=daily'
-    response = requests.get(url, headers=headers)
-    data = response.json()
-
-    if 'data' in data and 'quotes' in data['data']:
-        ohlcv = data['data']['quotes']
-        df = pd.DataFrame(ohlcv)
-        
-        # Flatten the nested dictionaries (if any)
-        df = df.applymap(lambda x: str(x) if isinstance(x, dict) else x)
-        print(f"Fetched data for {symbol}:\n{df.head()}")  # Log fetched data
-        
-        return df
-    else:
-        print(f"Error fetching data for {symbol}: {data}")
-        return None
-
-# Function to store data in SQLite
-def store_data_in_sqlite(df, symbol):
-    print(f"Storing data for {symbol} in the database...")  # Log storage action
-    df.to_sql(symbol, conn, if_exists='replace', index=False)
-    print(f"Data for {symbol} stored in SQLite database.")
 
-# Main data fetching and storing loop
-for name, symbol in tickers.items():
-    if table_exists(symbol):
-        # Retrieve the most recent date from the local database
-        query = f"SELECT MAX(timestamp) FROM {symbol}"
-        c.execute(query)
-        last_date = c.fetchone()[0]
-        if last_date:
-            last_date = pd.to_datetime(last_date).tz_localize(None)
-            start_date = last_date + pd.DateOffset(days=1)
+# Pooled, rate-limited API client shared by all workers, optionally backed by a
+# response_cache.ResponseCache
+def make_client(base_url=None, workers=1, cache=None):
+    if not API_KEY and (cache is None or cache.mode != 'replay'):
+        raise cmc_client.CMCError("No API_KEY in config.py; only --api-cache replay runs without one")
+    return cmc_client.CMCClient(API_KEY, base_url=base_url or getattr(config, 'BASE_URL', cmc_client.BASE_URL),
+                                credits_per_minute=CREDITS_PER_MINUTE, max_workers=workers, cache=cache)
+
+
+# End of the range to fetch in incremental mode: the start of the current UTC day (or
+# intraday bar)
+def incremental_end(interval=price_store.DAILY):
+    bar_length = pd.Timedelta(seconds=price_store.INTERVALS[interval])
+    return pd.Timestamp.now(tz='UTC').floor(bar_length).tz_localize(None)
+
+
+# Function to store fetched quotes in SQLite. With advance=False the symbol's high-water
+# mark is left for the caller to move. Returns the latest stored timestamp (or None).
+def store_data_in_sqlite(conn, quotes, symbol, interval=price_store.DAILY, advance=True):
+    # Flatten each quote into typed columns matching the prices table
+    with instrumentation.stage('parse') as stage:
+        rows = [price_store.quote_to_row(symbol, quote) for quote in quotes]
+        stage.add(rows=len(rows))
+    print(f"Storing {len(rows)} rows for {symbol} in the database...")  # Log storage action
+    # Upsert in one transaction, together with the high-water mark when it advances
+    with instrumentation.stage('store') as stage:
+        stage.add(rows=price_store.upsert_rows(conn, rows, interval=interval, advance=advance))
+    print(f"Data for {symbol} stored in SQLite database.")
+    return max((row[1] for row in rows), default=None)
+
+
+# Work out the date range still missing for every symbol and split it into API-sized
+# pages. Returns (symbol, page_start, page_end) jobs, the stalest symbols first.
+def plan_jobs(conn, symbols, end_date=fixed_end_date, interval=price_store.DAILY, page_days=None):
+    page_days = page_days or cmc_client.INTERVAL_PAGE_DAYS[interval]
+    bar_length = pd.Timedelta(seconds=price_store.INTERVALS[interval])
+    ranges = []
+    for symbol in symbols:
+        # Retrieve the high-water mark for this symbol from the local database
+        last_ts = price_store.last_timestamp(conn, symbol, interval)
+        if last_ts is not None:
+            last_date = pd.to_datetime(last_ts, unit='s')
+            start_date = last_date + bar_length
         else:
-            start_date = fixed_start_date  # Start from the fixed start date
-    else:
-        # If the table doesn't exist, fetch data from the fixed start date
-        start_date = fixed_start_date
-    
-    end_date = fixed_end_date
-    
-    # Ensure start_date is always before end_date
-    if start_date >= end_date:
-        print(f"Invalid date range for {symbol}: start_date {start_date} is not before end_date {end_date}")
-        continue
-    
-    print(f"Fetching daily data for {name} ({symbol}) from {start_date.date()} to {end_date.date()}...")
-    df = fetch_historical_data(symbol, start_date, end_date)
-    if df is not None:
-        # Store in SQLite
-        store_data_in_sqlite(df, symbol)
-    else:
-        print(f"Failed to fetch data for {name}.")
-
-print("Daily data fetching and storing complete.")
-
-# Close the SQLite connection
-conn.close()
-
-
-
-
-
-
+            # If the symbol has no rows yet, fetch data from the fixed start date
+            start_date = fixed_start_date
+
+        # Ensure start_date is always before end_date; symbols that are already up to
+        # date are skipped quietly
+        if start_date >= end_date:
+            if last_ts is None:
+                print(f"Invalid date range for {symbol}: start_date {start_date} is not before end_date {end_date}")
+            continue
+
+        print(f"Fetching {interval} data for {names.get(symbol, symbol)} ({symbol}) from {start_date} to {end_date}...")
+        ranges.append((start_date, symbol))
+
+    jobs = []
+    for start_date, symbol in sorted(ranges):
+        # Split long ranges into API-sized pages
+        for page_start, page_end in cmc_client.page_ranges(start_date, end_date, page_days):
+            jobs.append((symbol, page_start, page_end))
+    return jobs
+
+
+# Fetch concurrently; results are stored from this thread as they arrive. Stops taking
+# results once `stop` (a threading.Event) is set; every stored page is committed on its
+# own, so stopping early never leaves a half-written page. Returns the updated symbols.
+#
+# A symbol's high-water mark only moves through the run of pages that succeeded without
+# a gap from its planned start: after a failed page the later pages are still stored,
+# but the next plan_jobs starts again at the failed page instead of skipping it.
+def fetch_and_store(conn, client, jobs, interval=price_store.DAILY, stop=None):
+    updated_symbols = set()
+    # Pages of every symbol in planned order, and the latest timestamp of each page
+    # stored so far (None for a page without quotes)
+    pending, stored = {}, {}
+    for job in jobs:
+        pending.setdefault(job[0], []).append(job)
+    with instrumentation.stage('fetch'):
+        for job, quotes, error in client.fetch_many(jobs, interval=interval):
+            symbol = job[0]
+            if error is None:
+                # Store in SQLite
+                stored[job] = store_data_in_sqlite(conn, quotes, symbol, interval, advance=False)
+                updated_symbols.add(symbol)
+                high_water = None
+                pages = pending[symbol]
+                while pages and pages[0] in stored:
+                    high_water = stored.pop(pages.pop(0)) or high_water
+                if high_water is not None:
+                    with conn:
+                        price_store.record_high_water(conn, {symbol: high_water}, interval)
+            else:
+                # Pin the mark just before the earliest unfinished page, so a symbol
+                # without one yet doesn't fall back to MAX(ts) of the later pages
+                first_start = pending[symbol][0][1]
+                with conn:
+                    price_store.record_high_water(
+                        conn, {symbol: price_store.to_epoch_seconds(first_start) - price_store.INTERVALS[interval]},
+                        interval)
+                instrumentation.count('fetch_errors')
+                print(error)
+                print(f"Failed to fetch data for {names.get(symbol, symbol)}.")
+            if stop is not None and stop.is_set():
+                break
+    return updated_symbols
+
+
+# Bring the derived daily stores up to date with the new bars
+def update_derived(conn, symbols, interval=price_store.DAILY):
+    if interval != price_store.DAILY:
+        return
+    # Feed the new bars into the streaming rolling statistics (constant work per bar)
+    with instrumentation.stage('rolling_state'):
+        rolling_state.update(conn, sorted(symbols))
+
+    # Keep the memory-mapped price matrix in sync, if one has been built
+    with instrumentation.stage('matrix_sync') as stage:
+        stage.add(rows=matrix_store.sync_if_present(conn, sorted(symbols)))
+
+
+if __name__ == '__main__':
+    # Command line options: the number of concurrent workers and an optional API base URL
+    # (e.g. a local stub server for testing)
+    parser = argparse.ArgumentParser(description='Fetch CoinMarketCap quotes into crypto_data.db.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of concurrent fetch workers')
+    parser.add_argument('--incremental', action='store_true', help='Fetch up to today instead of the fixed end date')
+    parser.add_argument('--interval', choices=list(price_store.INTERVALS), default=price_store.DAILY,
+                        help='Bar interval to fetch; each interval is stored in its own table')
+    parser.add_argument('--page-days', type=int, help='Longest date range requested per API call (default: by interval)')
+    parser.add_argument('--base-url', default=getattr(config, 'BASE_URL', cmc_client.BASE_URL), help='CoinMarketCap API base URL')
+    response_cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.configure_from_args(args)
+
+    # SQLite database connection (creates the normalized prices table of the interval if needed)
+    conn = price_store.connect()
+    price_store.ensure_schema(conn, args.interval)
+    client = make_client(args.base_url, args.workers, response_cache.open_from_args(args))
+
+    # In incremental mode refresh up to the start of the current UTC day (or intraday bar)
+    end_date = incremental_end(args.interval) if args.incremental else fixed_end_date
+
+    jobs = plan_jobs(conn, tickers.values(), end_date, args.interval, args.page_days)
+    updated_symbols = fetch_and_store(conn, client, jobs, args.interval)
+    update_derived(conn, updated_symbols, args.interval)
+
+    print(f"{args.interval.capitalize()} data fetching and storing complete.")
+
+    # Close the API session and the SQLite connection
+    client.close()
+    conn.close()
@@ -1,62 +1,28 @@
-import sqlite3
-import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-import ast
+import loader
+import price_store
+import pipeline
+import charts
 
-# Connect to the SQLite database
-conn = sqlite3.connect('crypto_data.db')
+# Connect to the SQLite database (read-only, so a running fetch is never blocked)
+conn = price_store.connect('crypto_data.db', readonly=True)
 
 # Define the tickers you want to visualize
-tickers = [
-    'ATLAS', 'POLIS', 'RNDR', 'PSY', 'ORCA',
-    'HNT', 'SOL', 'MNGO', 'SBR', 'RAY', 'BONK'
-]
-
-# Initialize an empty DataFrame to hold all the percentage changes
-all_pct_changes = pd.DataFrame()
-
-# Loop through each ticker and fetch the data
-for ticker in tickers:
-    try:
-        query = f"SELECT timestamp, quote FROM {ticker} ORDER BY timestamp"
-        df = pd.read_sql(query, conn, parse_dates=['timestamp'])
-        
-        # Extract the closing price from the 'quote' dictionary
-        df['close'] = df['quote'].apply(lambda x: ast.literal_eval(x)['USD']['price'])
-        
-        # Calculate the percentage change day-over-day
-        df['pct_change'] = df['close'].pct_change() * 100  # Convert to percentage
-        
-        # Add the percentage change to the all_pct_changes DataFrame
-        df.set_index('timestamp', inplace=True)
-        all_pct_changes[ticker] = df['pct_change']
-    
-    except pd.io.sql.DatabaseError:
-        print(f"No table found for {ticker}. Skipping...")
-        continue
-    
-    except KeyError as e:
-        print(f"KeyError for {ticker}: {e}. Skipping this token.")
-        continue
-
-# Drop rows with NaN values (which occur due to the pct_change calculation)
-all_pct_changes.dropna(inplace=True)
-
-# Creating the heatmap
-plt.figure(figsize=(16, 10))
-sns.heatmap(all_pct_changes.T, cmap='RdYlGn', center=0, annot=False, linewidths=.5, cbar_kws={'label': '% Change'})
-plt.title('Heatmap of Daily % Change in Close Price for Cryptocurrencies')
-plt.xlabel('Date')
-plt.ylabel('Token')
-plt.xticks(rotation=45, ha='right')
-plt.tight_layout()
-
-# Save the heatmap to the main directory
-plt.savefig('crypto_daily_pct_change_heatmap.png')
-
-# Show the heatmap
-plt.show()
+tickers = loader.TICKERS
+
+# Every ticker as a date x token price matrix on the daily calendar, checked for gaps,
+# duplicates and outlier ticks, and its day-over-day returns
+prices = pipeline.prices(conn).select(tickers)
+daily_returns = prices.returns()
+loader.report_missing(tickers, prices.to_frame().columns)
+prices.source.quality.print_summary()
+
+if charts.use_scalable_heatmap(*daily_returns.to_frame().shape):
+    # Long histories / many tokens: weekly buckets drawn as a single rasterized image
+    daily_returns.plot('scalable_heatmap_chart', bucket='weekly', sort_by='mean')
+else:
+    # Convert to percentages and drop the rows where no token has a return (the first
+    # day, due to the pct_change calculation); a gap in one token stays a blank cell
+    daily_returns.pct().dropna().plot('heatmap_chart')
 
 # Close the SQLite connection
 conn.close()
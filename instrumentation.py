@@ -0,0 +1,286 @@
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Instrumentation is off unless configured, either from the command line of a script
+# (add_arguments/configure_from_args) or from the environment:
+#   METRICS_FILE    where to write the metrics (*.prom selects the Prometheus format)
+#   METRICS_FORMAT  'jsonl' (default) or 'prometheus'
+#   PROFILE_STAGE   name of one stage to profile
+#   PROFILER        'cprofile' (default) or 'tracemalloc'
+# When off, stage() returns a shared no-op context and count() returns immediately.
+ENABLED = False
+
+FORMATS = ('jsonl', 'prometheus')
+PROFILERS = ('cprofile', 'tracemalloc')
+
+# Prefix of the Prometheus metric names
+PROM_PREFIX = 'crypto'
+
+_config = {}
+_stages = {}
+_counters = {}
+_profile = {}
+_local = threading.local()
+_lock = threading.Lock()
+# Held by the one stage pass being profiled. cProfile and tracemalloc are process
+# state (tracemalloc.stop() ends tracing for every thread), so two passes must never
+# profile at once
+_profile_lock = threading.Lock()
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far, or None where unsupported."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, **counts):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class Stage:
+    """Times one pass through a named stage and collects its counts (rows, bytes, ...).
+
+    count() calls made on the same thread while the stage is open are added to it;
+    time spent in nested stages is included in their parents. When the stage is the
+    one selected for profiling, its passes are profiled one at a time: a pass that
+    starts while another thread is profiling (or nested in a profiled pass) runs
+    unprofiled, and cProfile only sees the thread that entered the pass.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = {}
+        self.profiled = False
+
+    def __enter__(self):
+        if _config.get('profile_stage') == self.name:
+            self.profiled = _profile_lock.acquire(blocking=False)
+        if self.profiled:
+            if _config['profiler'] == 'tracemalloc':
+                tracemalloc.start()
+            else:
+                _profile.setdefault('profile', cProfile.Profile()).enable()
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        _local.stack.remove(self)
+        if self.profiled:
+            if _config['profiler'] == 'tracemalloc':
+                peak = tracemalloc.get_traced_memory()[1]
+                if peak >= _profile.get('tracemalloc_peak_bytes', 0):
+                    _profile['tracemalloc_peak_bytes'] = peak
+                    _profile['snapshot'] = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+            else:
+                _profile['profile'].disable()
+            self.profiled = False
+            _profile_lock.release()
+        record(self.name, seconds, self.counts)
+        return False
+
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+
+def stage(name):
+    """Context manager timing the stage `name`; a no-op unless instrumentation is on."""
+    if not ENABLED:
+        return NULL_STAGE
+    return Stage(name)
+
+
+def count(name, value=1):
+    """Add `value` to the run-wide counter `name` and to the stages open on this thread."""
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    for open_stage in getattr(_local, 'stack', ()):
+        open_stage.add(**{name: value})
+
+
+# Fold one pass through a stage into its running totals
+def record(name, seconds, counts):
+    with _lock:
+        stats = _stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'counts': {}})
+        stats['calls'] += 1
+        stats['seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+        for key, value in counts.items():
+            stats['counts'][key] = stats['counts'].get(key, 0) + value
+        stats['peak_rss_bytes'] = peak_rss_bytes()
+
+
+def configure(path, fmt=None, profile_stage=None, profiler='cprofile', script=None):
+    """Turn instrumentation on; metrics are written to `path` when the process exits."""
+    global ENABLED
+    if fmt is None:
+        fmt = 'prometheus' if path.endswith('.prom') else 'jsonl'
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown metrics format: {fmt}")
+    if profiler not in PROFILERS:
+        raise ValueError(f"Unknown profiler: {profiler}")
+    first = not ENABLED
+    _config.update(path=path, format=fmt, profile_stage=profile_stage, profiler=profiler,
+                   script=script or os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0],
+                   run=uuid.uuid4().hex[:12], started=time.time())
+    ENABLED = True
+    if first:
+        atexit.register(flush)
+
+
+def configure_from_env():
+    path = os.environ.get('METRICS_FILE')
+    if path:
+        configure(path, os.environ.get('METRICS_FORMAT'), os.environ.get('PROFILE_STAGE'),
+                  os.environ.get('PROFILER', 'cprofile'))
+
+
+def add_arguments(parser):
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='Write per-stage metrics to PATH (JSON lines, or a Prometheus textfile for *.prom)')
+    parser.add_argument('--metrics-format', choices=FORMATS, help='Format of the metrics file')
+    parser.add_argument('--profile-stage', metavar='STAGE', help='Profile one stage (needs --metrics)')
+    parser.add_argument('--profiler', choices=PROFILERS, default='cprofile', help='Profiler used by --profile-stage')
+
+
+def configure_from_args(args):
+    if args.metrics:
+        configure(args.metrics, args.metrics_format, args.profile_stage, args.profiler)
+
+
+def snapshot(reset=False):
+    """The metrics collected so far as one JSON-serializable dict. With `reset`, the
+    totals start again from zero in the same step, so no pass is counted twice or lost."""
+    with _lock:
+        now = time.time()
+        metrics = {
+            'run': _config.get('run'),
+            'script': _config.get('script'),
+            'started': _config.get('started'),
+            'seconds': now - _config.get('started', now),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'counters': dict(_counters),
+            'stages': {name: dict(stats, counts=dict(stats['counts'])) for name, stats in _stages.items()},
+        }
+        if reset:
+            _stages.clear()
+            _counters.clear()
+            _config.update(started=now, flushed=True)
+        return metrics
+
+
+def prometheus_text(metrics):
+    script = metrics['script']
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {PROM_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PROM_PREFIX}_{name} {kind}")
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{val}"' for key, val in [('script', script)] + labels)
+            lines.append(f"{PROM_PREFIX}_{name}{{{label_text}}} {value}")
+
+    stages = metrics['stages']
+    metric('stage_seconds', 'gauge', 'Wall time spent in a stage during the last run.',
+           [([('stage', name)], stats['seconds']) for name, stats in stages.items()])
+    metric('stage_calls', 'gauge', 'Times a stage was entered during the last run.',
+           [([('stage', name)], stats['calls']) for name, stats in stages.items()])
+    metric('stage_count', 'gauge', 'Counts (rows, API calls, bytes, ...) recorded inside a stage.',
+           [([('stage', name), ('counter', key)], value)
+            for name, stats in stages.items() for key, value in stats['counts'].items()])
+    metric('run_count', 'gauge', 'Counts recorded during the last run.',
+           [([('counter', key)], value) for key, value in metrics['counters'].items()])
+    metric('run_seconds', 'gauge', 'Wall time of the last run.', [([], metrics['seconds'])])
+    if metrics['peak_rss_bytes'] is not None:
+        metric('peak_rss_bytes', 'gauge', 'Peak resident memory of the last run.', [([], metrics['peak_rss_bytes'])])
+    metric('last_run_timestamp_seconds', 'gauge', 'Start time of the last run.', [([], metrics['started'])])
+    return '\n'.join(lines) + '\n'
+
+
+# Print (and for cProfile, save) the profile of the selected stage. While another
+# thread is inside a profiled pass the report is left for the next flush, rather than
+# reading a profiler that is still running (or waiting on a thread stuck at exit)
+def report_profile():
+    if not _profile_lock.acquire(blocking=False):
+        return
+    try:
+        _report_profile()
+    finally:
+        _profile_lock.release()
+
+
+def _report_profile():
+    name = _config.get('profile_stage')
+    if 'profile' in _profile:
+        path = f"{name}.prof"
+        _profile['profile'].dump_stats(path)
+        print(f"Profile of stage '{name}' written to {path}")
+        pstats.Stats(_profile['profile']).sort_stats('cumulative').print_stats(15)
+    if 'snapshot' in _profile:
+        print(f"Top allocations in stage '{name}' (peak {_profile['tracemalloc_peak_bytes'] / 2**20:.1f} MB):")
+        for stat in _profile['snapshot'].statistics('lineno')[:10]:
+            print(f"  {stat}")
+    _profile.clear()
+
+
+def flush(reset=False):
+    """Write the collected metrics: one JSON line appended per run, or a Prometheus
+    textfile replaced atomically (for node_exporter's textfile collector).
+
+    A long-running process flushes with `reset` after each unit of work (a daemon
+    cycle), so every record covers only what happened since the previous one; the
+    flush at exit then writes the remainder, and nothing when there is none.
+    """
+    if not ENABLED:
+        return
+    report_profile()
+    metrics = snapshot(reset)
+    if _config.get('flushed') and not reset and not (metrics['stages'] or metrics['counters']):
+        return
+    path = _config['path']
+    if _config['format'] == 'prometheus':
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(prometheus_text(metrics))
+        os.replace(tmp, path)
+    else:
+        with open(path, 'a') as f:
+            f.write(json.dumps(metrics, sort_keys=True) + '\n')
+
+
+configure_from_env()
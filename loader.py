@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import price_store
+import instrumentation
+
+# Tokens covered by the analysis scripts
+TICKERS = [
+    'ATLAS', 'POLIS', 'RNDR', 'PSY', 'ORCA',
+    'HNT', 'SOL', 'MNGO', 'SBR', 'RAY', 'BONK'
+]
+
+
+# Convert a date-like bound (str, Timestamp, datetime) to a UTC epoch day
+def to_epoch_day(value):
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert('UTC').tz_localize(None)
+    return int(ts.value // 10**9) // price_store.SECONDS_PER_DAY
+
+
+# Convert an array of UTC epoch days to a naive (UTC) DatetimeIndex
+def days_to_index(days):
+    return pd.DatetimeIndex(pd.to_datetime(np.asarray(days, dtype='int64') * price_store.SECONDS_PER_DAY, unit='s'), name='timestamp')
+
+
+# Convert an array of UTC epoch seconds to a naive (UTC) DatetimeIndex
+def seconds_to_index(seconds):
+    return pd.DatetimeIndex(pd.to_datetime(np.asarray(seconds, dtype='int64'), unit='s'), name='timestamp')
+
+
+def load_arrays(conn, symbols=None, start=None, end=None, columns=('price',), interval=price_store.DAILY):
+    """Read several symbols with one query and pivot them into dense arrays.
+
+    Returns (days, symbols, {column: array}) where each array has shape
+    (len(days), len(symbols)) and holds NaN where a symbol has no row for a day.
+    `start`/`end` are inclusive date bounds and `columns` selects which quote
+    fields are read. Symbols without any rows are left out of the result.
+    For intraday intervals the rows are bars and `days` holds their epoch
+    seconds instead.
+    """
+    columns = [columns] if isinstance(columns, str) else list(columns)
+    unknown = set(columns) - set(price_store.QUOTE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown price columns: {sorted(unknown)}")
+
+    where, params = [], []
+    if symbols is not None:
+        symbols = list(symbols)
+        if not symbols:
+            return np.empty(0, dtype='int64'), [], {col: np.empty((0, 0)) for col in columns}
+        where.append(f"symbol IN ({', '.join('?' for _ in symbols)})")
+        params.extend(symbols)
+    # Intraday tables are read by timestamp so the bounds are a range on the primary key
+    key = 'day' if interval == price_store.DAILY else 'ts'
+    scale = 1 if interval == price_store.DAILY else price_store.SECONDS_PER_DAY
+    if start is not None:
+        where.append(f"{key} >= ?")
+        params.append(to_epoch_day(start) * scale)
+    if end is not None:
+        where.append(f"{key} < ?")
+        params.append((to_epoch_day(end) + 1) * scale)
+
+    query = f"SELECT symbol, {key}, {', '.join(columns)} FROM {price_store.prices_table(interval)}"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    with instrumentation.stage('sql_read') as stage:
+        rows = conn.execute(query, params).fetchall()
+        stage.add(rows=len(rows))
+
+    if not rows:
+        return np.empty(0, dtype='int64'), [], {col: np.empty((0, 0)) for col in columns}
+
+    row_symbols, row_days, *values = zip(*rows)
+    days, day_pos = np.unique(np.asarray(row_days, dtype='int64'), return_inverse=True)
+    present, sym_pos = np.unique(np.asarray(row_symbols, dtype=object), return_inverse=True)
+
+    # Keep the caller's symbol order; symbols with no rows are dropped
+    if symbols is not None:
+        present_set = set(present)
+        order = [s for s in dict.fromkeys(symbols) if s in present_set]
+    else:
+        order = sorted(present)
+    remap = np.empty(len(present), dtype='int64')
+    lookup = {s: i for i, s in enumerate(order)}
+    for i, s in enumerate(present):
+        remap[i] = lookup[s]
+    sym_pos = remap[sym_pos]
+
+    arrays = {}
+    for col, col_values in zip(columns, values):
+        matrix = np.full((len(days), len(order)), np.nan)
+        matrix[day_pos, sym_pos] = np.asarray(col_values, dtype='float64')
+        arrays[col] = matrix
+    return days, order, arrays
+
+
+def load_price_matrix(conn, symbols=None, start=None, end=None, column='price', interval=price_store.DAILY):
+    """Date x token DataFrame of one quote field, read with a single query (one row
+    per bar for intraday intervals)."""
+    keys, order, arrays = load_arrays(conn, symbols, start, end, columns=(column,), interval=interval)
+    index = days_to_index(keys) if interval == price_store.DAILY else seconds_to_index(keys)
+    return pd.DataFrame(arrays[column], index=index, columns=pd.Index(order, name='symbol'))
+
+
+def load_returns(conn, symbols=None, start=None, end=None):
+    """Date x token DataFrame of daily simple returns (as decimals) on a contiguous
+    daily calendar, so a missing day is a gap rather than a two-day return."""
+    prices = load_price_matrix(conn, symbols, start, end)
+    if len(prices):
+        prices = prices.asfreq('D')
+    return prices.pct_change(fill_method=None)
+
+
+# Print a note for every requested symbol that has no data in the store
+def report_missing(requested, loaded):
+    loaded = set(loaded)
+    for symbol in requested:
+        if symbol not in loaded:
+            print(f"No data found for {symbol}. Skipping...")
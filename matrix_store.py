@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+import price_store
+import loader
+
+# Default location of the on-disk price matrix
+STORE_PATH = 'price_matrix'
+
+DATA_FILE = 'prices.f32'
+META_FILE = 'meta.json'
+
+# Symbols per query when syncing (keeps us under SQLite's bound-parameter limit)
+SYNC_CHUNK = 400
+
+
+class MatrixStore:
+    """Aligned date x token price matrix kept as a memory-mapped float32 file.
+
+    Rows are consecutive UTC days starting at `start_day`, columns are tokens in
+    the order they were first seen; missing prices are NaN. The file is allocated
+    with spare capacity in both dimensions so daily appends and new tokens rarely
+    need a rewrite. Readers map the file read-only, so date windows and
+    contiguous token ranges are views into the page cache rather than copies.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.meta = None
+        self.columns = {}
+
+    @property
+    def data_path(self):
+        return os.path.join(self.path, DATA_FILE)
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.path, META_FILE)
+
+    def exists(self):
+        return os.path.exists(self.meta_path)
+
+    def load_meta(self):
+        with open(self.meta_path) as f:
+            self.meta = json.load(f)
+        self.columns = {symbol: i for i, symbol in enumerate(self.meta['symbols'])}
+        return self.meta
+
+    def _save_meta(self):
+        tmp = self.meta_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self.meta_path)
+
+    def _map(self, mode='r'):
+        shape = (self.meta['capacity_days'], self.meta['capacity_tokens'])
+        return np.memmap(self.data_path, dtype=np.float32, mode=mode, shape=shape)
+
+    def _allocate(self, start_day, capacity_days, capacity_tokens, old=None, row_offset=0):
+        # Write a new, larger file next to the old one and swap it in atomically
+        tmp = self.data_path + '.tmp'
+        data = np.memmap(tmp, dtype=np.float32, mode='w+', shape=(capacity_days, capacity_tokens))
+        data[:] = np.nan
+        if old is not None:
+            rows, cols = old.shape
+            data[row_offset:row_offset + rows, :cols] = old
+        data.flush()
+        del data
+        os.replace(tmp, self.data_path)
+        self.meta.update(start_day=start_day, capacity_days=capacity_days, capacity_tokens=capacity_tokens)
+
+    def _ensure_capacity(self, first_day, last_day, n_tokens):
+        meta = self.meta
+        start_day = meta['start_day'] if meta['n_days'] else first_day
+        new_start = min(start_day, first_day)
+        needed_days = max(start_day + meta['n_days'], last_day + 1) - new_start
+        shift = start_day - new_start
+        if (shift or needed_days > meta['capacity_days'] or n_tokens > meta['capacity_tokens']
+                or not os.path.exists(self.data_path)):
+            capacity_days = max(meta['capacity_days'], 1)
+            while capacity_days < needed_days:
+                capacity_days *= 2
+            capacity_tokens = max(meta['capacity_tokens'], 1)
+            while capacity_tokens < n_tokens:
+                capacity_tokens *= 2
+            old = None
+            if os.path.exists(self.data_path) and meta['n_days']:
+                old = np.array(self._map()[:meta['n_days'], :len(meta['symbols'])])
+            self._allocate(new_start, capacity_days, capacity_tokens, old, row_offset=shift)
+        meta['start_day'] = new_start
+        meta['n_days'] = needed_days
+
+    def create(self, capacity_days=1024, capacity_tokens=64):
+        os.makedirs(self.path, exist_ok=True)
+        self.meta = {'start_day': 0, 'n_days': 0, 'capacity_days': capacity_days,
+                     'capacity_tokens': capacity_tokens, 'symbols': [], 'synced_day': {}}
+        self.columns = {}
+        self._allocate(0, capacity_days, capacity_tokens)
+        self._save_meta()
+
+    def write_rows(self, symbols, days, prices):
+        """Scatter (symbol, day, price) rows into the matrix, growing it if needed."""
+        if self.meta is None:
+            self.load_meta()
+        if len(days) == 0:
+            return 0
+        days = np.asarray(days, dtype='int64')
+        for symbol in dict.fromkeys(symbols):
+            if symbol not in self.columns:
+                self.columns[symbol] = len(self.meta['symbols'])
+                self.meta['symbols'].append(symbol)
+        self._ensure_capacity(int(days.min()), int(days.max()), len(self.meta['symbols']))
+
+        cols = np.fromiter((self.columns[s] for s in symbols), dtype='int64', count=len(days))
+        data = self._map('r+')
+        data[days - self.meta['start_day'], cols] = np.asarray(prices, dtype='float64')
+        data.flush()
+        del data
+
+        synced = self.meta['synced_day']
+        for symbol, day in zip(symbols, days.tolist()):
+            if day > synced.get(symbol, -1):
+                synced[symbol] = day
+        self._save_meta()
+        return len(days)
+
+    def sync(self, conn, symbols=None):
+        """Copy rows stored after each symbol's last synced day from SQLite.
+
+        A symbol whose bars were backfilled or revised on or before its last
+        synced day (price_store's change marks) is copied again from the earliest
+        changed day. With `symbols=None` every symbol in the prices table is
+        checked. Returns the number of rows written.
+        """
+        if self.meta is None:
+            self.load_meta()
+        if symbols is None:
+            symbols = [row[0] for row in conn.execute(f"SELECT DISTINCT symbol FROM {price_store.PRICES_TABLE}")]
+        symbols = list(symbols)
+        pending = price_store.pending_changes(conn, 'matrix_store')
+        written = 0
+        for i in range(0, len(symbols), SYNC_CHUNK):
+            chunk = symbols[i:i + SYNC_CHUNK]
+            params = []
+            for symbol in chunk:
+                after = self.meta['synced_day'].get(symbol, -1)
+                if symbol in pending:
+                    after = min(after, pending[symbol][0] - 1)
+                params.extend([symbol, after])
+            values = ', '.join('(?, ?)' for _ in chunk)
+            rows = conn.execute(
+                f"WITH synced(symbol, after) AS (VALUES {values}) "
+                f"SELECT p.symbol, p.day, p.price FROM {price_store.PRICES_TABLE} p "
+                f"JOIN synced s ON p.symbol = s.symbol AND p.day > s.after",
+                params,
+            ).fetchall()
+            if rows:
+                row_symbols, row_days, row_prices = zip(*rows)
+                written += self.write_rows(list(row_symbols), row_days,
+                                           [np.nan if p is None else p for p in row_prices])
+            # The matrix now holds every change seen before the read
+            with conn:
+                for symbol in chunk:
+                    if symbol in pending:
+                        price_store.clear_changes(conn, 'matrix_store', symbol, pending[symbol][1])
+        return written
+
+    def rebuild(self, conn):
+        self.create()
+        return self.sync(conn)
+
+    def array(self, symbols=None, start=None, end=None):
+        """(days, symbols, values) for a date window and token selection.
+
+        `values` is a read-only view of the mapped file when `symbols` is None or a
+        contiguous run of stored columns; other selections gather just those
+        columns.
+        """
+        if self.meta is None:
+            self.load_meta()
+        meta = self.meta
+        data = self._map('r')[:meta['n_days'], :len(meta['symbols'])]
+        first = 0 if start is None else max(0, loader.to_epoch_day(start) - meta['start_day'])
+        last = meta['n_days'] if end is None else min(meta['n_days'], loader.to_epoch_day(end) - meta['start_day'] + 1)
+        rows = slice(first, max(first, last))
+        days = np.arange(meta['start_day'] + rows.start, meta['start_day'] + rows.stop, dtype='int64')
+
+        if symbols is None:
+            return days, list(meta['symbols']), data[rows]
+        selected = [s for s in symbols if s in self.columns]
+        cols = [self.columns[s] for s in selected]
+        if cols and cols == list(range(cols[0], cols[0] + len(cols))):
+            return days, selected, data[rows, cols[0]:cols[0] + len(cols)]
+        return days, selected, data[rows][:, cols]
+
+    def frame(self, symbols=None, start=None, end=None):
+        """Date x token DataFrame backed by `array` (float32)."""
+        days, selected, values = self.array(symbols, start, end)
+        return pd.DataFrame(values, index=loader.days_to_index(days),
+                            columns=pd.Index(selected, name='symbol'), copy=False)
+
+
+# Sync the store at `path` from the database if it has been created
+def sync_if_present(conn, symbols=None, path=STORE_PATH):
+    store = MatrixStore(path)
+    if not store.exists():
+        return 0
+    return store.sync(conn, symbols)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or update the memory-mapped price matrix.')
+    parser.add_argument('--db', default=price_store.DB_PATH, help='Path to the SQLite database')
+    parser.add_argument('--path', default=STORE_PATH, help='Directory of the matrix store')
+    parser.add_argument('--rebuild', action='store_true', help='Recreate the store from the full database')
+    args = parser.parse_args()
+
+    conn = price_store.connect(args.db)
+    store = MatrixStore(args.path)
+    if args.rebuild or not store.exists():
+        written = store.rebuild(conn)
+    else:
+        written = store.sync(conn)
+    meta = store.meta or store.load_meta()
+    print(f"Wrote {written} rows; matrix holds {meta['n_days']} days x {len(meta['symbols'])} tokens.")
+    conn.close()
@@ -0,0 +1,213 @@
+import hashlib
+import io
+import json
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+
+# Default location of the cache: its own file next to the price database, so the
+# analyses never write into the price data (git-ignored, like cmc_cache.db)
+CACHE_PATH = 'metric_cache.db'
+
+# Default upper bound on the total size of cached payloads
+MAX_BYTES = 64 * 1024 * 1024
+
+# Seconds to wait for another process writing to the cache
+BUSY_TIMEOUT = 30.0
+
+# One cached payload per (metric, parameter set, symbol). Cross-sectional metrics such
+# as the correlation matrix are stored under symbol '*'. `fingerprint` is the hash of
+# the source rows the payload was computed from.
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric_cache (
+    metric TEXT NOT NULL,
+    params TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (metric, params, symbol)
+)
+"""
+
+ALL_SYMBOLS = '*'
+
+
+# Dates as int64 nanoseconds, whatever resolution the index uses
+def datetime_ns(index):
+    return np.asarray(index.values, dtype='datetime64[ns]').view('int64')
+
+
+# Serialize a Series/DataFrame to npz bytes (no pickling)
+def encode_frame(frame):
+    if isinstance(frame, pd.Series):
+        frame = frame.to_frame()
+    buffer = io.BytesIO()
+    index = frame.index
+    if isinstance(index, pd.DatetimeIndex):
+        index_values, index_kind = datetime_ns(index), 'datetime'
+    else:
+        index_values, index_kind = np.asarray(index, dtype=str), 'label'
+    np.savez(buffer, values=frame.to_numpy(dtype='float64'), index=index_values,
+             columns=np.asarray(frame.columns, dtype=str), index_kind=np.asarray(index_kind))
+    return buffer.getvalue()
+
+
+def decode_frame(payload):
+    with np.load(io.BytesIO(payload)) as data:
+        if str(data['index_kind']) == 'datetime':
+            index = pd.DatetimeIndex(data['index'].astype('datetime64[ns]'), name='timestamp')
+        else:
+            index = pd.Index(data['index'].tolist())
+        return pd.DataFrame(data['values'], index=index, columns=data['columns'].tolist())
+
+
+# Hash of one token's (date, value) pairs, ignoring dates where it has no value
+def fingerprint_series(series):
+    mask = series.notna().to_numpy()
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(datetime_ns(series.index)[mask]).tobytes())
+    digest.update(np.ascontiguousarray(series.to_numpy(dtype='float64')[mask]).tobytes())
+    return digest.hexdigest()
+
+
+def fingerprint_frame(prices):
+    return {symbol: fingerprint_series(prices[symbol]) for symbol in prices.columns}
+
+
+# Stable text key for a parameter dict
+def params_key(params):
+    return json.dumps(params or {}, sort_keys=True)
+
+
+class MetricCache:
+    """Cache of derived metrics in its own SQLite file, keyed by metric, parameters
+    and source fingerprint.
+
+    `per_symbol` only recomputes the tokens whose source prices changed since the
+    payload was stored; `cross_section` recomputes when any token changed. When the
+    cache grows past `max_bytes`, the least recently used parameter combinations are
+    evicted first.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # WAL, so the daemon and a manual analysis can share the cache
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute(CACHE_SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def _lookup(self, metric, params, symbols):
+        placeholders = ', '.join('?' for _ in symbols)
+        rows = self.conn.execute(
+            f"SELECT symbol, fingerprint, payload FROM metric_cache "
+            f"WHERE metric = ? AND params = ? AND symbol IN ({placeholders})",
+            [metric, params] + list(symbols),
+        ).fetchall()
+        return {symbol: (fingerprint, payload) for symbol, fingerprint, payload in rows}
+
+    def _store(self, metric, params, entries):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO metric_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(metric, params, symbol, fingerprint, payload, len(payload), now)
+                 for symbol, fingerprint, payload in entries],
+            )
+
+    def _touch(self, metric, params, symbols):
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE metric_cache SET last_used = ? WHERE metric = ? AND params = ? AND symbol = ?",
+                [(time.time(), metric, params, symbol) for symbol in symbols],
+            )
+
+    def per_symbol(self, metric, params, prices, compute, fingerprints=None):
+        """Date x token frame of `compute(prices_subset)`, reusing cached columns.
+
+        `compute` must treat every column independently, so a token's result only
+        depends on its own prices; it is called once with the columns whose
+        fingerprint changed (or that were never cached).
+        """
+        params = params_key(params)
+        fingerprints = fingerprints or fingerprint_frame(prices)
+        symbols = list(prices.columns)
+        cached = self._lookup(metric, params, symbols)
+
+        columns, stale = {}, []
+        for symbol in symbols:
+            entry = cached.get(symbol)
+            if entry is not None and entry[0] == fingerprints[symbol]:
+                columns[symbol] = decode_frame(entry[1]).iloc[:, 0]
+            else:
+                stale.append(symbol)
+        self.hits += len(symbols) - len(stale)
+        self.misses += len(stale)
+        self._touch(metric, params, [s for s in symbols if s in columns])
+
+        if stale:
+            computed = compute(prices[stale])
+            entries = []
+            for symbol in stale:
+                # Only keep the dates where the token has a price
+                series = computed[symbol].reindex(prices.index)[prices[symbol].notna()]
+                columns[symbol] = series
+                entries.append((symbol, fingerprints[symbol], encode_frame(series.rename(symbol))))
+            self._store(metric, params, entries)
+            self.evict()
+
+        result = pd.DataFrame({symbol: columns[symbol] for symbol in symbols}, columns=symbols)
+        result = result.reindex(prices.index)
+        result.columns.name = prices.columns.name
+        return result
+
+    def cross_section(self, metric, params, prices, compute, fingerprints=None):
+        """`compute(prices)` cached under the combined fingerprint of every token."""
+        params = params_key(params)
+        fingerprints = fingerprints or fingerprint_frame(prices)
+        combined = hashlib.blake2b(
+            json.dumps([[s, fingerprints[s]] for s in prices.columns]).encode(), digest_size=16
+        ).hexdigest()
+        entry = self._lookup(metric, params, [ALL_SYMBOLS]).get(ALL_SYMBOLS)
+        if entry is not None and entry[0] == combined:
+            self.hits += 1
+            self._touch(metric, params, [ALL_SYMBOLS])
+            return decode_frame(entry[1])
+        self.misses += 1
+        result = compute(prices)
+        self._store(metric, params, [(ALL_SYMBOLS, combined, encode_frame(result))])
+        self.evict()
+        return result
+
+    def evict(self):
+        """Drop whole (metric, params) combinations, least recently used first,
+        until the cache fits in `max_bytes`. Returns the number of rows removed."""
+        groups = self.conn.execute(
+            "SELECT metric, params, SUM(size), MAX(last_used) FROM metric_cache "
+            "GROUP BY metric, params ORDER BY MAX(last_used)"
+        ).fetchall()
+        total = sum(size for _, _, size, _ in groups)
+        removed = 0
+        with self.conn:
+            # Never evict the most recently used combination
+            for metric, params, size, _ in groups[:-1]:
+                if total <= self.max_bytes:
+                    break
+                removed += self.conn.execute(
+                    "DELETE FROM metric_cache WHERE metric = ? AND params = ?", (metric, params)
+                ).rowcount
+                total -= size
+        return removed
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM metric_cache")
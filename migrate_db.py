@@ -0,0 +1,20 @@
+import argparse
+import price_store
+
+# One-shot migrator: copies the per-symbol TEXT tables written by older versions of
+# fetchData.py into the normalized `prices` table
+parser = argparse.ArgumentParser(description='Migrate legacy per-symbol tables into the normalized prices table.')
+parser.add_argument('--db', default=price_store.DB_PATH, help='Path to the SQLite database')
+parser.add_argument('--drop-legacy', action='store_true', help='Drop the legacy tables after migrating them')
+args = parser.parse_args()
+
+conn = price_store.connect(args.db)
+migrated = price_store.migrate_legacy_tables(conn, drop_legacy=args.drop_legacy)
+
+if migrated:
+    for symbol, count in migrated.items():
+        print(f"Migrated {count} rows for {symbol}.")
+else:
+    print("No legacy tables found. Nothing to migrate.")
+
+conn.close()
@@ -0,0 +1,397 @@
+import argparse
+import pandas as pd
+import price_store
+import loader
+import analytics
+import alignment
+import resample
+import charts
+import metric_cache
+import backends
+import rolling_state
+
+# Steps that transform every token's column on its own and keep the dates, so they
+# can be computed for a subset of tokens and cached per token
+COLUMNWISE = {'returns', 'scale', 'rolling', 'cumulative', 'normalize'}
+
+# Steps whose results are kept in the metric cache when the source has one
+CACHED = {'returns', 'rolling', 'cumulative', 'corr'}
+
+ROLLING_STATS = backends.ROLLING_STATS
+
+
+def as_date(value):
+    return None if value is None else pd.Timestamp(value)
+
+
+def apply_step(step, frame):
+    """Apply one plan step to an evaluated frame."""
+    kind = step[0]
+    if kind == 'select':
+        _, tokens, start, end = step
+        if tokens is not None:
+            frame = frame[[t for t in tokens if t in frame.columns]]
+        if start is not None or end is not None:
+            frame = frame.loc[start:end]
+        return frame
+    if kind == 'select_pairs':
+        tokens = [t for t in step[1] if t in frame.columns]
+        return frame.loc[tokens, tokens]
+    if kind == 'returns':
+        return analytics.on_daily_calendar(analytics.daily_returns, frame)
+    if kind == 'scale':
+        return frame * step[1]
+    if kind == 'rolling':
+        _, window, stat = step
+        return analytics.on_daily_calendar(lambda f: analytics.rolling(f, window, stat), frame)
+    if kind == 'cumulative':
+        return analytics.cumulative_returns(frame)
+    if kind == 'normalize':
+        return analytics.normalize_to_start(frame)
+    if kind == 'dropna':
+        return frame.dropna(how='all')
+    if kind == 'corr':
+        return analytics.correlation(frame)
+    raise ValueError(f"Unknown pipeline step: {kind}")
+
+
+def describe_step(step):
+    kind = step[0]
+    if kind == 'select':
+        _, tokens, start, end = step
+        parts = []
+        if tokens is not None:
+            parts.append(f"tokens={','.join(tokens)}")
+        if start is not None:
+            parts.append(f"start={start.date()}")
+        if end is not None:
+            parts.append(f"end={end.date()}")
+        return f"select({', '.join(parts)})"
+    if kind == 'select_pairs':
+        return f"select({','.join(step[1])})"
+    if kind == 'scale':
+        return f"scale({step[1]:g})"
+    if kind == 'rolling':
+        return f"rolling({step[1]}).{step[2]}"
+    return kind
+
+
+# Name of a chain of steps, used as its metric name in the metric cache
+def describe(steps):
+    return '.'.join(describe_step(step) for step in steps) or 'prices'
+
+
+def scan_bounds(steps, push_dates=True):
+    """(tokens, start, end) of the prices a chain of steps needs, None meaning
+    unbounded, found by walking the steps from the output back to the scan.
+
+    Token selections commute with every step, so the scan reads only the tokens
+    selected everywhere. A date selection bounds the dates; on the way back each
+    returns step needs one more day before it and a rolling window `window - 1`
+    more days, while cumulative returns, normalizing and correlation need the
+    whole history of their input.
+    """
+    tokens = start = end = None
+    day = pd.Timedelta(days=1)
+    for step in reversed(steps):
+        kind = step[0]
+        if kind in ('select', 'select_pairs') and step[1] is not None:
+            tokens = list(step[1]) if tokens is None else [t for t in step[1] if t in tokens]
+        if kind == 'select':
+            _, _, selected_start, selected_end = step
+            if selected_start is not None:
+                start = selected_start if start is None else max(start, selected_start)
+            if selected_end is not None:
+                end = selected_end if end is None else min(end, selected_end)
+        elif kind == 'returns' and start is not None:
+            start -= day
+        elif kind == 'rolling' and start is not None:
+            start -= (step[1] - 1) * day
+        elif kind in ('cumulative', 'normalize'):
+            start = None
+        elif kind == 'corr':
+            start = end = None
+    if not push_dates:
+        start = end = None
+    return tokens, start, end
+
+
+# Smallest bounds that cover all of `bounds`
+def hull(bounds):
+    bounds = list(bounds)
+    if any(tokens is None for tokens, _, _ in bounds):
+        tokens = None
+    else:
+        tokens = list(dict.fromkeys(t for selected, _, _ in bounds for t in selected))
+    starts = [start for _, start, _ in bounds]
+    ends = [end for _, _, end in bounds]
+    start = None if any(s is None for s in starts) else min(starts)
+    end = None if any(e is None for e in ends) else max(ends)
+    return tokens, start, end
+
+
+# Whether prices loaded for `loaded` bounds can serve `wanted` bounds
+def covers(loaded, wanted):
+    tokens, start, end = loaded
+    wanted_tokens, wanted_start, wanted_end = wanted
+    return ((tokens is None or (wanted_tokens is not None and set(wanted_tokens) <= set(tokens)))
+            and (start is None or (wanted_start is not None and wanted_start >= start))
+            and (end is None or (wanted_end is not None and wanted_end <= end)))
+
+
+class PriceSource:
+    """Where a pipeline reads its prices: the database (or the matrix store), the
+    bar interval and the alignment options.
+
+    Prices are read once for the bounds of everything collected together, put
+    through the alignment stage, and every evaluated step is kept, so plans that
+    share a prefix (the load, the returns) compute it once. Results persist for
+    the life of the source; a later collect that needs more tokens or dates
+    reads the store again. With a MetricCache, returns, rolling statistics,
+    cumulative returns and correlations are also cached between runs.
+    """
+
+    def __init__(self, conn=None, store=None, interval=price_store.DAILY, cache=None, fill_policy='mask',
+                 max_fill=alignment.MAX_FILL, mask_outliers=False):
+        if conn is None and store is None:
+            raise ValueError('A price source needs a database connection or a matrix store')
+        self.conn = conn
+        self.store = store
+        self.interval = interval
+        self.cache = cache
+        self.fill_policy = fill_policy
+        self.max_fill = max_fill
+        self.mask_outliers = mask_outliers
+        self.bounds = None
+        self.prices = None
+        self.quality = None
+        self.results = {}
+        self.fingerprints = None
+
+    @property
+    def pushes_dates(self):
+        # Forward fills and outlier detection look at neighbouring dates, so only
+        # the plain alignment can be given a date range
+        return self.fill_policy == 'mask' and not self.mask_outliers
+
+    def load(self, bounds):
+        tokens, start, end = bounds
+        duplicates = None
+        if self.store is not None:
+            # Map the on-disk matrix instead of reading the database into memory
+            prices = self.store.frame(tokens, start, end)
+        else:
+            # One read transaction, so a fetch committing meanwhile cannot leave the
+            # prices and the duplicate counts from different states of the store
+            with price_store.snapshot(self.conn):
+                prices = resample.load_price_matrix(self.conn, tokens, start, end, interval=self.interval)
+                if self.interval == price_store.DAILY:
+                    duplicates = alignment.duplicate_rows(self.conn, tokens, start, end)
+        self.prices, self.quality = alignment.align(prices, self.fill_policy, self.max_fill, self.mask_outliers,
+                                                    duplicates=duplicates)
+        self.bounds = bounds
+        self.results = {(): self.prices}
+        self.fingerprints = None
+
+    def prepare(self, bounds):
+        """Make sure the loaded prices cover `bounds`, reading the store if not."""
+        if self.bounds is None or not covers(self.bounds, bounds):
+            self.load(bounds)
+
+    def evaluate(self, steps):
+        """Result of a chain of steps on the loaded prices, computing each prefix once."""
+        if steps in self.results:
+            return self.results[steps]
+        parent, step = steps[:-1], steps[-1]
+        # Leading token selections only pick columns of the prices, so the chain
+        # after them can be cached per token
+        base = 0
+        while base < len(parent) and parent[base][0] == 'select' and parent[base][2:] == (None, None):
+            base += 1
+        persisted = self.persisted(steps, base)
+        if persisted is not None:
+            result = persisted
+        elif (self.cache is not None and step[0] in CACHED
+                and all(s[0] in COLUMNWISE for s in parent[base:])):
+            if self.fingerprints is None:
+                self.fingerprints = metric_cache.fingerprint_frame(self.prices)
+            prices, name = self.evaluate(steps[:base]), describe(steps[base:])
+            if step[0] == 'corr':
+                result = self.cache.cross_section(name, {}, prices,
+                                                  lambda p: apply_step(step, self.evaluate(parent)), self.fingerprints)
+            else:
+                # Only the tokens whose prices changed are recomputed
+                result = self.cache.per_symbol(name, {}, prices,
+                                               lambda p: apply_step(step, self.evaluate(parent)[list(p.columns)]),
+                                               self.fingerprints)
+        else:
+            result = apply_step(step, self.evaluate(parent))
+        self.results[steps] = result
+        return result
+
+
+    def persisted(self, steps, base):
+        """The rolling mean or std that rolling_state keeps current on every fetch, for
+        a returns().rolling(window) chain straight on the daily prices of the
+        database, or None when they cannot stand in for computing it."""
+        step = steps[-1]
+        if not (step[0] == 'rolling' and step[1] in rolling_state.WINDOWS and step[2] in ('mean', 'std')
+                and steps[base:-1] == (('returns',),) and self.store is None
+                and self.interval == price_store.DAILY and self.pushes_dates):
+            return None
+        prices = self.evaluate(steps[:base])
+        with price_store.snapshot(self.conn):
+            if not rolling_state.is_current(self.conn, prices.columns):
+                return None
+            stats = rolling_state.stats_frame(self.conn, prices.columns, step[1], step[2])
+        return stats.reindex(index=prices.index, columns=prices.columns)
+
+
+class Frame:
+    """A deferred analysis: a price source plus the steps to apply to it.
+
+    Every method returns a new Frame with one more step and nothing is read or
+    computed until to_frame(), plot() or collect(). Steps apply in order, so
+    `select(start=...)` before returns() leaves the first date without a
+    return, while `returns().select(start=...)` reads the day before.
+    """
+
+    def __init__(self, source, steps=()):
+        self.source = source
+        self.steps = tuple(steps)
+
+    @property
+    def is_matrix(self):
+        return any(step[0] == 'corr' for step in self.steps)
+
+    def then(self, *step):
+        if self.is_matrix and step[0] != 'select_pairs':
+            raise ValueError(f"Cannot apply {step[0]} to a correlation matrix")
+        return Frame(self.source, self.steps + (step,))
+
+    def select(self, tokens=None, start=None, end=None):
+        """Keep `tokens` (in that order) and the dates from `start` to `end`, inclusive.
+        On a correlation matrix the tokens are kept on both axes."""
+        tokens = None if tokens is None else tuple(dict.fromkeys([tokens] if isinstance(tokens, str) else tokens))
+        if self.is_matrix:
+            if start is not None or end is not None:
+                raise ValueError('A correlation matrix has no dates to select')
+            return self if tokens is None else self.then('select_pairs', tokens)
+        return self.then('select', tokens, as_date(start), as_date(end))
+
+    def event_window(self, window=analytics.EVENT_WINDOW):
+        return self.select(start=window[0], end=window[1])
+
+    def returns(self):
+        """Daily simple returns, as decimals, on the daily calendar."""
+        return self.then('returns')
+
+    def pct(self):
+        return self.then('scale', 100)
+
+    def rolling(self, window):
+        if window < 1:
+            raise ValueError('window must be at least 1')
+        return Rolling(self, window)
+
+    def cumulative(self):
+        """Compounded return since the first date."""
+        return self.then('cumulative')
+
+    def normalize(self):
+        """Shift every token to start at zero on its first valid date."""
+        return self.then('normalize')
+
+    def dropna(self):
+        """Drop the dates where no token has a value."""
+        return self.then('dropna')
+
+    def corr(self):
+        """Pairwise-complete Pearson correlation between the tokens."""
+        return self.then('corr')
+
+    def bounds(self):
+        return scan_bounds(self.steps, self.source.pushes_dates)
+
+    def explain(self):
+        """The read the plan pushes down to the store and the steps that follow it."""
+        tokens, start, end = self.bounds()
+        scan = [f"tokens={','.join(tokens)}" if tokens is not None else 'all tokens',
+                f"from {start.date()}" if start is not None else 'from the first date',
+                f"to {end.date()}" if end is not None else 'to the last date']
+        return '\n'.join([f"scan {self.source.interval} prices: {', '.join(scan)}"] +
+                         [f"  {describe_step(step)}" for step in self.steps])
+
+    def to_frame(self):
+        return collect(self)[0]
+
+    def plot(self, chart, **params):
+        """Evaluate the plan and draw it with the `charts` function named `chart`."""
+        return getattr(charts, chart)(self.to_frame(), **params)
+
+
+class Rolling:
+    """Trailing window over a Frame; each statistic returns a new Frame."""
+
+    def __init__(self, frame, window):
+        self.frame = frame
+        self.window = window
+
+    def stat(self, stat):
+        if stat not in ROLLING_STATS:
+            raise ValueError(f"Unknown rolling statistic: {stat}")
+        return self.frame.then('rolling', self.window, stat)
+
+    def mean(self):
+        return self.stat('mean')
+
+    def std(self):
+        return self.stat('std')
+
+    def min(self):
+        return self.stat('min')
+
+    def max(self):
+        return self.stat('max')
+
+    def sum(self):
+        return self.stat('sum')
+
+
+# Start a plan on the prices of a database connection (or a matrix store)
+def prices(conn=None, **options):
+    return Frame(PriceSource(conn, **options))
+
+
+def collect(*frames):
+    """Evaluate several plans together and return their DataFrames in order.
+
+    Plans on the same source are served by one read of the store covering all
+    of them, and the steps they share are computed once.
+    """
+    groups = {}
+    for frame in frames:
+        groups.setdefault(frame.source, []).append(frame)
+    for source, group in groups.items():
+        source.prepare(hull(frame.bounds() for frame in group))
+    return [frame.source.evaluate(frame.steps) for frame in frames]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the pushed-down read and the result of a small pipeline.')
+    parser.add_argument('--db', default=price_store.DB_PATH, help='Path to the SQLite database')
+    parser.add_argument('--tickers', nargs='+', default=loader.TICKERS, help='Tokens to select')
+    parser.add_argument('--start', help='First date of the output')
+    parser.add_argument('--end', help='Last date of the output')
+    parser.add_argument('--window', type=int, default=analytics.WINDOW_SIZE, help='Rolling window in days')
+    parser.add_argument('--stat', choices=ROLLING_STATS, default='std', help='Rolling statistic of the daily returns')
+    backends.add_arguments(parser)
+    args = parser.parse_args()
+    backends.configure_from_args(args)
+
+    conn = price_store.connect(args.db, readonly=True)
+    plan = (prices(conn).select(args.tickers).returns().rolling(args.window).stat(args.stat).pct()
+            .select(start=args.start, end=args.end).dropna())
+    print(plan.explain())
+    print(plan.to_frame().to_string(float_format=lambda v: f"{v:.4f}"))
+    conn.close()
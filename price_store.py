@@ -0,0 +1,303 @@
+import os
+import sqlite3
+import ast
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.request import pathname2url
+
+# Default location of the SQLite database shared by the fetcher and the analysis scripts
+DB_PATH = 'crypto_data.db'
+
+# Name of the normalized price table
+PRICES_TABLE = 'prices'
+
+# Numeric fields copied out of each CoinMarketCap USD quote
+QUOTE_FIELDS = [
+    'price', 'volume_24h', 'market_cap', 'total_supply', 'circulating_supply',
+    'percent_change_1h', 'percent_change_24h', 'percent_change_7d', 'percent_change_30d',
+]
+
+# Full column list of the normalized table, in insert order
+PRICE_COLUMNS = ['symbol', 'ts', 'day'] + QUOTE_FIELDS
+
+# Bar intervals we store, with their length in seconds. Each interval has its own
+# table: daily bars live in `prices`, intraday bars in `prices_<interval>`.
+INTERVALS = {'daily': 86400, '1h': 3600, '5m': 300}
+DAILY = 'daily'
+
+
+def prices_table(interval=DAILY):
+    if interval not in INTERVALS:
+        raise ValueError(f"Unknown interval: {interval}")
+    return PRICES_TABLE if interval == DAILY else f"{PRICES_TABLE}_{interval}"
+
+
+def ingest_state_table(interval=DAILY):
+    if interval not in INTERVALS:
+        raise ValueError(f"Unknown interval: {interval}")
+    return 'ingest_state' if interval == DAILY else f"ingest_state_{interval}"
+
+
+# One row per (symbol, UTC epoch second); `day` is the UTC epoch day (ts // 86400).
+# WITHOUT ROWID keeps rows clustered on the primary key, so per-symbol range scans
+# read contiguous pages. Keeping every interval in its own table means intraday
+# volume never slows down scans of the daily bars.
+def prices_schema(table=PRICES_TABLE):
+    return f"""
+CREATE TABLE IF NOT EXISTS {table} (
+    symbol TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    price REAL,
+    volume_24h REAL,
+    market_cap REAL,
+    total_supply REAL,
+    circulating_supply REAL,
+    percent_change_1h REAL,
+    percent_change_24h REAL,
+    percent_change_7d REAL,
+    percent_change_30d REAL,
+    PRIMARY KEY (symbol, ts)
+) WITHOUT ROWID
+"""
+
+
+PRICES_SCHEMA = prices_schema()
+
+
+# Per-symbol high-water mark: the newest timestamp stored for each symbol, so the
+# fetcher only asks the API for bars after it
+def ingest_state_schema(table='ingest_state'):
+    return f"""
+CREATE TABLE IF NOT EXISTS {table} (
+    symbol TEXT PRIMARY KEY,
+    high_water_ts INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL
+)
+"""
+
+
+INGEST_STATE_SCHEMA = ingest_state_schema()
+
+# Derived stores kept in step with the daily bars; each has its own change marks
+CHANGE_CONSUMERS = ('rolling_state', 'matrix_store')
+
+# Earliest day of the daily bars written per symbol since a consumer last caught up,
+# so a backfilled or revised bar can be told apart from a new one. `version` counts
+# the writes, so a consumer only clears a mark it has seen.
+CHANGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS price_changes (
+    consumer TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    min_day INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (consumer, symbol)
+)
+"""
+
+SECONDS_PER_DAY = 86400
+
+# Rows per executemany batch when upserting
+BATCH_SIZE = 1000
+
+# Seconds a connection waits for a lock held by another process before giving up with
+# "database is locked"
+BUSY_TIMEOUT = 30.0
+
+
+def connect(path=DB_PATH, readonly=False, timeout=BUSY_TIMEOUT, check_same_thread=True):
+    """Open the database; writers also make sure the normalized schema exists.
+
+    Writers switch the file to WAL journaling (a persistent setting), so readers
+    never block the writer and the writer never blocks readers. Their write
+    transactions start with BEGIN IMMEDIATE, so two writers queue on the busy
+    timeout instead of failing when a read lock is upgraded. Read-only
+    connections open the file through a `mode=ro` URI, for the analysis scripts
+    that have nothing to write; they see the last committed state.
+    """
+    if readonly:
+        uri = f"file:{pathname2url(os.path.abspath(path))}?mode=ro"
+        return sqlite3.connect(uri, uri=True, timeout=timeout, check_same_thread=check_same_thread)
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level='IMMEDIATE', check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode = WAL")
+    # Durable at every checkpoint; a crash can only lose the last commits, never corrupt
+    conn.execute("PRAGMA synchronous = NORMAL")
+    ensure_schema(conn)
+    return conn
+
+
+@contextmanager
+def snapshot(conn):
+    """Run the reads inside the block against one consistent state of the database.
+
+    Opens a read transaction, so every query sees the state as of the first one,
+    even while the fetcher commits new pages. In WAL mode this never blocks the
+    writer. Only reads belong in the block; inside a transaction that is already
+    open it does nothing.
+    """
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+
+
+def ensure_schema(conn, interval=DAILY):
+    table = prices_table(interval)
+    conn.execute(prices_schema(table))
+    conn.execute(ingest_state_schema(ingest_state_table(interval)))
+    if interval == DAILY:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_day ON {table} (day)")
+        ensure_changes_schema(conn)
+    conn.commit()
+
+
+# Marks written before they were kept per consumer are handed to every consumer
+def ensure_changes_schema(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(price_changes)")]
+    if columns and 'consumer' not in columns:
+        conn.execute("ALTER TABLE price_changes RENAME TO price_changes_old")
+        conn.execute(CHANGES_SCHEMA)
+        conn.executemany("INSERT INTO price_changes SELECT ?, symbol, min_day, version FROM price_changes_old",
+                         [(consumer,) for consumer in CHANGE_CONSUMERS])
+        conn.execute("DROP TABLE price_changes_old")
+    conn.execute(CHANGES_SCHEMA)
+
+
+# Convert an API timestamp such as '2023-10-02T00:00:00.000Z' to UTC epoch seconds
+def to_epoch_seconds(value):
+    if isinstance(value, (int, float)):
+        return int(value)
+    dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+# Turn one quote record from the API ({'timestamp': ..., 'quote': {'USD': {...}}})
+# into a tuple matching PRICE_COLUMNS
+def quote_to_row(symbol, record, currency='USD'):
+    quote = record['quote']
+    if isinstance(quote, str):
+        # Legacy tables stored the quote dict as its Python repr
+        quote = ast.literal_eval(quote)
+    usd = quote[currency]
+    ts = to_epoch_seconds(record.get('timestamp') or usd['timestamp'])
+    return (symbol, ts, ts // SECONDS_PER_DAY) + tuple(usd.get(field) for field in QUOTE_FIELDS)
+
+
+# Upsert normalized rows keyed on (symbol, ts) into the table of `interval` in a single
+# transaction, in batches of `batch_size`, and (unless `advance` is False) advance each
+# symbol's high-water mark in the same transaction. Daily rows also mark the earliest
+# day written per symbol in price_changes, for every consumer. Returns the number of
+# rows written.
+def upsert_rows(conn, rows, batch_size=BATCH_SIZE, interval=DAILY, advance=True):
+    placeholders = ', '.join('?' for _ in PRICE_COLUMNS)
+    updates = ', '.join(f"{col} = excluded.{col}" for col in PRICE_COLUMNS[2:])
+    statement = (
+        f"INSERT INTO {prices_table(interval)} ({', '.join(PRICE_COLUMNS)}) VALUES ({placeholders}) "
+        f"ON CONFLICT (symbol, ts) DO UPDATE SET {updates}"
+    )
+    written = 0
+    high_water, low_day = {}, {}
+    with conn:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            symbol, ts, day = row[0], row[1], row[2]
+            if symbol not in high_water or ts > high_water[symbol]:
+                high_water[symbol] = ts
+            if symbol not in low_day or day < low_day[symbol]:
+                low_day[symbol] = day
+            if len(batch) >= batch_size:
+                conn.executemany(statement, batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            conn.executemany(statement, batch)
+            written += len(batch)
+        if advance:
+            record_high_water(conn, high_water, interval)
+        if interval == DAILY:
+            conn.executemany(
+                "INSERT INTO price_changes (consumer, symbol, min_day, version) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (consumer, symbol) DO UPDATE SET "
+                "min_day = MIN(min_day, excluded.min_day), version = version + 1",
+                [(consumer, symbol, day) for consumer in CHANGE_CONSUMERS for symbol, day in low_day.items()],
+            )
+    return written
+
+
+# Move the high-water marks of {symbol: ts} forward (never back); runs inside the
+# caller's transaction
+def record_high_water(conn, high_water, interval=DAILY):
+    now = int(time.time())
+    conn.executemany(
+        f"INSERT INTO {ingest_state_table(interval)} (symbol, high_water_ts, updated_at) VALUES (?, ?, ?) "
+        "ON CONFLICT (symbol) DO UPDATE SET "
+        "high_water_ts = MAX(high_water_ts, excluded.high_water_ts), updated_at = excluded.updated_at",
+        [(symbol, ts, now) for symbol, ts in high_water.items()],
+    )
+
+
+# {symbol: (min_day, version)} of the daily bars written since `consumer` last cleared
+# each symbol's mark
+def pending_changes(conn, consumer):
+    rows = conn.execute("SELECT symbol, min_day, version FROM price_changes WHERE consumer = ?", (consumer,))
+    return {symbol: (min_day, version) for symbol, min_day, version in rows}
+
+
+# Clear a consumer's change mark of a symbol, unless it was written to again after
+# `version` was read; runs inside the caller's transaction
+def clear_changes(conn, consumer, symbol, version):
+    conn.execute("DELETE FROM price_changes WHERE consumer = ? AND symbol = ? AND version = ?",
+                 (consumer, symbol, version))
+
+
+# Latest stored timestamp (epoch seconds) for a symbol at `interval`, or None if it has
+# no rows. Reads the recorded high-water mark and falls back to the table itself for
+# databases written before ingest_state existed.
+def last_timestamp(conn, symbol, interval=DAILY):
+    row = conn.execute(f"SELECT high_water_ts FROM {ingest_state_table(interval)} WHERE symbol = ?",
+                       (symbol,)).fetchone()
+    if row is not None:
+        return row[0]
+    row = conn.execute(f"SELECT MAX(ts) FROM {prices_table(interval)} WHERE symbol = ?", (symbol,)).fetchone()
+    return row[0]
+
+
+# Tables written by the old fetcher: one table per symbol with TEXT timestamp/quote columns
+def legacy_tables(conn):
+    tables = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+    ).fetchall()
+    legacy = []
+    for (name,) in tables:
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info("{name}")')}
+        if {'timestamp', 'quote'} <= columns:
+            legacy.append(name)
+    return legacy
+
+
+# One-shot migration of the per-symbol tables into the normalized table.
+# Returns a {symbol: rows_migrated} dict.
+def migrate_legacy_tables(conn, drop_legacy=False):
+    ensure_schema(conn)
+    migrated = {}
+    for symbol in legacy_tables(conn):
+        records = conn.execute(f'SELECT timestamp, quote FROM "{symbol}"').fetchall()
+        rows = []
+        for timestamp, quote in records:
+            if timestamp is None or quote is None:
+                continue
+            rows.append(quote_to_row(symbol, {'timestamp': timestamp, 'quote': quote}))
+        upsert_rows(conn, rows)
+        if drop_legacy:
+            with conn:
+                conn.execute(f'DROP TABLE "{symbol}"')
+        migrated[symbol] = len(rows)
+    return migrated
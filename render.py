@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+# Records the input hash each PNG was last rendered from, next to the PNGs
+MANIFEST = '.render_manifest.json'
+
+
+class RenderJob:
+    """One chart to draw: the `charts` function name, its data and keyword parameters."""
+
+    def __init__(self, chart, data, path, **params):
+        self.chart = chart
+        self.data = data
+        self.path = path
+        self.params = params
+
+    def digest(self):
+        """Hash of the chart function, its parameters and the data, index included."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(json.dumps([self.chart, self.params], sort_keys=True, default=str).encode())
+        h.update(json.dumps([str(c) for c in self.data.columns]).encode())
+        h.update(pd.util.hash_pandas_object(self.data, index=True).to_numpy().tobytes())
+        return h.hexdigest()
+
+
+def load_manifest(directory='.'):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, directory='.'):
+    path = os.path.join(directory, MANIFEST)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+# Runs in a worker process: headless, so no window is ever opened
+def render_job(job):
+    import charts
+    charts.set_headless()
+    getattr(charts, job.chart)(job.data, path=job.path, show=False, **job.params)
+    return job.path
+
+
+# Runs in the calling process, which keeps its HEADLESS setting and matplotlib backend:
+# show=False never opens a window, and interactive mode is only off while drawing
+def render_here(job):
+    import charts
+    with charts.pyplot().ioff():
+        getattr(charts, job.chart)(job.data, path=job.path, show=False, **job.params)
+    return job.path
+
+
+def render_all(jobs, workers=None, force=False, directory='.'):
+    """Render jobs in a process pool, skipping PNGs whose inputs are unchanged.
+
+    A job that fails does not stop the others: the manifest is saved for every
+    chart that rendered, then the first error is raised. Returns
+    (rendered_paths, skipped_paths).
+    """
+    manifest = load_manifest(directory)
+    pending, skipped, digests = [], [], {}
+    for job in jobs:
+        digest = job.digest()
+        if not force and manifest.get(job.path) == digest and os.path.exists(job.path):
+            skipped.append(job.path)
+        else:
+            pending.append(job)
+            digests[job.path] = digest
+
+    rendered, errors = [], []
+    if len(pending) == 1 or workers == 1:
+        for job in pending:
+            try:
+                rendered.append(render_here(job))
+            except Exception as e:
+                errors.append((job.path, e))
+    elif pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [(job, pool.submit(render_job, job)) for job in pending]
+            for job, future in futures:
+                try:
+                    rendered.append(future.result())
+                except Exception as e:
+                    errors.append((job.path, e))
+
+    for path in rendered:
+        manifest[path] = digests[path]
+    if rendered:
+        save_manifest(manifest, directory)
+    for path, error in errors:
+        print(f"Failed to render {path}: {error}")
+    if errors:
+        raise errors[0][1]
+    return rendered, skipped
@@ -0,0 +1,159 @@
+import argparse
+import numpy as np
+import pandas as pd
+import price_store
+import loader
+import instrumentation
+
+# Bar sizes rows can be resampled to: fixed lengths in seconds, or calendar weeks
+# (starting on Monday) and months
+RULES = {'5m': 300, '1h': 3600, 'daily': price_store.SECONDS_PER_DAY, 'weekly': 'W', 'monthly': 'M'}
+
+BAR_COLUMNS = ['symbol', 'ts', 'open', 'high', 'low', 'close', 'volume_24h', 'bars']
+
+
+def bucket_starts(ts, rule):
+    """UTC epoch second at which the `rule` bucket of every timestamp starts."""
+    ts = np.asarray(ts, dtype='int64')
+    size = RULES[rule]
+    if size == 'W':
+        day = ts // price_store.SECONDS_PER_DAY
+        # Epoch day 0 was a Thursday
+        return (day - (day + 3) % 7) * price_store.SECONDS_PER_DAY
+    if size == 'M':
+        return ts.astype('datetime64[s]').astype('datetime64[M]').astype('datetime64[s]').astype('int64')
+    return ts - ts % size
+
+
+def check_rule(interval, rule):
+    size = RULES[rule]
+    if isinstance(size, int) and size < price_store.INTERVALS[interval]:
+        raise ValueError(f"Cannot resample {interval} bars to the finer rule {rule}")
+
+
+def ohlc(symbols, ts, prices, rule, volumes=None):
+    """OHLC bars of `rule` from long-form (symbol, ts, price) rows, without a pivot.
+
+    Rows are grouped by symbol and bucket with a single pass of boundary
+    detection and ufunc.reduceat, so the cost is linear in the number of rows.
+    Rows with a missing price are ignored. Bars are labelled with the bucket
+    start; `bars` counts the source rows in each bar and `volume_24h` is the
+    last value seen (it is already a trailing 24h volume).
+    """
+    symbols = np.asarray(symbols, dtype=object)
+    ts = np.asarray(ts, dtype='int64')
+    prices = np.asarray(prices, dtype='float64')
+    volumes = np.full(len(ts), np.nan) if volumes is None else np.asarray(volumes, dtype='float64')
+    valid = np.isfinite(prices)
+    symbols, ts, prices, volumes = symbols[valid], ts[valid], prices[valid], volumes[valid]
+    if len(ts) == 0:
+        return pd.DataFrame(columns=BAR_COLUMNS)
+
+    codes, names = pd.factorize(symbols)
+    starts = bucket_starts(ts, rule)
+    order = np.lexsort((ts, codes))
+    if not (order == np.arange(len(order))).all():
+        codes, ts, starts, prices, volumes = codes[order], ts[order], starts[order], prices[order], volumes[order]
+
+    new_bar = np.empty(len(ts), dtype=bool)
+    new_bar[0] = True
+    new_bar[1:] = (codes[1:] != codes[:-1]) | (starts[1:] != starts[:-1])
+    first = np.flatnonzero(new_bar)
+    last = np.append(first[1:] - 1, len(ts) - 1)
+    return pd.DataFrame({
+        'symbol': np.asarray(names, dtype=object)[codes[first]],
+        'ts': starts[first],
+        'open': prices[first],
+        'high': np.maximum.reduceat(prices, first),
+        'low': np.minimum.reduceat(prices, first),
+        'close': prices[last],
+        'volume_24h': volumes[last],
+        'bars': last - first + 1,
+    })
+
+
+def load_bars(conn, interval, rule, symbols=None, start=None, end=None):
+    """OHLC bars of `rule` built from the stored `interval` rows.
+
+    Rows are read in primary-key order (symbol, ts), so SQLite streams them
+    without sorting and the resampling needs no reordering either.
+    """
+    check_rule(interval, rule)
+    where, params = [], []
+    if symbols is not None:
+        symbols = list(symbols)
+        if not symbols:
+            return pd.DataFrame(columns=BAR_COLUMNS)
+        where.append(f"symbol IN ({', '.join('?' for _ in symbols)})")
+        params.extend(symbols)
+    if start is not None:
+        where.append("ts >= ?")
+        params.append(loader.to_epoch_day(start) * price_store.SECONDS_PER_DAY)
+    if end is not None:
+        where.append("ts < ?")
+        params.append((loader.to_epoch_day(end) + 1) * price_store.SECONDS_PER_DAY)
+    query = f"SELECT symbol, ts, price, volume_24h FROM {price_store.prices_table(interval)}"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY symbol, ts"
+    with instrumentation.stage('sql_read') as stage:
+        rows = conn.execute(query, params).fetchall()
+        stage.add(rows=len(rows))
+    if not rows:
+        return pd.DataFrame(columns=BAR_COLUMNS)
+    row_symbols, row_ts, row_prices, row_volumes = zip(*rows)
+    with instrumentation.stage('resample') as stage:
+        bars = ohlc(row_symbols, row_ts, [np.nan if p is None else p for p in row_prices], rule,
+                    [np.nan if v is None else v for v in row_volumes])
+        stage.add(rows=len(rows), bars=len(bars))
+    return bars
+
+
+def close_matrix(bars, symbols=None, column='close'):
+    """Date x token DataFrame of one bar column (NaN where a token has no bar)."""
+    if len(bars) == 0:
+        return pd.DataFrame(index=loader.seconds_to_index([]), columns=pd.Index([], name='symbol'), dtype='float64')
+    times, time_pos = np.unique(bars['ts'].to_numpy(dtype='int64'), return_inverse=True)
+    present, sym_pos = np.unique(bars['symbol'].to_numpy(dtype=object), return_inverse=True)
+    matrix = np.full((len(times), len(present)), np.nan)
+    matrix[time_pos, sym_pos] = bars[column].to_numpy(dtype='float64')
+    frame = pd.DataFrame(matrix, index=loader.seconds_to_index(times), columns=pd.Index(present, name='symbol'))
+    if symbols is not None:
+        frame = frame[[s for s in dict.fromkeys(symbols) if s in frame.columns]]
+    return frame
+
+
+def load_price_matrix(conn, symbols=None, start=None, end=None, interval=price_store.DAILY, rule='daily'):
+    """Date x token closing prices at `rule`, derived from bars stored at `interval`.
+
+    With daily data and a daily rule this is the plain loader, so the daily
+    analyses can run on any base resolution by swapping in this function.
+    """
+    if interval == price_store.DAILY and rule == 'daily':
+        return loader.load_price_matrix(conn, symbols, start, end)
+    return close_matrix(load_bars(conn, interval, rule, symbols, start, end), symbols)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Resample stored bars to a coarser interval.')
+    parser.add_argument('--db', default=price_store.DB_PATH, help='Path to the SQLite database')
+    parser.add_argument('--interval', choices=list(price_store.INTERVALS), default='1h', help='Stored bar interval')
+    parser.add_argument('--rule', choices=list(RULES), default='daily', help='Bar size to resample to')
+    parser.add_argument('--tickers', nargs='+', help='Tokens to include (default: all)')
+    parser.add_argument('--start', help='First date (inclusive)')
+    parser.add_argument('--end', help='Last date (inclusive)')
+    parser.add_argument('--csv', help='Write the bars to this CSV file instead of printing them')
+    args = parser.parse_args()
+
+    # Read-only, so resampling never blocks or writes to a running fetch
+    conn = price_store.connect(args.db, readonly=True)
+    table = price_store.prices_table(args.interval)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is None:
+        parser.error(f"no {args.interval} bars in {args.db}; fetch them with fetchData.py --interval {args.interval}")
+    bars = load_bars(conn, args.interval, args.rule, args.tickers, args.start, args.end)
+    conn.close()
+    bars.insert(1, 'timestamp', loader.seconds_to_index(bars['ts']))
+    if args.csv:
+        bars.drop(columns='ts').to_csv(args.csv, index=False)
+    else:
+        print(bars.drop(columns='ts').to_string(index=False))
@@ -0,0 +1,131 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+# Default location of the cache; it is kept apart from crypto_data.db so a recorded
+# cache can be copied around (e.g. to replay a backfill on another machine)
+CACHE_PATH = 'cmc_cache.db'
+
+# Modes:
+#   cache   serve stored responses that are still valid, fetch and store the rest
+#   record  always fetch and store (refreshes the recording)
+#   replay  only serve stored responses; a miss is an error and nothing is fetched,
+#           so no API key is needed
+#   off     no cache
+MODES = ('cache', 'record', 'replay', 'off')
+
+# How long a response covering the current (still open) UTC day is served from the
+# cache. Responses that end before the current day never expire.
+RECENT_TTL = 3600
+
+SECONDS_PER_DAY = 86400
+
+# Seconds to wait for another process holding the cache's write lock
+BUSY_TIMEOUT = 30.0
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    path TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    interval TEXT NOT NULL,
+    time_start INTEGER NOT NULL,
+    time_end INTEGER NOT NULL,
+    body BLOB NOT NULL,
+    fetched_at REAL NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (path, symbol, interval, time_start, time_end)
+)
+"""
+
+
+class CacheMiss(Exception):
+    """Raised in replay mode for a request that was never recorded."""
+
+
+class ResponseCache:
+    """On-disk cache of decoded API responses, keyed by (path, symbol, interval,
+    time_start, time_end).
+
+    Bodies are stored zlib-compressed in a small SQLite database. A response
+    whose range ends before the start of the current UTC day covers closed bars
+    only and is kept for good; anything newer expires after `ttl` seconds.
+    Safe to share between the fetch worker threads.
+    """
+
+    def __init__(self, path=CACHE_PATH, mode='cache', ttl=RECENT_TTL, clock=time.time):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # WAL, so a replaying analysis can read the cache while a fetch records into it
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute(CACHE_SCHEMA)
+
+    @staticmethod
+    def key(path, params):
+        return (path, params['symbol'], params['interval'], int(params['time_start']), int(params['time_end']))
+
+    def get(self, path, params):
+        """The stored response for a request, or None when it has to be fetched."""
+        if self.mode == 'record':
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT body, expires_at FROM responses "
+                "WHERE path = ? AND symbol = ? AND interval = ? AND time_start = ? AND time_end = ?",
+                self.key(path, params)).fetchone()
+            # Replay serves whatever was recorded, however old
+            if row is not None and (self.mode == 'replay' or row[1] is None or row[1] > self.clock()):
+                self.hits += 1
+                return json.loads(zlib.decompress(row[0]))
+            self.misses += 1
+        if self.mode == 'replay':
+            raise CacheMiss(f"No recorded response for {params['symbol']} {params['interval']} "
+                            f"{params['time_start']}-{params['time_end']} in {self.path}")
+        return None
+
+    def put(self, path, params, data):
+        if self.mode == 'replay':
+            return
+        now = self.clock()
+        current_day = int(now) // SECONDS_PER_DAY * SECONDS_PER_DAY
+        expires_at = None if int(params['time_end']) <= current_day else now + self.ttl
+        body = zlib.compress(json.dumps(data, separators=(',', ':')).encode())
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO responses (path, symbol, interval, time_start, time_end, body, fetched_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (path, symbol, interval, time_start, time_end) DO UPDATE SET "
+                "body = excluded.body, fetched_at = excluded.fetched_at, expires_at = excluded.expires_at",
+                self.key(path, params) + (body, now, expires_at))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# Open the cache for a mode, or return None when caching is off
+def open_cache(path=CACHE_PATH, mode='cache', ttl=RECENT_TTL):
+    if mode == 'off':
+        return None
+    return ResponseCache(path, mode, ttl)
+
+
+def add_arguments(parser):
+    parser.add_argument('--api-cache', choices=MODES, default='cache',
+                        help='API response cache mode: cache, record (refetch everything), replay (offline), or off')
+    parser.add_argument('--api-cache-path', default=CACHE_PATH, help='Path of the API response cache')
+    parser.add_argument('--api-cache-ttl', type=float, default=RECENT_TTL,
+                        help='Seconds a response covering the current UTC day stays valid')
+
+
+def open_from_args(args):
+    return open_cache(args.api_cache_path, args.api_cache, args.api_cache_ttl)
@@ -0,0 +1,310 @@
+import argparse
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+import price_store
+import loader
+import analytics
+import alignment
+import matrix_store
+import rolling_sweep
+
+# Trailing windows (in days) the risk table is computed over
+LOOKBACKS = (30, 90, 365)
+
+# Benchmark the betas are measured against
+BENCHMARK = 'SOL'
+
+# Confidence level of VaR/CVaR (losses beyond the worst 5% of days)
+CONFIDENCE = 0.95
+
+# Crypto trades every day, so Sharpe and Sortino are annualized with 365 periods
+PERIODS_PER_YEAR = 365
+
+# Tokens need at least this many returns in a window to get metrics
+MIN_PERIODS = 20
+
+METRICS = ['observations', 'mean', 'volatility', 'downside_deviation', 'max_drawdown', 'var_historical',
+           'cvar_historical', 'var_parametric', 'cvar_parametric', 'sharpe', 'sortino', 'beta']
+
+# Tokens processed together by the rolling window scans
+SCAN_COLUMNS = 64
+
+
+# Per-token totals over the date axis of a (dates, tokens) array with NaN for missing
+# returns: count, sum, sum of squares and sum of squared losses
+def column_sums(values):
+    valid = np.isfinite(values)
+    filled = np.where(valid, values, 0.0)
+    return valid.sum(axis=0), filled.sum(axis=0), (filled ** 2).sum(axis=0), (np.minimum(filled, 0.0) ** 2).sum(axis=0)
+
+
+# Mean, sample standard deviation and downside deviation (below 0) from column sums
+def moments(n, total, squares, losses, min_periods=MIN_PERIODS):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / n
+        variance = (squares - total * mean) / (n - 1)
+        std = np.sqrt(np.maximum(variance, 0.0))
+        downside = np.sqrt(losses / n)
+    enough = n >= max(min_periods, 2)
+    return np.where(enough, mean, np.nan), np.where(enough, std, np.nan), np.where(enough, downside, np.nan)
+
+
+def max_drawdown(values):
+    """Largest peak-to-trough fall of compounded returns in every column, as a
+    negative fraction (missing days leave the wealth unchanged)."""
+    growth = np.cumsum(np.where(np.isfinite(values), np.log1p(values), 0.0), axis=0)
+    # Wealth starts at 1 (log 0) before the first return
+    growth = np.vstack([np.zeros((1,) + growth.shape[1:]), growth])
+    return np.expm1((growth - np.maximum.accumulate(growth, axis=0)).min(axis=0))
+
+
+def historical_var(values, confidence=CONFIDENCE, axis=0):
+    """Historical VaR and CVaR along `axis`, as positive loss fractions.
+
+    The values are sorted once (missing values last). VaR is the linearly
+    interpolated (1 - confidence) quantile of each column's own valid returns;
+    CVaR is the mean of the returns at or below it.
+    """
+    ordered = np.sort(np.where(np.isfinite(values), values, np.inf), axis=axis)
+    n = np.isfinite(values).sum(axis=axis)
+    position = (1 - confidence) * np.maximum(n - 1, 0)
+    lower = np.floor(position).astype('int64')
+    upper = np.minimum(lower + 1, np.maximum(n - 1, 0))
+    low_values = np.take_along_axis(ordered, np.expand_dims(lower, axis), axis).squeeze(axis)
+    high_values = np.take_along_axis(ordered, np.expand_dims(upper, axis), axis).squeeze(axis)
+    with np.errstate(invalid='ignore'):
+        quantile = low_values + (position - lower) * (high_values - low_values)
+        tail = np.cumsum(np.where(np.isfinite(ordered), ordered, 0.0), axis=axis)
+        tail_mean = np.take_along_axis(tail, np.expand_dims(lower, axis), axis).squeeze(axis) / (lower + 1)
+    empty = n == 0
+    return np.where(empty, np.nan, -quantile), np.where(empty, np.nan, -tail_mean)
+
+
+def parametric_var(mean, std, confidence=CONFIDENCE):
+    """Gaussian VaR and CVaR from the mean and standard deviation, as positive loss
+    fractions."""
+    normal = NormalDist()
+    z = normal.inv_cdf(1 - confidence)
+    return -(mean + z * std), -(mean - std * normal.pdf(z) / (1 - confidence))
+
+
+# Pairwise-complete sums of every column against one benchmark column
+def benchmark_sums(values, bench):
+    both = np.isfinite(values) & np.isfinite(bench)[:, None]
+    x = np.where(both, values, 0.0)
+    b = np.where(both, bench[:, None], 0.0)
+    return both.sum(axis=0), x.sum(axis=0), b.sum(axis=0), (x * b).sum(axis=0), (b * b).sum(axis=0)
+
+
+def beta_from_sums(n, sx, sb, sxb, sbb, min_periods=MIN_PERIODS):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = sxb - sx * sb / n
+        variance = sbb - sb * sb / n
+        beta = covariance / variance
+    return np.where((n >= max(min_periods, 2)) & (variance > 0), beta, np.nan)
+
+
+def risk_metrics(returns, benchmark=BENCHMARK, confidence=CONFIDENCE, min_periods=MIN_PERIODS):
+    """Token x metric DataFrame of every risk metric over all rows of `returns`.
+
+    Each metric is a reduction over the date axis of the whole (dates x tokens)
+    matrix, so the cost grows with the number of cells and not with a loop over
+    tokens. Every token uses its own valid returns; beta uses the dates where
+    both the token and the benchmark have a return.
+    """
+    values = returns.to_numpy(dtype='float64')
+    n, total, squares, losses = column_sums(values)
+    mean, std, downside = moments(n, total, squares, losses, min_periods)
+    enough = n >= max(min_periods, 2)
+    var_h, cvar_h = historical_var(values, confidence)
+    var_p, cvar_p = parametric_var(mean, std, confidence)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = mean / std * np.sqrt(PERIODS_PER_YEAR)
+        sortino = mean / downside * np.sqrt(PERIODS_PER_YEAR)
+    if benchmark in returns.columns:
+        bench = returns[benchmark].to_numpy(dtype='float64')
+        beta = beta_from_sums(*benchmark_sums(values, bench), min_periods=min_periods)
+    else:
+        beta = np.full(values.shape[1], np.nan)
+    table = pd.DataFrame({
+        'observations': n,
+        'mean': mean,
+        'volatility': std,
+        'downside_deviation': downside,
+        'max_drawdown': np.where(enough, max_drawdown(values), np.nan),
+        'var_historical': np.where(enough, var_h, np.nan),
+        'cvar_historical': np.where(enough, cvar_h, np.nan),
+        'var_parametric': var_p,
+        'cvar_parametric': cvar_p,
+        'sharpe': np.where(np.isfinite(sharpe), sharpe, np.nan),
+        'sortino': np.where(np.isfinite(sortino), sortino, np.nan),
+        'beta': beta,
+    }, index=returns.columns)
+    return table[METRICS]
+
+
+def risk_table(returns, lookbacks=LOOKBACKS, benchmark=BENCHMARK, confidence=CONFIDENCE, min_periods=MIN_PERIODS):
+    """Token x (lookback, metric) DataFrame of risk_metrics over the trailing
+    `lookbacks` rows of a returns matrix on the daily calendar. Windows shorter
+    than `min_periods` only need full coverage."""
+    tables = {lookback: risk_metrics(returns.iloc[-lookback:], benchmark, confidence, min(min_periods, lookback))
+              for lookback in lookbacks}
+    return pd.concat(tables, axis=1, names=['lookback', 'metric'])
+
+
+# Sums over the trailing `window` rows ending at every row, from prefix sums; the first
+# rows cover the shorter windows available so far
+def trailing_sums(values, window):
+    prefix = np.vstack([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+    return rolling_sweep.PrefixSums.difference(prefix, window)
+
+
+# Lagged copies of `values` at every lag 0..window-1 behind each row, as aligned
+# (dates, tokens) arrays (rows before the start are `pad`), for a block of
+# SCAN_COLUMNS tokens at a time. Scanning the window lags over whole-matrix arrays
+# keeps the work vectorized; blocking the tokens keeps each block in cache.
+def lagged_blocks(values, window, pad=np.nan):
+    padded = np.vstack([np.full((window - 1,) + values.shape[1:], pad), values])
+    for start in range(0, values.shape[1], SCAN_COLUMNS):
+        block = np.ascontiguousarray(padded[:, start:start + SCAN_COLUMNS])
+        lags = [block[window - 1 - lag:window - 1 - lag + len(values)] for lag in range(window)]
+        yield slice(start, start + SCAN_COLUMNS), lags
+
+
+# Worst drawdown inside every trailing window, from the running log wealth. The scan
+# runs forward from the level before the window's first return.
+def rolling_drawdown(values, window):
+    growth = np.cumsum(np.where(np.isfinite(values), np.log1p(values), 0.0), axis=0)
+    # Levels before the first return are all the starting level (log 0)
+    growth = np.vstack([np.zeros((1,) + values.shape[1:]), growth])
+    worst = np.empty_like(growth)
+    for columns, lags in lagged_blocks(growth, window + 1, 0.0):
+        peak = lags[-1].copy()
+        block_worst = np.zeros_like(peak)
+        drop = np.empty_like(peak)
+        for level in reversed(lags[:-1]):
+            np.maximum(peak, level, out=peak)
+            np.subtract(level, peak, out=drop)
+            np.minimum(block_worst, drop, out=block_worst)
+        worst[:, columns] = block_worst
+    return np.expm1(worst[1:])
+
+
+def rolling_historical_var(returns, window, confidence=CONFIDENCE):
+    """Rolling historical VaR and CVaR (positive loss fractions) with the same
+    definitions as historical_var. The quantiles come from pandas' rolling
+    quantile; the CVaR tail shortfalls are accumulated over the window lags."""
+    rolling = returns.rolling(window, min_periods=1)
+    var = -rolling.quantile(1 - confidence).to_numpy(dtype='float64')
+    # The order statistic at the floor position closes the CVaR tail
+    threshold = rolling.quantile(1 - confidence, interpolation='lower').to_numpy(dtype='float64')
+    values = returns.to_numpy(dtype='float64')
+    n = trailing_sums(np.isfinite(values).astype('float64'), window)
+    tail = np.floor((1 - confidence) * np.maximum(n - 1, 0)) + 1
+    # Sum of the shortfalls below the threshold (missing returns add nothing); ties at
+    # the threshold make up the rest of the tail, so tail mean = threshold + shortfall / tail
+    shortfall = np.empty_like(values)
+    for columns, lags in lagged_blocks(values, window):
+        limit = np.ascontiguousarray(threshold[:, columns])
+        total = np.zeros_like(limit)
+        gap = np.empty_like(limit)
+        with np.errstate(invalid='ignore'):
+            for lagged_values in lags:
+                np.subtract(lagged_values, limit, out=gap)
+                np.fmin(gap, 0.0, out=gap)
+                total += gap
+        shortfall[:, columns] = total
+    with np.errstate(invalid='ignore'):
+        cvar = -(threshold + shortfall / tail)
+    return var, np.where(n > 0, cvar, np.nan)
+
+
+def rolling_risk(returns, window, benchmark=BENCHMARK, confidence=CONFIDENCE, min_periods=MIN_PERIODS,
+                 metrics=None):
+    """Rolling versions of the risk metrics over trailing `window`-day windows.
+
+    Returns {metric: date x token DataFrame}. Moments, Sharpe/Sortino, parametric
+    VaR/CVaR and beta come from prefix sums (constant work per cell whatever the
+    window); historical VaR/CVaR and max drawdown scan the window lags over the
+    whole matrix at once. `metrics` restricts the output to a subset.
+    """
+    metrics = METRICS if metrics is None else list(metrics)
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f"Unknown risk metrics: {sorted(unknown)}")
+    min_periods = min(min_periods, window)
+    values = returns.to_numpy(dtype='float64')
+    valid = np.isfinite(values)
+    filled = np.where(valid, values, 0.0)
+    n = trailing_sums(valid.astype('float64'), window)
+    total = trailing_sums(filled, window)
+    squares = trailing_sums(filled ** 2, window)
+    losses = trailing_sums(np.minimum(filled, 0.0) ** 2, window)
+    mean, std, downside = moments(n, total, squares, losses, min_periods)
+    enough = n >= max(min_periods, 2)
+
+    result = {'observations': n, 'mean': mean, 'volatility': std, 'downside_deviation': downside}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['sharpe'] = np.where(std > 0, mean / std * np.sqrt(PERIODS_PER_YEAR), np.nan)
+        result['sortino'] = np.where(downside > 0, mean / downside * np.sqrt(PERIODS_PER_YEAR), np.nan)
+    result['var_parametric'], result['cvar_parametric'] = parametric_var(mean, std, confidence)
+    if 'beta' in metrics:
+        result['beta'] = np.full(values.shape, np.nan)
+        if benchmark in returns.columns:
+            bench = returns[benchmark].to_numpy(dtype='float64')
+            both = valid & np.isfinite(bench)[:, None]
+            x = np.where(both, values, 0.0)
+            b = np.where(both, bench[:, None], 0.0)
+            sums = [trailing_sums(term, window) for term in (both.astype('float64'), x, b, x * b, b * b)]
+            result['beta'] = beta_from_sums(*sums, min_periods=min_periods)
+    if 'var_historical' in metrics or 'cvar_historical' in metrics:
+        var_h, cvar_h = rolling_historical_var(returns, window, confidence)
+        result['var_historical'] = np.where(enough, var_h, np.nan)
+        result['cvar_historical'] = np.where(enough, cvar_h, np.nan)
+    if 'max_drawdown' in metrics:
+        result['max_drawdown'] = np.where(enough, rolling_drawdown(values, window), np.nan)
+
+    return {name: pd.DataFrame(result[name], index=returns.index, columns=returns.columns) for name in metrics}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Risk metrics of every token over several lookbacks.')
+    parser.add_argument('--db', default=price_store.DB_PATH, help='Path to the SQLite database')
+    parser.add_argument('--matrix-store', metavar='PATH', help='Read prices from the memory-mapped matrix at PATH')
+    parser.add_argument('--tickers', nargs='+', help='Tokens to include (default: all)')
+    parser.add_argument('--lookbacks', nargs='+', type=int, default=list(LOOKBACKS), help='Trailing windows in days')
+    parser.add_argument('--benchmark', default=BENCHMARK, help='Token the betas are measured against')
+    parser.add_argument('--confidence', type=float, default=CONFIDENCE, help='VaR/CVaR confidence level')
+    parser.add_argument('--min-periods', type=int, default=MIN_PERIODS, help='Minimum returns per token and window')
+    parser.add_argument('--rolling', type=int, metavar='WINDOW', help='Also compute the metrics over rolling WINDOW-day windows')
+    parser.add_argument('--csv', help='Write the risk table to this CSV file')
+    parser.add_argument('--rolling-csv', help='Write the rolling metrics (date, symbol, metrics...) to this CSV file')
+    args = parser.parse_args()
+
+    if args.matrix_store:
+        prices = matrix_store.MatrixStore(args.matrix_store).frame(args.tickers)
+    else:
+        conn = price_store.connect(args.db, readonly=True)
+        prices = loader.load_price_matrix(conn, args.tickers)
+        conn.close()
+    # The same daily returns the charts use, on the canonical daily calendar
+    prices, _ = alignment.align(prices)
+    returns = analytics.daily_returns(prices)
+    if args.benchmark not in returns.columns:
+        print(f"No data found for benchmark {args.benchmark}; betas are left empty.")
+
+    table = risk_table(returns, args.lookbacks, args.benchmark, args.confidence, args.min_periods)
+    for lookback in args.lookbacks:
+        print(f"\nLast {lookback} days (through {returns.index[-1].date()}):")
+        print(table[lookback].to_string(float_format=lambda v: f"{v:.4f}"))
+    if args.csv:
+        table.to_csv(args.csv)
+
+    if args.rolling:
+        rolling = rolling_risk(returns, args.rolling, args.benchmark, args.confidence, args.min_periods)
+        long = pd.concat({name: frame.stack() for name, frame in rolling.items()}, axis=1)
+        long = long.dropna(how='all', subset=[m for m in METRICS if m != 'observations'])
+        print(f"\nRolling {args.rolling}-day metrics: {len(long)} (date, token) rows.")
+        if args.rolling_csv:
+            long.to_csv(args.rolling_csv)
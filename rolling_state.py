@@ -0,0 +1,299 @@
+import argparse
+import json
+import math
+import sqlite3
+import numpy as np
+import pandas as pd
+import price_store
+import loader
+
+# Windows (in days) maintained for every token
+WINDOWS = (7, 14, 30)
+
+# Per-token streaming state: the last bar consumed plus one ring buffer per window
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rolling_state (
+    symbol TEXT PRIMARY KEY,
+    last_day INTEGER,
+    last_price REAL,
+    n_bars INTEGER NOT NULL,
+    windows TEXT NOT NULL
+)
+"""
+
+# Rolling mean and standard deviation of the daily returns (as decimals), one row per
+# token, window and day
+STATS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rolling_stats (
+    symbol TEXT NOT NULL,
+    window INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    mean REAL,
+    std REAL,
+    PRIMARY KEY (symbol, window, day)
+) WITHOUT ROWID
+"""
+
+
+def ensure_schema(conn):
+    conn.execute(STATE_SCHEMA)
+    conn.execute(STATS_SCHEMA)
+    conn.commit()
+
+
+class RollingWindow:
+    """Fixed-size ring buffer of returns with a sliding Welford mean/variance.
+
+    Each push adds the new value and removes the one falling out of the window in
+    O(1). Like pandas' rolling(window) with the default min_periods, the mean and
+    std are NaN until the window holds `size` valid (non-NaN) values.
+    """
+
+    def __init__(self, size, buffer=None, pos=0, valid=0, mean=0.0, m2=0.0):
+        self.size = size
+        self.buffer = buffer if buffer is not None else []
+        self.pos = pos
+        self.valid = valid
+        self.mean_ = mean
+        self.m2 = m2
+
+    def _add(self, x):
+        self.valid += 1
+        delta = x - self.mean_
+        self.mean_ += delta / self.valid
+        self.m2 += delta * (x - self.mean_)
+
+    def _remove(self, x):
+        self.valid -= 1
+        if self.valid == 0:
+            self.mean_ = 0.0
+            self.m2 = 0.0
+            return
+        delta = x - self.mean_
+        self.mean_ -= delta / self.valid
+        self.m2 = max(0.0, self.m2 - delta * (x - self.mean_))
+
+    def push(self, x):
+        if len(self.buffer) < self.size:
+            self.buffer.append(x)
+        else:
+            old = self.buffer[self.pos]
+            if not math.isnan(old):
+                self._remove(old)
+            self.buffer[self.pos] = x
+        self.pos = (self.pos + 1) % self.size
+        if not math.isnan(x):
+            self._add(x)
+
+    def mean(self):
+        return self.mean_ if self.valid == self.size else math.nan
+
+    def std(self):
+        if self.valid != self.size or self.size < 2:
+            return math.nan
+        return math.sqrt(self.m2 / (self.size - 1))
+
+    def to_dict(self):
+        return {'buffer': self.buffer, 'pos': self.pos, 'valid': self.valid, 'mean': self.mean_, 'm2': self.m2}
+
+    @classmethod
+    def from_dict(cls, size, data):
+        return cls(size, data['buffer'], data['pos'], data['valid'], data['mean'], data['m2'])
+
+
+class TokenState:
+    """Streaming state of one token: last bar seen and a RollingWindow per size."""
+
+    def __init__(self, symbol, windows=WINDOWS, last_day=None, last_price=None, n_bars=0, rolling=None):
+        self.symbol = symbol
+        self.last_day = last_day
+        self.last_price = last_price
+        self.n_bars = n_bars
+        self.rolling = rolling or {w: RollingWindow(w) for w in windows}
+
+    def push_bar(self, day, price):
+        """Consume one daily bar; returns {window: (mean, std)} for that day.
+
+        Days skipped since the previous bar count as missing returns, as they
+        would in a daily-calendar DataFrame, and so does the first bar after them.
+        """
+        price = math.nan if price is None else float(price)
+        if self.last_day is None:
+            ret = math.nan
+        else:
+            missing = min(day - self.last_day - 1, max(self.rolling))
+            for _ in range(max(missing, 0)):
+                for window in self.rolling.values():
+                    window.push(math.nan)
+            if missing > 0 or self.last_price is None or math.isnan(self.last_price):
+                ret = math.nan
+            else:
+                ret = price / self.last_price - 1
+        for window in self.rolling.values():
+            window.push(ret)
+        self.last_day = day
+        self.last_price = price
+        self.n_bars += 1
+        return {size: (window.mean(), window.std()) for size, window in self.rolling.items()}
+
+    def to_row(self):
+        windows = json.dumps({str(size): w.to_dict() for size, w in self.rolling.items()})
+        return (self.symbol, self.last_day, self.last_price, self.n_bars, windows)
+
+    @classmethod
+    def from_row(cls, row):
+        symbol, last_day, last_price, n_bars, windows = row
+        rolling = {int(size): RollingWindow.from_dict(int(size), data) for size, data in json.loads(windows).items()}
+        return cls(symbol, last_day=last_day, last_price=last_price, n_bars=n_bars, rolling=rolling)
+
+
+def load_state(conn, symbol, windows=WINDOWS):
+    row = conn.execute(
+        "SELECT symbol, last_day, last_price, n_bars, windows FROM rolling_state WHERE symbol = ?", (symbol,)
+    ).fetchone()
+    if row is None:
+        return TokenState(symbol, windows)
+    state = TokenState.from_row(row)
+    if set(state.rolling) != set(windows):
+        # The tracked windows changed; start this token over
+        return TokenState(symbol, windows)
+    return state
+
+
+def update(conn, symbols, windows=WINDOWS):
+    """Feed every bar stored after each token's last consumed day into its state.
+
+    Costs O(new bars) per token. A token whose stored bars changed on or before
+    its last consumed day (a backfill or a revised bar, as recorded by
+    price_store.upsert_rows) is replayed from its first bar instead.
+    Returns {symbol: bars_consumed}.
+    """
+    ensure_schema(conn)
+    consumed = {}
+    pending = price_store.pending_changes(conn, 'rolling_state')
+    for symbol in symbols:
+        state = load_state(conn, symbol, windows)
+        changes = pending.get(symbol)
+        if changes is not None and state.last_day is not None and changes[0] <= state.last_day:
+            state = TokenState(symbol, windows)
+        if state.n_bars == 0:
+            # Fresh (or reset) state: drop any stats left from an older state
+            conn.execute("DELETE FROM rolling_stats WHERE symbol = ?", (symbol,))
+        after = -1 if state.last_day is None else state.last_day
+        bars = conn.execute(
+            f"SELECT day, price FROM {price_store.PRICES_TABLE} WHERE symbol = ? AND day > ? ORDER BY day",
+            (symbol, after),
+        ).fetchall()
+        stats = []
+        for day, price in bars:
+            for size, (mean, std) in state.push_bar(day, price).items():
+                stats.append((symbol, size, day, mean, std))
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO rolling_stats VALUES (?, ?, ?, ?, ?)", stats)
+            conn.execute("INSERT OR REPLACE INTO rolling_state VALUES (?, ?, ?, ?, ?)", state.to_row())
+            if changes is not None:
+                price_store.clear_changes(conn, 'rolling_state', symbol, changes[1])
+        consumed[symbol] = len(bars)
+    return consumed
+
+
+# Forget the streaming state of the given tokens and replay their full history
+def rebuild(conn, symbols, windows=WINDOWS):
+    ensure_schema(conn)
+    with conn:
+        conn.executemany("DELETE FROM rolling_state WHERE symbol = ?", [(s,) for s in symbols])
+        conn.executemany("DELETE FROM rolling_stats WHERE symbol = ?", [(s,) for s in symbols])
+    return update(conn, symbols, windows)
+
+
+def rolling_frame(conn, symbols, window, stat='mean'):
+    """Date x token DataFrame of the persisted rolling `stat` ('mean' or 'std').
+
+    Catches up on any bars not yet consumed first, so it is always current.
+    """
+    if stat not in ('mean', 'std'):
+        raise ValueError(f"Unknown rolling statistic: {stat}")
+    symbols = list(symbols)
+    if symbols:
+        update(conn, symbols)
+    return stats_frame(conn, symbols, window, stat)
+
+
+# The persisted stats as they are, for readers that cannot write (see is_current)
+def stats_frame(conn, symbols, window, stat='mean'):
+    symbols = list(symbols)
+    if not symbols:
+        return pd.DataFrame(index=loader.days_to_index([]), columns=pd.Index([], name='symbol'), dtype='float64')
+    query = (
+        f"SELECT symbol, day, {stat} FROM rolling_stats "
+        f"WHERE window = ? AND symbol IN ({', '.join('?' for _ in symbols)})"
+    )
+    df = pd.read_sql(query, conn, params=[window] + symbols)
+    frame = df.pivot(index='day', columns='symbol', values=stat)
+    frame = frame.reindex(columns=[s for s in symbols if s in frame.columns])
+    frame.index = loader.days_to_index(frame.index)
+    frame.columns.name = 'symbol'
+    return frame
+
+
+def is_current(conn, symbols, windows=WINDOWS):
+    """Whether the persisted stats of every token cover all of its stored bars, with
+    no backfill or revision waiting, so a read-only reader can use them as they are."""
+    symbols = list(symbols)
+    try:
+        pending = price_store.pending_changes(conn, 'rolling_state')
+        states = {row[0]: row[1:] for row in conn.execute(
+            f"SELECT symbol, last_day, windows FROM rolling_state "
+            f"WHERE symbol IN ({', '.join('?' for _ in symbols)})", symbols)}
+    except sqlite3.OperationalError:
+        # A database the rolling state was never built in
+        return False
+    for symbol in symbols:
+        if symbol in pending or symbol not in states:
+            return False
+        last_day, tracked = states[symbol]
+        latest = conn.execute(f"SELECT MAX(ts) FROM {price_store.PRICES_TABLE} WHERE symbol = ?",
+                              (symbol,)).fetchone()[0]
+        if latest is None or last_day != latest // price_store.SECONDS_PER_DAY:
+            return False
+        if {int(size) for size in json.loads(tracked)} != set(windows):
+            return False
+    return True
+
+
+# Compare the persisted stats with a full pandas recomputation on a daily calendar.
+# Returns the largest absolute difference per window.
+def verify(conn, symbols, windows=WINDOWS):
+    prices = loader.load_price_matrix(conn, symbols)
+    prices = prices.asfreq('D')
+    returns = prices.pct_change(fill_method=None)
+    worst = {}
+    for window in windows:
+        for stat, expected in (('mean', returns.rolling(window).mean()), ('std', returns.rolling(window).std())):
+            actual = rolling_frame(conn, list(prices.columns), window, stat).reindex(expected.index)
+            # Only compare the days where a bar exists
+            mask = prices.notna().to_numpy()
+            a, e = actual.to_numpy()[mask], expected.to_numpy()[mask]
+            if not np.array_equal(np.isnan(a), np.isnan(e)):
+                raise AssertionError(f"NaN pattern differs for window={window} stat={stat}")
+            diff = np.nanmax(np.abs(a - e)) if np.isfinite(a).any() else 0.0
+            worst[window] = max(worst.get(window, 0.0), float(diff))
+    return worst
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain streaming rolling statistics for every token.')
+    parser.add_argument('--db', default=price_store.DB_PATH, help='Path to the SQLite database')
+    parser.add_argument('--rebuild', action='store_true', help='Replay the full history instead of only new bars')
+    parser.add_argument('--verify', action='store_true', help='Compare the persisted stats with pandas')
+    args = parser.parse_args()
+
+    conn = price_store.connect(args.db)
+    symbols = [row[0] for row in conn.execute(f"SELECT DISTINCT symbol FROM {price_store.PRICES_TABLE}")]
+    consumed = rebuild(conn, symbols) if args.rebuild else update(conn, symbols)
+    for symbol, count in consumed.items():
+        print(f"Consumed {count} new bars for {symbol}.")
+    if args.verify:
+        for window, diff in verify(conn, symbols).items():
+            print(f"{window}-day window: max abs difference vs pandas {diff:.3g}")
+    conn.close()
@@ -0,0 +1,224 @@
+import argparse
+import numpy as np
+import pandas as pd
+import price_store
+import loader
+import analytics
+import alignment
+
+# Windows (in days) swept by default
+WINDOWS = (7, 14, 30, 90)
+
+STATS = ('mean', 'std', 'min', 'max', 'zscore')
+
+
+class PrefixSums:
+    """Running count, sum and sum of squares of every column of a (dates, tokens)
+    array with NaN for missing values, built once and shared by every window.
+
+    The sums are taken over the values minus a per-column shift (the column's
+    mean), so the sum of squares does not cancel catastrophically when the
+    variance is small next to the mean; the shift is added back to the means.
+    """
+
+    def __init__(self, values):
+        values = np.asarray(values, dtype='float64')
+        valid = np.isfinite(values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.shift = np.where(valid.any(axis=0), np.nansum(values, axis=0) / valid.sum(axis=0), 0.0)
+        centred = np.where(valid, values - self.shift, 0.0)
+        zeros = np.zeros((1,) + values.shape[1:])
+        self.count = np.vstack([zeros, np.cumsum(valid, axis=0)])
+        self.total = np.vstack([zeros, np.cumsum(centred, axis=0)])
+        self.squares = np.vstack([zeros, np.cumsum(centred * centred, axis=0)])
+
+    @staticmethod
+    def difference(prefix, window):
+        # Row e of the result is prefix[e + 1] - prefix[max(e + 1 - window, 0)], taken
+        # with two slice subtractions instead of gathering rows
+        result = np.subtract(prefix[1:], prefix[0])
+        if window < len(prefix) - 1:
+            np.subtract(prefix[window + 1:], prefix[1:-window], out=result[window:])
+        return result
+
+    def window(self, window):
+        """(count, mean, sample variance) over the trailing `window` rows ending at
+        every row (shorter at the start)."""
+        n = self.difference(self.count, window)
+        total = self.difference(self.total, window)
+        squares = self.difference(self.squares, window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            centred_mean = total / n
+            # Sum of squared deviations from the window mean; rounding can leave a tiny
+            # negative value for a flat window, which is clamped to zero
+            deviations = np.maximum(squares - total * centred_mean, 0.0)
+            variance = deviations / (n - 1)
+        return n, centred_mean + self.shift, variance
+
+
+def window_extremes(values, window, reduce):
+    """Trailing `window`-row minimum or maximum (`reduce` is np.fmin or np.fmax) of
+    every column, ignoring NaN, in O(rows) whatever the window.
+
+    Uses the van Herk/Gil-Werman scheme: the rows are cut into blocks of `window`,
+    each block gets a running reduction forwards and backwards, and every window
+    is the reduction of one backward and one forward value.
+    """
+    n_rows = len(values)
+    fill = np.inf if reduce is np.fmin else -np.inf
+    n_blocks = -(-(n_rows + window - 1) // window)
+    # Pad window - 1 rows in front so every window ends inside the array
+    padded = np.full((n_blocks * window,) + values.shape[1:], fill)
+    padded[window - 1:window - 1 + n_rows] = np.where(np.isfinite(values), values, fill)
+    blocks = padded.reshape((n_blocks, window) + values.shape[1:])
+    forward = reduce.accumulate(blocks, axis=1).reshape(padded.shape)
+    backward = reduce.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+    # The window ending at padded row e spans rows e - window + 1 .. e
+    ends = np.arange(window - 1, window - 1 + n_rows)
+    result = reduce(backward[ends - window + 1], forward[ends])
+    return np.where(np.isfinite(result), result, np.nan)
+
+
+class RollingSweep:
+    """Rolling statistics of one date x token matrix for several windows.
+
+    `values[stat]` is an array of shape (windows, dates, tokens), compact float32
+    unless the sweep asked for float64; frame() and to_long() select from it for
+    plotting and export.
+    """
+
+    def __init__(self, values, windows, index, columns):
+        self.values = values
+        self.windows = list(windows)
+        self.index = index
+        self.columns = columns
+
+    def frame(self, stat, window):
+        """Date x token DataFrame of one statistic and window."""
+        data = self.values[stat][self.windows.index(window)]
+        return pd.DataFrame(data.astype('float64'), index=self.index, columns=self.columns)
+
+    def to_long(self, stats=None):
+        """(window, date, symbol) x statistic DataFrame, without the rows where
+        every statistic is missing."""
+        stats = list(stats or self.values)
+        index = pd.MultiIndex.from_product([self.windows, self.index, self.columns],
+                                           names=['window', self.index.name or 'timestamp', 'symbol'])
+        long = pd.DataFrame({stat: self.values[stat].reshape(-1) for stat in stats}, index=index)
+        return long.dropna(how='all')
+
+    def save(self, path):
+        """Write the arrays, windows, dates and tokens to an .npz file."""
+        np.savez_compressed(path, windows=np.asarray(self.windows), dates=self.index.values.astype('datetime64[s]'),
+                            symbols=np.asarray(self.columns, dtype=str), **self.values)
+
+
+# Reject window sizes a rolling window cannot have
+def check_windows(windows):
+    bad = [w for w in windows if int(w) != w or w < 1]
+    if bad:
+        raise ValueError(f"Rolling windows must be whole numbers of at least 1 day, got {bad}")
+
+
+def sweep(frame, windows=WINDOWS, stats=STATS, min_periods=None, dtype='float32'):
+    """Rolling mean, std, min, max and z-score of every column of `frame` for every
+    window in one pass over the data.
+
+    The prefix sums are built once and every window reads its sums as a difference
+    of two rows, so mean, std and z-score cost the same whatever the window; min
+    and max are O(rows) per window. A window needs `min_periods` values (default:
+    the whole window, as pandas' rolling does). The z-score is how many rolling
+    standard deviations the latest value is from the rolling mean. Results are
+    stored as `dtype` (float32 by default, float64 where the exact values matter).
+    """
+    check_windows(windows)
+    unknown = set(stats) - set(STATS)
+    if unknown:
+        raise ValueError(f"Unknown rolling statistics: {sorted(unknown)}")
+    values = frame.to_numpy(dtype='float64')
+    prefix = PrefixSums(values)
+    shape = (len(windows),) + values.shape
+    result = {stat: np.full(shape, np.nan, dtype=dtype) for stat in stats}
+    for i, window in enumerate(windows):
+        required = window if min_periods is None else min(min_periods, window)
+        n, mean, variance = prefix.window(window)
+        enough = n >= required
+        std = np.sqrt(variance)
+        if 'mean' in result:
+            result['mean'][i] = np.where(enough, mean, np.nan)
+        if 'std' in result:
+            result['std'][i] = np.where(enough & (n > 1), std, np.nan)
+        if 'zscore' in result:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                zscore = (values - mean) / std
+            result['zscore'][i] = np.where(enough & (std > 0), zscore, np.nan)
+        for stat, reduce in (('min', np.fmin), ('max', np.fmax)):
+            if stat in result:
+                result[stat][i] = np.where(enough, window_extremes(values, window, reduce), np.nan)
+    return RollingSweep(result, windows, frame.index, frame.columns)
+
+
+def daily_sweep(frame, windows, stat):
+    """One date x token float64 DataFrame of `stat` per window, computed on the
+    daily calendar and returned on `frame`'s dates, like the pipeline's rolling."""
+    calendar = frame.asfreq('D') if not frame.empty else frame
+    result = sweep(calendar, windows, (stat,), dtype='float64')
+    return [result.frame(stat, window).reindex(frame.index) for window in windows]
+
+
+# Largest absolute difference of every statistic and window against pandas' rolling
+def verify(frame, result):
+    worst = {}
+    for window in result.windows:
+        rolling = frame.rolling(window)
+        expected = {'mean': rolling.mean(), 'std': rolling.std(), 'min': rolling.min(), 'max': rolling.max()}
+        expected['zscore'] = (frame - expected['mean']) / expected['std']
+        for stat in result.values:
+            actual = result.frame(stat, window).to_numpy()
+            wanted = expected[stat].to_numpy()
+            if stat == 'zscore':
+                # Flat windows have no z-score; pandas may return +-inf or huge values there
+                wanted = np.where(expected['std'].to_numpy() > 0, wanted, np.nan)
+            both = np.isfinite(actual) & np.isfinite(wanted)
+            scale = np.maximum(np.abs(wanted), 1.0) if stat == 'zscore' else 1.0
+            diff = np.abs(actual - wanted) / scale
+            worst[(stat, window)] = float(diff[both].max()) if both.any() else 0.0
+    return worst
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rolling statistics of the daily returns for several windows at once.')
+    parser.add_argument('--db', default=price_store.DB_PATH, help='Path to the SQLite database')
+    parser.add_argument('--tickers', nargs='+', help='Tokens to include (default: all)')
+    parser.add_argument('--windows', nargs='+', type=int, default=list(WINDOWS), help='Window sizes in days')
+    parser.add_argument('--stats', nargs='+', choices=STATS, default=list(STATS), help='Statistics to compute')
+    parser.add_argument('--min-periods', type=int, help='Returns a window needs (default: the whole window)')
+    parser.add_argument('--csv', help='Write (window, date, symbol, stats...) rows to this CSV file')
+    parser.add_argument('--npz', help='Write the (window, date, token) arrays to this .npz file')
+    parser.add_argument('--verify', action='store_true', help='Compare every statistic with pandas rolling')
+    args = parser.parse_args()
+    try:
+        check_windows(args.windows)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.min_periods is not None and args.min_periods < 1:
+        parser.error('--min-periods must be at least 1')
+
+    conn = price_store.connect(args.db, readonly=True)
+    prices, _ = alignment.align(loader.load_price_matrix(conn, args.tickers))
+    conn.close()
+    returns = analytics.daily_returns(prices)
+    result = sweep(returns, args.windows, args.stats, args.min_periods)
+
+    last = returns.index[-1]
+    for window in args.windows:
+        latest = pd.DataFrame({stat: result.frame(stat, window).loc[last] for stat in args.stats})
+        print(f"\n{window}-day window on {last.date()}:")
+        print(latest.to_string(float_format=lambda v: f"{v:.4f}"))
+    if args.csv:
+        result.to_long().to_csv(args.csv)
+    if args.npz:
+        result.save(args.npz)
+    if args.verify:
+        for (stat, window), diff in verify(returns, result).items():
+            print(f"{stat} {window}-day: max abs difference vs pandas {diff:.3g}")
@@ -0,0 +1,304 @@
+import argparse
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+import price_store
+import loader
+import analytics
+
+# Default address of the service
+HOST = '127.0.0.1'
+PORT = 8050
+
+# Connections kept open to the SQLite store
+POOL_SIZE = 4
+
+# Upper bound on the encoded responses kept in the LRU cache
+CACHE_BYTES = 64 * 1024 * 1024
+
+# Rows per JSON chunk; responses of more than one chunk are sent with chunked encoding
+CHUNK_ROWS = 2000
+
+# How long a data version read from ingest_state is trusted before it is re-read
+VERSION_TTL = 1.0
+
+
+class ConnectionPool:
+    """Fixed-size pool of read-only SQLite connections shared by the request threads."""
+
+    def __init__(self, path=price_store.DB_PATH, size=POOL_SIZE):
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(price_store.connect(path, readonly=True, check_same_thread=False))
+
+    @contextmanager
+    def connection(self):
+        conn = self.connections.get()
+        try:
+            yield conn
+        finally:
+            self.connections.put(conn)
+
+    def close(self):
+        while not self.connections.empty():
+            self.connections.get().close()
+
+
+class LRUCache:
+    """Thread-safe LRU of encoded responses, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            chunks = self.entries.get(key)
+            if chunks is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return chunks
+
+    def put(self, key, chunks):
+        nbytes = sum(len(chunk) for chunk in chunks)
+        if nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= sum(len(chunk) for chunk in self.entries.pop(key))
+            self.entries[key] = chunks
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= sum(len(chunk) for chunk in evicted)
+
+
+class QueryError(Exception):
+    """Raised for a request the service cannot answer; carries the HTTP status."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# Each metric maps a daily price matrix to a frame (date x token, or token x token)
+# through the shared analytics functions. Returns need the day before the requested
+# start, and rolling metrics a full window of it.
+METRICS = {
+    'prices': lambda ctx, window: ctx.prices,
+    'returns': lambda ctx, window: ctx.pct_changes,
+    'rolling_mean': lambda ctx, window: ctx.rolling_mean(window),
+    'volatility': lambda ctx, window: ctx.rolling_volatility(window),
+    'cumulative': lambda ctx, window: ctx.cumulative_returns,
+    'correlation': lambda ctx, window: ctx.correlation,
+}
+ROLLING = {'rolling_mean', 'volatility'}
+
+
+def iter_chunks(metric, frame, chunk_rows=CHUNK_ROWS):
+    """Encode a frame as JSON byte chunks, produced one block of `chunk_rows` rows
+    at a time, that concatenate to {"metric": ..., "columns": [...],
+    "rows": [[label, v1, v2, ...], ...]}, with NaN as null."""
+    if isinstance(frame.index, pd.DatetimeIndex):
+        labels = frame.index.strftime('%Y-%m-%d').tolist()
+    else:
+        labels = [str(label) for label in frame.index]
+    values = frame.to_numpy(dtype='float64')
+    head = json.dumps({'metric': metric, 'columns': [str(c) for c in frame.columns]})[:-1] + ', "rows": ['
+    yield head.encode()
+    for start in range(0, len(labels), chunk_rows):
+        block = values[start:start + chunk_rows]
+        cells = np.where(np.isfinite(block), block, None).tolist()
+        rows = [[label] + row for label, row in zip(labels[start:start + chunk_rows], cells)]
+        text = json.dumps(rows)[1:-1]
+        yield ((', ' if start else '') + text).encode()
+    yield b']}'
+
+
+def encode_chunks(metric, frame, chunk_rows=CHUNK_ROWS):
+    """The chunks of iter_chunks as a list."""
+    return list(iter_chunks(metric, frame, chunk_rows))
+
+
+class MetricService:
+    """Answers metric queries from the SQLite store through a connection pool and an
+    LRU cache of encoded responses.
+
+    Cache keys include a data version read from ingest_state (re-read at most every
+    VERSION_TTL seconds), so responses are recomputed once new bars are stored.
+    """
+
+    def __init__(self, pool, cache):
+        self.pool = pool
+        self.cache = cache
+        self.version = None
+        self.version_read = 0.0
+        self.lock = threading.Lock()
+
+    def data_version(self):
+        with self.lock:
+            if time.monotonic() - self.version_read < VERSION_TTL:
+                return self.version
+        with self.pool.connection() as conn:
+            try:
+                version = conn.execute("SELECT MAX(updated_at), SUM(high_water_ts), COUNT(*) FROM ingest_state").fetchone()
+            except sqlite3.OperationalError:
+                version = None
+        with self.lock:
+            self.version, self.version_read = version, time.monotonic()
+        return version
+
+    def tokens(self):
+        with self.pool.connection() as conn:
+            symbols = [row[0] for row in conn.execute(f"SELECT DISTINCT symbol FROM {price_store.PRICES_TABLE}")]
+        return [json.dumps({'tokens': symbols}).encode()]
+
+    def compute(self, metric, tokens, start, end, window):
+        # Read enough history before `start` for the first value to be complete
+        history = window if metric in ROLLING else 1 if metric == 'returns' else 0
+        load_start = start
+        if history and start is not None:
+            load_start = pd.Timestamp(start) - pd.Timedelta(days=history)
+        with self.pool.connection() as conn:
+            prices = loader.load_price_matrix(conn, tokens, load_start, end)
+        if prices.empty:
+            raise QueryError('No data for the requested tokens and dates', 404)
+        frame = METRICS[metric](analytics.AnalysisContext(prices), window)
+        if start is not None and metric != 'correlation':
+            frame = frame.loc[pd.Timestamp(start):]
+        return frame
+
+    def query(self, metric, tokens=None, start=None, end=None, window=analytics.WINDOW_SIZE):
+        """Encoded response chunks for one query: a list from the cache, or for a
+        frame of more than one chunk of rows, a generator that encodes the chunks as
+        they are sent and caches them once the last one is out. The frame itself is
+        computed before this returns, so query errors come before any output."""
+        if metric not in METRICS:
+            raise QueryError(f"Unknown metric: {metric}", 404)
+        key = (metric, tuple(tokens) if tokens else None, start, end, window if metric in ROLLING else None,
+               self.data_version())
+        chunks = self.cache.get(key)
+        if chunks is not None:
+            return chunks
+        frame = self.compute(metric, tokens, start, end, window)
+        if len(frame) <= CHUNK_ROWS:
+            chunks = encode_chunks(metric, frame)
+            self.cache.put(key, chunks)
+            return chunks
+        return self.stream(key, iter_chunks(metric, frame))
+
+    def stream(self, key, chunks):
+        sent = []
+        for chunk in chunks:
+            sent.append(chunk)
+            yield chunk
+        # Only complete responses are cached
+        self.cache.put(key, sent)
+
+
+def parse_query(query):
+    params = parse_qs(query)
+
+    def one(name, default=None):
+        return params.get(name, [default])[-1]
+
+    tokens = one('tokens')
+    tokens = [t for t in tokens.split(',') if t] if tokens else None
+    try:
+        window = int(one('window', analytics.WINDOW_SIZE))
+        start = one('start') and str(pd.Timestamp(one('start')).date())
+        end = one('end') and str(pd.Timestamp(one('end')).date())
+    except ValueError as e:
+        raise QueryError(f"Bad query parameter: {e}")
+    if window < 1:
+        raise QueryError('window must be at least 1')
+    return tokens, start, end, window
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def send_chunks(self, chunks, status=200):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            if isinstance(chunks, list) and len(chunks) <= 3:
+                body = b''.join(chunks)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            # Large ranges are streamed chunk by chunk, each written as soon as it is encoded
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in chunks:
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split('/') if p]
+            try:
+                if parts == ['health']:
+                    chunks = [json.dumps({'status': 'ok', 'cache_hits': service.cache.hits,
+                                          'cache_misses': service.cache.misses}).encode()]
+                elif parts == ['tokens']:
+                    chunks = service.tokens()
+                elif len(parts) == 2 and parts[0] == 'metrics':
+                    chunks = service.query(parts[1], *parse_query(url.query))
+                else:
+                    raise QueryError(f"Not found: {url.path}", 404)
+            except QueryError as e:
+                self.send_chunks([json.dumps({'error': str(e)}).encode()], e.status)
+                return
+            except Exception as e:
+                print(f"Failed to answer {self.path}: {e!r}")
+                self.send_chunks([json.dumps({'error': 'Internal server error'}).encode()], 500)
+                return
+            try:
+                self.send_chunks(chunks)
+            except Exception as e:
+                # The status line is already out, so the response can only be cut short
+                print(f"Failed to stream {self.path}: {e!r}")
+                self.close_connection = True
+
+    return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve returns, volatility, correlation and cumulative returns as JSON.')
+    parser.add_argument('--db', default=price_store.DB_PATH, help='Path to the SQLite database')
+    parser.add_argument('--host', default=HOST, help='Address to listen on')
+    parser.add_argument('--port', type=int, default=PORT, help='Port to listen on')
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE, help='SQLite connections in the pool')
+    parser.add_argument('--cache-mb', type=float, default=CACHE_BYTES / 2**20, help='Size bound of the response cache in MB')
+    args = parser.parse_args()
+
+    pool = ConnectionPool(args.db, args.pool_size)
+    service = MetricService(pool, LRUCache(int(args.cache_mb * 2**20)))
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Serving metrics on http://{args.host}:{args.port}/metrics/<metric>?tokens=SOL,BONK&start=...&end=...&window=7")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import backends
+
+pytest.importorskip('polars')
+
+
+# Synthetic date x token prices with scattered gaps, a token listed late, one with
+# no data and one whose price never moves
+@pytest.fixture
+def prices():
+    rng = np.random.default_rng(0)
+    values = np.exp(np.cumsum(rng.normal(0, 0.03, (120, 12)), axis=0))
+    frame = pd.DataFrame(values, index=pd.date_range('2024-01-01', periods=120),
+                         columns=[f"T{i}" for i in range(12)])
+    frame = frame.mask(rng.random(frame.shape) < 0.15)
+    frame.iloc[:100, 1] = np.nan
+    frame.iloc[:, 2] = np.nan
+    frame.iloc[:, 3] = 5.0
+    return frame
+
+
+def assert_matches(expected, actual):
+    assert actual.index.equals(expected.index)
+    assert actual.columns.equals(expected.columns)
+    assert (actual.dtypes == expected.dtypes).all()
+    expected, actual = expected.to_numpy(dtype='float64'), actual.to_numpy(dtype='float64')
+    np.testing.assert_array_equal(np.isnan(actual), np.isnan(expected))
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=backends.TOLERANCE, equal_nan=True)
+
+
+@pytest.fixture
+def pair():
+    return backends.get('pandas'), backends.get('polars')
+
+
+def test_returns(pair, prices):
+    reference, polars = pair
+    assert_matches(reference.returns(prices), polars.returns(prices))
+    as_float32 = prices.astype('float32')
+    assert_matches(reference.returns(as_float32), polars.returns(as_float32))
+
+
+@pytest.mark.parametrize('stat', backends.ROLLING_STATS)
+@pytest.mark.parametrize('window', [1, 7, 30])
+def test_rolling(pair, prices, window, stat):
+    reference, polars = pair
+    returns = reference.returns(prices)
+    assert_matches(reference.rolling(returns, window, stat), polars.rolling(returns, window, stat))
+
+
+def test_cumulative(pair, prices):
+    reference, polars = pair
+    returns = reference.returns(prices)
+    assert_matches(reference.cumulative(returns), polars.cumulative(returns))
+
+
+def test_correlation(pair, prices):
+    reference, polars = pair
+    returns = reference.returns(prices)
+    assert_matches(reference.correlation(returns), polars.correlation(returns))
+
+
+def test_empty_frames_go_to_pandas(pair, prices):
+    reference, polars = pair
+    empty = prices.iloc[:0]
+    assert_matches(reference.returns(empty), polars.returns(empty))
+    assert_matches(reference.correlation(empty), polars.correlation(empty))
+
+
+def test_verify_reports_no_mismatch(prices):
+    assert all(diff <= backends.TOLERANCE for diff in backends.verify(prices, 'polars', (7, 30)).values())
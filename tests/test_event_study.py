@@ -0,0 +1,45 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import event_study
+
+
+def test_windows_masks_events_outside_the_data():
+    returns = pd.DataFrame(np.arange(20.0).reshape(10, 2), index=pd.date_range('2024-01-10', periods=10),
+                           columns=['A', 'B'])
+    events = [event_study.Event('before', '2024-01-01'), event_study.Event('first day', '2024-01-10'),
+              event_study.Event('after', '2024-02-01')]
+    tensor = event_study.windows(returns, events, np.arange(-1, 2))
+    assert np.isnan(tensor[0]).all()
+    assert np.isnan(tensor[2]).all()
+    np.testing.assert_array_equal(tensor[1, :, 0], [np.nan, 0.0, 2.0])
+
+
+def test_bootstrap_means_match_nanmean_of_the_resamples():
+    rng = np.random.default_rng(1)
+    sample = rng.normal(size=(40, 5))
+    sample[rng.random(sample.shape) < 0.3] = np.nan
+    sample[:, 0] = np.nan
+    means = event_study.bootstrap_chunk((sample, 300, 7))
+    # The same draws as the chunk's first block
+    idx = np.random.default_rng(7).integers(0, 40, size=(256, 40))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        expected = np.nanmean(sample[idx], axis=1)
+    np.testing.assert_allclose(means[:256], expected, rtol=0, atol=1e-12)
+    assert np.isnan(means[:, 0]).all()
+
+
+def test_bootstrap_p_value_ignores_draws_without_a_mean():
+    # Column 0 has two valid values in 40 rows, so many resamples miss both
+    sample = np.full((40, 2), np.nan)
+    sample[:2, 0] = [1.0, 3.0]
+    sample[:, 1] = np.linspace(-1.0, 1.0, 40) + 0.05
+    mean, p_value, draws = event_study.bootstrap_test(sample, 2000, workers=1)
+    means = event_study.bootstrap_chunk((sample - mean, 2000, 0))
+    usable = np.isfinite(means[:, 0])
+    assert 0 < draws[0] == usable.sum() < 2000
+    assert draws[1] == 2000
+    assert p_value[0] == (np.abs(means[usable, 0]) >= np.abs(mean[0])).mean()
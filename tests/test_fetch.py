@@ -0,0 +1,124 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+
+import cmc_client
+import fetchData
+import price_store
+
+DAY = 86400
+
+
+# Stub of the historical quotes endpoint: one daily quote per day of the requested
+# range. Pages whose (symbol, time_start) is in `broken` get a body that isn't JSON,
+# and pages in `slow` are answered late.
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    broken = set()
+    slow = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        symbol, start, end = query['symbol'][0], int(query['time_start'][0]), int(query['time_end'][0])
+        if (symbol, start) in self.slow:
+            time.sleep(0.3)
+        if (symbol, start) in self.broken:
+            body = b'<html>upstream error</html>'
+        else:
+            quotes = []
+            for ts in range(start, end, DAY):
+                stamp = datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+                quotes.append({'timestamp': stamp, 'quote': {'USD': {'price': 1.0, 'timestamp': stamp}}})
+            body = json.dumps({'data': {'quotes': quotes}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    StubHandler.broken, StubHandler.slow = set(), set()
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield StubHandler, f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def client(server):
+    _, url = server
+    with cmc_client.CMCClient('test', base_url=url, credits_per_minute=60000, max_workers=4,
+                              max_retries=0) as client:
+        yield client
+
+
+def epoch(timestamp):
+    return int(timestamp.timestamp())
+
+
+def make_jobs(symbols, start='2024-01-01', end='2024-01-31', page_days=10):
+    return [(symbol, page_start, page_end) for symbol in symbols
+            for page_start, page_end in cmc_client.page_ranges(pd.Timestamp(start), pd.Timestamp(end), page_days)]
+
+
+def test_fetch_many_yields_each_symbols_pages_in_order(server, client):
+    handler, _ = server
+    jobs = make_jobs(['AAA', 'BBB'])
+    # The first page of each symbol finishes last
+    handler.slow = {('AAA', epoch(jobs[0][1])), ('BBB', epoch(jobs[3][1]))}
+    results = list(client.fetch_many(jobs))
+    assert sorted(job for job, _, _ in results) == sorted(jobs)
+    for symbol in ('AAA', 'BBB'):
+        yielded = [job for job, _, _ in results if job[0] == symbol]
+        assert yielded == [job for job in jobs if job[0] == symbol]
+    assert all(error is None and len(quotes) == 10 for _, quotes, error in results)
+
+
+def test_fetch_many_reports_a_malformed_page_without_ending_the_batch(server, client):
+    handler, _ = server
+    jobs = make_jobs(['AAA'])
+    handler.broken = {('AAA', epoch(jobs[1][1]))}
+    results = list(client.fetch_many(jobs))
+    assert [job for job, _, _ in results] == jobs
+    _, quotes, error = results[1]
+    assert quotes is None and isinstance(error, cmc_client.CMCError)
+    assert all(error is None for _, _, error in results[::2])
+
+
+def test_failed_page_is_planned_again(server, client, tmp_path, monkeypatch):
+    handler, _ = server
+    monkeypatch.setattr(fetchData, 'fixed_start_date', pd.Timestamp('2024-01-01'))
+    end = pd.Timestamp('2024-01-31')
+    conn = price_store.connect(str(tmp_path / 'prices.db'))
+    price_store.ensure_schema(conn)
+
+    jobs = fetchData.plan_jobs(conn, ['AAA', 'BBB'], end_date=end, page_days=10)
+    # A middle page of one symbol and the first page of the other fail
+    handler.broken = {('AAA', epoch(jobs[1][1])), ('BBB', epoch(jobs[3][1]))}
+    fetchData.fetch_and_store(conn, client, jobs)
+    assert price_store.last_timestamp(conn, 'AAA') == epoch(pd.Timestamp('2024-01-10'))
+    assert price_store.last_timestamp(conn, 'BBB') == epoch(pd.Timestamp('2023-12-31'))
+
+    handler.broken = set()
+    retry = fetchData.plan_jobs(conn, ['AAA', 'BBB'], end_date=end, page_days=10)
+    assert {(symbol, start) for symbol, start, _ in retry} == {
+        ('AAA', pd.Timestamp('2024-01-11')), ('AAA', pd.Timestamp('2024-01-21')),
+        ('BBB', pd.Timestamp('2024-01-01')), ('BBB', pd.Timestamp('2024-01-11')), ('BBB', pd.Timestamp('2024-01-21'))}
+    fetchData.fetch_and_store(conn, client, retry)
+    for symbol in ('AAA', 'BBB'):
+        assert price_store.last_timestamp(conn, symbol) == epoch(pd.Timestamp('2024-01-30'))
+        assert conn.execute("SELECT COUNT(*) FROM prices WHERE symbol = ?", (symbol,)).fetchone()[0] == 30
+    conn.close()
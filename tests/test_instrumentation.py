@@ -0,0 +1,72 @@
+import json
+import threading
+
+import pytest
+
+import instrumentation
+
+
+@pytest.fixture
+def metrics_path(tmp_path, monkeypatch):
+    # Leave the module as it was and keep the exit hook out of the test run
+    for name in ('_config', '_stages', '_counters', '_profile'):
+        monkeypatch.setattr(instrumentation, name, {})
+    monkeypatch.setattr(instrumentation, 'ENABLED', False)
+    monkeypatch.setattr(instrumentation.atexit, 'register', lambda fn: None)
+    path = tmp_path / 'metrics.jsonl'
+    instrumentation.configure(str(path))
+    return path
+
+
+def records(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_reset_flushes_write_each_cycle_once(metrics_path):
+    for rows in (3, 5):
+        with instrumentation.stage('store') as stage:
+            stage.add(rows=rows)
+        instrumentation.count('pages')
+        instrumentation.flush(reset=True)
+    # The exit flush has nothing new to write
+    instrumentation.flush()
+    cycles = records(metrics_path)
+    assert [c['stages']['store']['calls'] for c in cycles] == [1, 1]
+    assert [c['stages']['store']['counts']['rows'] for c in cycles] == [3, 5]
+    assert [c['counters']['pages'] for c in cycles] == [1, 1]
+
+
+def test_exit_flush_writes_work_after_the_last_cycle(metrics_path):
+    with instrumentation.stage('fetch'):
+        pass
+    instrumentation.flush(reset=True)
+    with instrumentation.stage('render'):
+        pass
+    instrumentation.flush()
+    assert [sorted(c['stages']) for c in records(metrics_path)] == [['fetch'], ['render']]
+
+
+@pytest.mark.parametrize('profiler', ['cprofile', 'tracemalloc'])
+def test_profiles_one_pass_at_a_time(metrics_path, monkeypatch, tmp_path, profiler):
+    monkeypatch.chdir(tmp_path)
+    instrumentation.configure(str(metrics_path), profile_stage='parse', profiler=profiler)
+    entered, release = threading.Event(), threading.Event()
+
+    def worker():
+        with instrumentation.stage('parse'):
+            entered.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    entered.wait(5)
+    # A second pass while the worker is being profiled runs unprofiled
+    with instrumentation.stage('parse') as other:
+        assert not other.profiled
+    release.set()
+    thread.join()
+    with instrumentation.stage('parse') as later:
+        assert later.profiled
+    instrumentation.flush()
+    assert records(metrics_path)[-1]['stages']['parse']['calls'] == 3
+    assert not instrumentation._profile_lock.locked()
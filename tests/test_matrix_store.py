@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+import matrix_store
+import price_store
+import rolling_state
+
+FIRST_DAY = 19723
+
+
+def bars(symbol, days, price):
+    return [(symbol, day * price_store.SECONDS_PER_DAY, day, float(price(day)))
+            + (None,) * (len(price_store.QUOTE_FIELDS) - 1) for day in days]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = price_store.connect(str(tmp_path / 'prices.db'))
+    yield conn
+    conn.close()
+
+
+def assert_matches_database(store, conn):
+    days, symbols, values = store.array()
+    for j, symbol in enumerate(symbols):
+        stored = dict(conn.execute("SELECT day, price FROM prices WHERE symbol = ?", (symbol,)).fetchall())
+        expected = np.array([stored.get(int(day), np.nan) for day in days], dtype='float32')
+        np.testing.assert_array_equal(values[:, j], expected)
+
+
+def test_backfilled_and_revised_bars_reach_the_matrix(conn, tmp_path):
+    # Days 100-109 are missing, as after a failed page
+    days = [FIRST_DAY + d for d in range(120) if not 100 <= d < 110]
+    price_store.upsert_rows(conn, bars('SOL', days, lambda day: day - FIRST_DAY + 1.0))
+    price_store.upsert_rows(conn, bars('BONK', range(FIRST_DAY, FIRST_DAY + 120), lambda day: 2.0))
+    store = matrix_store.MatrixStore(str(tmp_path / 'matrix'))
+    store.rebuild(conn)
+    assert_matches_database(store, conn)
+    assert store.sync(conn) == 0
+
+    # The failed page is fetched on the next run
+    price_store.upsert_rows(conn, bars('SOL', range(FIRST_DAY + 100, FIRST_DAY + 110), lambda day: 0.5))
+    assert store.sync(conn) == 20
+    assert_matches_database(store, conn)
+
+    # A revised bar well before the last synced day
+    price_store.upsert_rows(conn, bars('BONK', [FIRST_DAY + 115], lambda day: 3.0))
+    assert store.sync(conn) == 5
+    assert_matches_database(store, conn)
+    assert store.sync(conn) == 0
+
+
+def test_marks_are_kept_per_consumer(conn, tmp_path):
+    price_store.upsert_rows(conn, bars('SOL', range(FIRST_DAY, FIRST_DAY + 40), lambda day: day - FIRST_DAY + 1.0))
+    store = matrix_store.MatrixStore(str(tmp_path / 'matrix'))
+    store.rebuild(conn)
+    rolling_state.update(conn, ['SOL'])
+    price_store.upsert_rows(conn, bars('SOL', [FIRST_DAY + 10], lambda day: 7.0))
+    # The rolling state catching up first leaves the matrix store's mark in place
+    rolling_state.update(conn, ['SOL'])
+    assert store.sync(conn) == 30
+    assert_matches_database(store, conn)
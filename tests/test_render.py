@@ -0,0 +1,38 @@
+import os
+
+import matplotlib
+import numpy as np
+import pandas as pd
+import pytest
+
+import charts
+import render
+
+
+def job(directory, name, chart='rolling_returns_chart'):
+    frame = pd.DataFrame(np.linspace(-1, 1, 60).reshape(20, 3), index=pd.date_range('2023-10-20', periods=20),
+                         columns=['SOL', 'BONK', 'ORCA'])
+    return render.RenderJob(chart, frame, os.path.join(directory, name), window_size=7)
+
+
+def test_in_process_render_keeps_global_state(tmp_path):
+    backend = matplotlib.get_backend()
+    matplotlib.use('svg')
+    try:
+        rendered, _ = render.render_all([job(tmp_path, 'a.png')], workers=1, directory=tmp_path)
+        assert rendered == [os.path.join(tmp_path, 'a.png')]
+        assert not charts.HEADLESS
+        assert matplotlib.get_backend() == 'svg'
+    finally:
+        matplotlib.use(backend)
+
+
+def test_manifest_keeps_the_charts_that_rendered(tmp_path):
+    good = job(tmp_path, 'good.png')
+    bad = job(tmp_path, 'bad.png', chart='no_such_chart')
+    with pytest.raises(AttributeError):
+        render.render_all([bad, good], workers=1, directory=tmp_path)
+    assert render.load_manifest(tmp_path) == {good.path: good.digest()}
+    # The next run skips the chart that rendered and only retries the other
+    rendered, skipped = render.render_all([good], workers=1, directory=tmp_path)
+    assert (rendered, skipped) == ([], [good.path])
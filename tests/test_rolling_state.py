@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import pipeline
+import price_store
+import rolling_state
+
+DAY = price_store.SECONDS_PER_DAY
+FIRST_DAY = 19723  # 2024-01-01
+
+
+def bars(symbol, days, prices):
+    return [(symbol, day * DAY, day) + (price,) + (None,) * (len(price_store.QUOTE_FIELDS) - 1)
+            for day, price in zip(days, prices)]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = price_store.connect(str(tmp_path / 'prices.db'))
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def history():
+    rng = np.random.default_rng(3)
+    prices = np.exp(np.cumsum(rng.normal(0, 0.05, 80)))
+    days = np.arange(FIRST_DAY, FIRST_DAY + 80)
+    # A gap of a few days, as when the API has no quotes
+    keep = (days < FIRST_DAY + 40) | (days > FIRST_DAY + 43)
+    return [int(d) for d in days[keep]], [float(p) for p in prices[keep]]
+
+
+def expected(conn, symbol, window, stat):
+    prices = pd.read_sql("SELECT day, price FROM prices WHERE symbol = ? ORDER BY day", conn, params=[symbol])
+    series = pd.Series(prices['price'].to_numpy(), index=pd.to_datetime(prices['day'] * DAY, unit='s'))
+    returns = series.asfreq('D').pct_change(fill_method=None)
+    return getattr(returns.rolling(window), stat)().reindex(series.index)
+
+
+def assert_matches_pandas(conn, symbol='AAA'):
+    for window in rolling_state.WINDOWS:
+        for stat in ('mean', 'std'):
+            actual = rolling_state.rolling_frame(conn, [symbol], window, stat)[symbol]
+            reference = expected(conn, symbol, window, stat)
+            np.testing.assert_array_equal(actual.index, reference.index)
+            np.testing.assert_allclose(actual.to_numpy(), reference.to_numpy(), rtol=0, atol=1e-12)
+
+
+def test_incremental_appends_match_pandas(conn, history):
+    days, prices = history
+    for start in range(0, len(days), 9):
+        price_store.upsert_rows(conn, bars('AAA', days[start:start + 9], prices[start:start + 9]))
+        rolling_state.update(conn, ['AAA'])
+    assert_matches_pandas(conn)
+
+
+def test_revised_and_backfilled_bars_are_applied(conn, history):
+    days, prices = history
+    price_store.upsert_rows(conn, bars('AAA', days, prices))
+    rolling_state.update(conn, ['AAA'])
+    # Revise a bar well inside the consumed history
+    price_store.upsert_rows(conn, bars('AAA', days[20:21], [prices[20] * 1.5]))
+    assert rolling_state.update(conn, ['AAA']) == {'AAA': len(days)}
+    assert_matches_pandas(conn)
+    # Backfill the gap, together with a new bar at the end
+    gap = [FIRST_DAY + 41, FIRST_DAY + 42, days[-1] + 1]
+    price_store.upsert_rows(conn, bars('AAA', gap, [2.0, 2.1, 2.2]))
+    rolling_state.update(conn, ['AAA'])
+    assert_matches_pandas(conn)
+    # Caught up: nothing left to replay
+    assert rolling_state.update(conn, ['AAA']) == {'AAA': 0}
+
+
+def test_rolling_frame_of_no_symbols_is_empty(conn):
+    frame = rolling_state.rolling_frame(conn, [], 7, 'mean')
+    assert frame.empty and frame.columns.name == 'symbol'
+
+
+def test_pipeline_reads_current_stats_and_computes_stale_ones(conn, history, tmp_path, monkeypatch):
+    days, prices = history
+    price_store.upsert_rows(conn, bars('AAA', days, prices))
+    rolling_state.update(conn, ['AAA'])
+    reader = price_store.connect(str(tmp_path / 'prices.db'), readonly=True)
+
+    def rolling_std():
+        return pipeline.prices(reader).select(['AAA']).returns().rolling(7).std().to_frame()['AAA']
+
+    computed = []
+    compute = pipeline.apply_step
+    monkeypatch.setattr(pipeline, 'apply_step', lambda step, frame: computed.append(step[0]) or compute(step, frame))
+    persisted = rolling_std()
+    assert 'rolling' not in computed
+    np.testing.assert_allclose(persisted.to_numpy(), expected(conn, 'AAA', 7, 'std').reindex(persisted.index),
+                               rtol=0, atol=1e-12)
+
+    # A revision the rolling state has not consumed yet is computed instead
+    price_store.upsert_rows(conn, bars('AAA', days[20:21], [prices[20] * 1.5]))
+    recomputed = rolling_std()
+    assert 'rolling' in computed
+    np.testing.assert_allclose(recomputed.to_numpy(), expected(conn, 'AAA', 7, 'std').reindex(recomputed.index),
+                               rtol=0, atol=1e-12)
+    reader.close()
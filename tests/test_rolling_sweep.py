@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import analytics
+import rolling_sweep
+
+
+@pytest.fixture
+def returns():
+    rng = np.random.default_rng(3)
+    index = pd.date_range('2024-01-01', periods=60, freq='D')
+    frame = pd.DataFrame(rng.normal(0, 0.03, (60, 3)), index=index, columns=['AAA', 'BBB', 'CCC'])
+    frame.iloc[:10, 1] = np.nan
+    # A missing day, so the sweep has to run on the daily calendar
+    return frame.drop(index[25])
+
+
+@pytest.mark.parametrize('window', [0, -3, 2.5])
+def test_rejects_bad_windows(returns, window):
+    with pytest.raises(ValueError, match='at least 1'):
+        rolling_sweep.sweep(returns, [7, window])
+
+
+@pytest.mark.parametrize('stat', ['mean', 'std'])
+def test_daily_sweep_matches_pipeline_rolling_in_float64(returns, stat):
+    frames = rolling_sweep.daily_sweep(returns, [1, 7, 30], stat)
+    for window, frame in zip([1, 7, 30], frames):
+        expected = analytics.on_daily_calendar(lambda f: analytics.rolling(f, window, stat), returns)
+        assert frame.dtypes.eq('float64').all()
+        pd.testing.assert_frame_equal(frame, expected, rtol=0, atol=1e-13)
@@ -0,0 +1,74 @@
+import json
+import threading
+import http.client
+
+import numpy as np
+import pytest
+
+import price_store
+import service
+
+FIRST_DAY = 19000
+N_DAYS = service.CHUNK_ROWS + 500
+
+
+@pytest.fixture
+def server(tmp_path):
+    path = str(tmp_path / 'prices.db')
+    conn = price_store.connect(path)
+    prices = np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.02, N_DAYS)))
+    price_store.upsert_rows(conn, [('SOL', day * price_store.SECONDS_PER_DAY, day, float(price))
+                                   + (None,) * (len(price_store.QUOTE_FIELDS) - 1)
+                                   for day, price in zip(range(FIRST_DAY, FIRST_DAY + N_DAYS), prices)])
+    conn.close()
+    pool = service.ConnectionPool(path, 2)
+    metrics = service.MetricService(pool, service.LRUCache())
+    httpd = service.ThreadingHTTPServer(('127.0.0.1', 0), service.make_handler(metrics))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield metrics, httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+    pool.close()
+
+
+def get(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request('GET', path)
+    response = conn.getresponse()
+    body = response.read()
+    conn.close()
+    return response, json.loads(body)
+
+
+def test_large_ranges_are_streamed_and_then_cached(server):
+    metrics, port = server
+    response, body = get(port, '/metrics/returns?tokens=SOL')
+    assert response.status == 200
+    assert response.getheader('Transfer-Encoding') == 'chunked'
+    assert len(body['rows']) == N_DAYS
+    # The second answer comes from the cache and is identical
+    response, cached = get(port, '/metrics/returns?tokens=SOL')
+    assert metrics.cache.hits == 1
+    assert cached == body
+
+
+def test_small_ranges_have_a_content_length(server):
+    _, port = server
+    response, body = get(port, '/metrics/volatility?tokens=SOL&start=2022-02-01&end=2022-02-28&window=7')
+    assert response.getheader('Content-Length') is not None
+    assert len(body['rows']) == 28
+
+
+def test_unexpected_errors_answer_500(server, monkeypatch):
+    metrics, port = server
+
+    def broken(*args):
+        raise KeyError('boom')
+
+    monkeypatch.setattr(metrics, 'compute', broken)
+    response, body = get(port, '/metrics/returns?tokens=SOL')
+    assert response.status == 500
+    assert body == {'error': 'Internal server error'}
+    # The server keeps answering
+    response, _ = get(port, '/tokens')
+    assert response.status == 200
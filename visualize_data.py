@@ -1,49 +1,20 @@
-import sqlite3
-import pandas as pd
 import matplotlib.pyplot as plt
-import ast
 import matplotlib.dates as mdates
+import loader
+import price_store
 
-# Connect to the SQLite database
-conn = sqlite3.connect('crypto_data.db')
+# Connect to the SQLite database (read-only, so a running fetch is never blocked)
+conn = price_store.connect('crypto_data.db', readonly=True)
 
 # Define the tickers you want to visualize
-tickers = [
-    'ATLAS', 'POLIS', 'RNDR', 'PSY', 'ORCA',
-    'HNT', 'SOL', 'MNGO', 'SBR', 'RAY', 'BONK'
-]
+tickers = loader.TICKERS
 
-# Initialize an empty DataFrame to hold all the percentage changes
-all_pct_changes = pd.DataFrame()
+# Load every ticker in one query as a date x token price matrix
+prices = loader.load_price_matrix(conn, tickers)
+loader.report_missing(tickers, prices.columns)
 
-# Loop through each ticker and fetch the data
-for ticker in tickers:
-    try:
-        query = f"SELECT timestamp, quote FROM {ticker} ORDER BY timestamp"
-        df = pd.read_sql(query, conn, parse_dates=['timestamp'])
-        print(f"Data for {ticker}:\n", df.head())  # Debug: Check data retrieval
-        
-        # Extract the closing price from the 'quote' dictionary
-        df['close'] = df['quote'].apply(lambda x: ast.literal_eval(x)['USD']['price'])
-        
-        # Calculate the percentage change day-over-day
-        df['pct_change'] = df['close'].pct_change() * 100  # Convert to percentage
-        print(f"Percentage changes for {ticker}:\n", df['pct_change'].head())  # Debug: Check percentage calculation
-        
-        # Add the percentage change to the all_pct_changes DataFrame
-        df.set_index('timestamp', inplace=True)
-        all_pct_changes[ticker] = df['pct_change']
-    
-    except pd.io.sql.DatabaseError:
-        print(f"No table found for {ticker}. Skipping...")
-        continue
-    
-    except KeyError as e:
-        print(f"KeyError for {ticker}: {e}. Skipping this token.")
-        continue
-
-# Debug: Check the combined DataFrame before plotting
-print("Combined percentage changes data:\n", all_pct_changes.head())
+# Calculate the percentage change day-over-day for all tokens at once
+all_pct_changes = prices.pct_change(fill_method=None) * 100  # Convert to percentage
 
 # Plotting the data
 plt.figure(figsize=(14, 8))
@@ -1,75 +1,45 @@
-import sqlite3
-import pandas as pd
-import matplotlib.pyplot as plt
-import ast
-import matplotlib.dates as mdates
+import argparse
+import loader
+import price_store
+import charts
+import pipeline
+import rolling_sweep
+
+# Sweep mode: one chart per window, all windows computed by rolling_sweep in one pass
+parser = argparse.ArgumentParser(description='Plot the rolling standard deviation of the daily returns.')
+parser.add_argument('--windows', nargs='+', type=int, metavar='N',
+                    help='Window sizes to sweep, e.g. 7 14 30 90 (default: a single 7-day chart)')
+args = parser.parse_args()
+if args.windows:
+    try:
+        rolling_sweep.check_windows(args.windows)
+    except ValueError as e:
+        parser.error(str(e))
 
-# Connect to the SQLite database
-conn = sqlite3.connect('crypto_data.db')
+# Connect to the SQLite database (read-only, so a running fetch is never blocked)
+conn = price_store.connect('crypto_data.db', readonly=True)
 
 # Define the tickers you want to visualize
-tickers = [
-    'ATLAS', 'POLIS', 'RNDR', 'PSY', 'ORCA',
-    'HNT', 'SOL', 'MNGO', 'SBR', 'RAY', 'BONK'
-]
-
-# Initialize an empty DataFrame to hold the rolling volatility (standard deviation)
-all_volatility = pd.DataFrame()
+tickers = loader.TICKERS
 
 # Set the window size for the rolling standard deviation
 window_size = 7  # You can change this to 14 or another value for a different smoothing effect
-
-# Loop through each ticker and fetch the data
-for ticker in tickers:
-    try:
-        query = f"SELECT timestamp, quote FROM {ticker} ORDER BY timestamp"
-        df = pd.read_sql(query, conn, parse_dates=['timestamp'])
-        
-        # Extract the closing price from the 'quote' dictionary
-        df['close'] = df['quote'].apply(lambda x: ast.literal_eval(x)['USD']['price'])
-        
-        # Calculate the daily returns
-        df['daily_return'] = df['close'].pct_change()  # Daily return as a decimal
-        
-        # Calculate the rolling standard deviation of the returns (volatility)
-        df['volatility'] = df['daily_return'].rolling(window=window_size).std() * 100  # Convert to percentage
-        
-        # Add the volatility data to the all_volatility DataFrame
-        df.set_index('timestamp', inplace=True)
-        all_volatility[ticker] = df['volatility']
-    
-    except pd.io.sql.DatabaseError:
-        print(f"No table found for {ticker}. Skipping...")
-        continue
-    
-    except KeyError as e:
-        print(f"KeyError for {ticker}: {e}. Skipping this token.")
-        continue
-
-# Drop rows with NaN values (which occur due to the rolling std calculation)
-all_volatility.dropna(inplace=True)
-
-# Creating the volatility plot
-plt.figure(figsize=(14, 8))
-for ticker in all_volatility.columns:
-    plt.plot(all_volatility.index, all_volatility[ticker], label=ticker)
-
-# Format the x-axis dates for better readability
-plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-plt.gca().xaxis.set_major_locator(mdates.DayLocator(interval=5))  # Show every 5th day
-plt.gcf().autofmt_xdate()  # Rotate the x-axis dates for better readability
-
-plt.title(f'{window_size}-Day Rolling Volatility (Standard Deviation) of Cryptocurrencies')
-plt.xlabel('Date')
-plt.ylabel(f'{window_size}-Day Rolling Volatility (%)')
-plt.legend(loc='upper left')
-plt.grid(True)
-
-# Save the plot to the main directory
-plt.savefig(f'crypto_{window_size}day_rolling_volatility.png')
-
-# Show the plot
-plt.show()
+windows = args.windows or [window_size]
+
+# Rolling standard deviation of the daily returns (volatility), in percent, for every
+# window. Rows where no token has a value yet (which occur due to the rolling std
+# calculation) are dropped; each token keeps its own valid window.
+daily_returns = pipeline.prices(conn).select(tickers).returns()
+if args.windows:
+    returns = daily_returns.to_frame()
+    results = [(frame * 100).dropna(how='all') for frame in rolling_sweep.daily_sweep(returns, windows, 'std')]
+else:
+    results = [daily_returns.rolling(window_size).std().pct().dropna().to_frame()]
+loader.report_missing(tickers, results[0].columns)
+
+# Create, save and show the volatility plot of every window
+for window_size, all_volatility in zip(windows, results):
+    charts.rolling_volatility_chart(all_volatility, window_size)
 
 # Close the SQLite connection
 conn.close()